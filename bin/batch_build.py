@@ -0,0 +1,269 @@
+"""Build several websites which share lessons, in one process.
+
+    python bin/batch_build.py ../workshop-a ../workshop-b ../course/_config.yml --sites 4
+
+Each site is given as its root directory, or its _config.yml. When the sites
+are built one at a time, each of them looks up, clones and parses every one of
+its lessons, so a lesson used by ten sites is fetched ten times. Instead:
+
+    1. the config of every site is loaded and checked, so a mistake in any of
+       them is found before anything is fetched
+    2. the repository and branch of each lesson are looked up once, and each
+       (lesson, commit) is cloned once, into the lesson cache
+    3. the schedule.html and setup.md of each lesson are parsed once
+    4. the sites are built in parallel, each in a process of its own (the
+       build scripts work in the current directory). The processes are forked
+       from this one, so they share the lessons which have been looked up and
+       parsed, and restore the lessons from the cache without any network
+       access
+
+So the time to fetch and parse the lessons grows with the number of different
+lessons, rather than the number of lessons in every site. The options are the
+same as build.py, and apply to every site.
+"""
+
+import os
+import sys
+import shutil
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+import build
+import get_submodules
+from github_resolver import GitHubResolver
+from lesson_cache import LessonCache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE
+from schedule_table import parse_schedules
+from clean_setup_md import clean_setup_file
+from lesson_pack import pack_path, REVEAL_JS_PACK
+from validate_config import ConfigError, validate_config
+from site_config import load_config
+
+log = logging.getLogger(__name__)
+
+# The resolver which has looked up every lesson. It is set before the sites are
+# built, so the processes which build the sites inherit it
+_resolver = None
+
+
+def site_directory(path):
+    """Get the root directory of a site from its directory or _config.yml."""
+    path = Path(path).resolve()
+    return path.parent if path.is_file() else path
+
+
+def load_sites(paths):
+    """Load and check the config of each site.
+
+    Parameters
+    ----------
+    paths: list[str]
+        The root directory, or _config.yml, of each site.
+
+    Returns
+    -------
+    sites: list[tuple[pathlib.Path, dict]]
+        The root directory and config of each site.
+
+    Raises
+    ------
+    ConfigError
+        If there are problems with any of the configs, with all of them listed.
+    """
+    sites = []
+    errors = []
+
+    for path in paths:
+        directory = site_directory(path)
+        if not (directory / "_config.yml").is_file():
+            errors.append(f"{directory}: there is no _config.yml")
+            continue
+        website_config = load_config(directory / "_config.yml")
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            errors += [f"{directory}: {error}" for error in validate_config(website_config, check_schedules=False)]
+        finally:
+            os.chdir(cwd)
+        sites.append((directory, website_config))
+
+    if errors:
+        raise ConfigError(errors)
+
+    return sites
+
+
+def fetch_lessons(sites, args):
+    """Look up and fetch every lesson used by the sites, once each.
+
+    Each (lesson, commit) which is not already in the lesson cache is cloned
+    into it, and then the schedule and setup of each lesson are parsed. The
+    lessons which have a lesson pack are left to each site to extract.
+
+    Parameters
+    ----------
+    sites: list[tuple[pathlib.Path, dict]]
+        The root directory and config of each site, from load_sites.
+    args: argparse.Namespace
+        The options of the build.
+
+    Returns
+    -------
+    resolver: GitHubResolver
+        The resolver, which has looked up every lesson.
+    stats: dict
+        The number of lessons used by all of the sites ("lessons"), the number
+        of "unique" lessons and the number which were "fetched".
+    """
+    workers = max(1, args.workers)
+    resolver = GitHubResolver(get_submodules.get_http_session(workers), args.api_url, args.git_url,
+                              Path(args.cache_dir) / "http")
+    cache = LessonCache(args.cache_dir, args.cache_size * 1024 ** 2)
+    mode = "-sparse" if args.sparse else ""
+
+    lessons_info = [
+        (n, lesson_info) for _, website_config in sites for n, lesson_info in enumerate(website_config["lessons"])
+        if lesson_info.get("type", None) in ["episode", "episode_r"]
+        and not (args.packs and pack_path(args.packs, lesson_info["gh-name"]).is_file())
+    ]
+
+    def fetch(lesson):
+        key = lesson["commit"] + mode
+        if cache.get(lesson["org"], lesson["name"], key) is not None:
+            return False
+        tmp = Path(tempfile.mkdtemp(prefix=".batch-", dir=cache.directory))
+        try:
+            get_submodules.fetch_lesson(lesson, args.git_url, args.sparse, path=str(tmp / "repo"))
+            cache.put(lesson["org"], lesson["name"], key, tmp / "repo")
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return True
+
+    def fetch_reveal():
+        key = get_submodules.REVEAL_JS_COMMIT + mode
+        if args.packs and pack_path(args.packs, REVEAL_JS_PACK).is_file():
+            return
+        if cache.get("hakimel", "reveal.js", key) is not None:
+            return
+        tmp = Path(tempfile.mkdtemp(prefix=".batch-", dir=cache.directory))
+        try:
+            get_submodules.fetch_reveal_js(args.git_url, args.sparse, path=str(tmp / "repo"))
+            cache.put("hakimel", "reveal.js", key, tmp / "repo")
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def parse(lesson):
+        path = cache.get(lesson["org"], lesson["name"], lesson["commit"] + mode)
+        if (path / "_includes/rsg/schedule.html").is_file():
+            with open(path / "_includes/rsg/schedule.html", "r") as fp:
+                parse_schedules(fp.read())
+        if (path / "setup.md").is_file():
+            clean_setup_file(path / "setup.md")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        reveal_js = executor.submit(fetch_reveal)
+        resolver.prefetch([
+            (lesson_info.get("org-name", get_submodules.DEFAULT_ORG), lesson_info.get("gh-name", None))
+            for _, lesson_info in lessons_info
+        ], executor)
+        lessons = [get_submodules.resolve_lesson(resolver, *item) for item in lessons_info]
+        unique = list({(lesson["org"], lesson["name"], lesson["commit"]): lesson for lesson in lessons}.values())
+        fetched = sum(executor.map(fetch, unique))
+        reveal_js.result()
+        list(executor.map(parse, unique))
+
+    return resolver, {"lessons": len(lessons), "unique": len(unique), "fetched": fetched}
+
+
+def build_site(directory, website_config, args):
+    """Build a site, in a process of its own.
+
+    Returns
+    -------
+    results: dict[str, str]
+        Whether each stage was "run", "skipped" or "not selected".
+    """
+    os.chdir(directory)
+    return build.build(website_config, args, resolver=_resolver)
+
+
+def batch_build(sites, args):
+    """Build every site, sharing the lessons between them.
+
+    Parameters
+    ----------
+    sites: list[tuple[pathlib.Path, dict]]
+        The root directory and config of each site, from load_sites.
+    args: argparse.Namespace
+        The options of the build.
+
+    Returns
+    -------
+    results: dict[pathlib.Path, dict | Exception]
+        The results of each site's build, from build.build, or the exception
+        which stopped it.
+    """
+    global _resolver
+
+    if "submodules" in (args.stages or [stage.name for stage in build.STAGES]):
+        _resolver, stats = fetch_lessons(sites, args)
+        print(f"{len(sites)} sites use {stats['lessons']} lessons, of which {stats['unique']} are different "
+              f"({stats['fetched']} fetched)")
+
+    # The sites are built in forked processes, which inherit the resolver and
+    # the parsed lessons
+    results = {}
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=max(1, args.sites), mp_context=context) as executor:
+        futures = {directory: executor.submit(build_site, directory, website_config, args)
+                   for directory, website_config in sites}
+        for directory, future in futures.items():
+            try:
+                results[directory] = future.result()
+            except Exception as e:
+                log.error(f"The build of {directory} failed: {e}")
+                results[directory] = e
+
+    LessonCache(args.cache_dir, args.cache_size * 1024 ** 2).evict()
+
+    return results
+
+
+def main():
+    """Main function of the script.
+
+    Load every site's config, fetch the lessons once, then build the sites.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", metavar="SITE",
+                        help="the root directory, or _config.yml, of each site")
+    parser.add_argument("--sites", type=int, default=os.cpu_count(),
+                        help="the number of sites to build at once")
+    build.add_arguments(parser)
+    args = parser.parse_args()
+    if args.no_cache:
+        parser.error("the sites share the lessons through the lesson cache, so --no-cache can not be used")
+    args.cache_dir = args.cache_dir or DEFAULT_CACHE_DIR
+    args.cache_size = args.cache_size or DEFAULT_CACHE_SIZE
+    args.api_url = args.api_url or get_submodules.GITHUB_API_URL
+    args.git_url = args.git_url or get_submodules.GITHUB_GIT_URL
+    if args.packs:
+        args.packs = os.path.abspath(args.packs)
+
+    logging.basicConfig(level=logging.INFO, format="%(processName)s: %(message)s")
+
+    results = batch_build(load_sites(args.paths), args)
+    for directory, result in results.items():
+        if isinstance(result, Exception):
+            print(f"{directory}: failed")
+        else:
+            print(f"{directory}: " + ", ".join(f"{stage} {outcome}" for stage, outcome in result.items()))
+
+    if any(isinstance(result, Exception) for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,778 @@
+"""Benchmark the build scripts on a synthetic workshop.
+
+A workshop (or course) with many multi-day lessons is generated in a temporary
+directory, and then the scripts are timed against it. Every lesson has a
+schedule table for each day, a setup.md, episodes and figures, and the sizes
+of each can be set on the command line, so the build can be measured from a
+handful of lessons to hundreds.
+
+    schedules   the time to import get_schedules.py, and the time to parse each
+                lesson's schedule.html, against the previous approach of
+                parsing every schedule with both BeautifulSoup and
+                pandas.read_html (only timed if pandas and lxml are installed)
+    render      the time to move each day of every lesson to its start time and
+                render _includes/rsg/schedule.html, against the previous
+                approach of strptime for each row, += and BeautifulSoup's
+                prettify. Use many --lessons and --days for large workshops
+    config      the time to load _config.yml and parse the dates and start
+                times of its lessons, the first time and from the cache on
+                later builds, against each of get_submodules.py,
+                get_schedules.py and clean_setup_md.py parsing it on its own
+    setup       the time to clean up each lesson's setup.md against the
+                previous approach, and clean_setup_md.py when setup.md has to
+                be written and when it is unchanged
+    pipeline    each lesson is committed to a local bare repository, and a fake
+                GitHub API is served on localhost, so bin/build.py can be run
+                end to end without network access. The first build, each stage
+                on its own and a build with nothing to do are timed
+
+The results can be written to a JSON file with --output, and compared with the
+results of a previous run with --compare, to check for regressions.
+
+    python bin/benchmark.py --lessons 50 --days 3
+    python bin/benchmark.py setup --setup-lines 20000
+    python bin/benchmark.py render --lessons 200 --days 5
+    python bin/benchmark.py config --lessons 500
+    python bin/benchmark.py pipeline --kind course --lessons 500 --output after.json --compare before.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import platform
+import tempfile
+import textwrap
+import datetime
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+
+BIN_DIR = Path(__file__).resolve().parent
+ORG = "Southampton-RSG-Training"
+GIT_ENV = {
+    # The lessons are cloned and added as submodules from file:// URLs
+    "GIT_CONFIG_COUNT": "1",
+    "GIT_CONFIG_KEY_0": "protocol.file.allow",
+    "GIT_CONFIG_VALUE_0": "always",
+    "GIT_AUTHOR_NAME": "Benchmark",
+    "GIT_AUTHOR_EMAIL": "benchmark@localhost",
+    "GIT_COMMITTER_NAME": "Benchmark",
+    "GIT_COMMITTER_EMAIL": "benchmark@localhost",
+}
+
+
+def lesson_files(n, n_days=3, n_sessions=8, n_episodes=6, n_figures=10, n_setup_lines=100, figure_kb=20):
+    """Create the files of a synthetic lesson repository.
+
+    Parameters
+    ----------
+    n: int
+        The number of the lesson.
+    n_days: int
+        The number of days, and therefore schedule tables, of the lesson.
+    n_sessions: int
+        The number of rows in each schedule table.
+    n_episodes: int
+        The number of episodes in the lesson. The first episode of each day
+        starts a new day.
+    n_figures: int
+        The number of figures in the lesson. Half of them are the same in
+        every lesson.
+    n_setup_lines: int
+        The number of lines in the lesson's setup.md.
+    figure_kb: int
+        The size of each figure, in KB.
+
+    Returns
+    -------
+    files: dict[str, bytes]
+        The contents of each file, by its path in the repository.
+    """
+    name = f"lesson-{n}"
+    files = {}
+
+    tables = []
+    for day in range(n_days):
+        rows = "".join(
+            f'<tr>\n  <td>{9 + i // 2:02d}:{30 * (i % 2):02d}</td>\n'
+            f'  <td><a href="../{name}/{i:02d}-episode/index.html">Day {day + 1}, session {i}</a></td>\n</tr>\n'
+            for i in range(n_sessions)
+        )
+        tables.append(f'<table class="table table-striped">\n<tr><th>Time</th><th>Session</th></tr>\n{rows}</table>')
+    files["_includes/rsg/schedule.html"] = "\n".join(tables).encode()
+
+    setup = [f"---\ntitle: Setup\nlesson: {name}\n---\n"]
+    for i in range(n_setup_lines // 10):
+        setup.append(f"## Step {i} ##\n\nInstall the software for step {i} of {name}, then check it works.\n"
+                     f"```\n$ tool --version\n```\n### Notes for C# users\n\n- one\n- two\n")
+    files["setup.md"] = "".join(setup).encode()
+
+    per_day = max(1, n_episodes // max(1, n_days))
+    for i in range(n_episodes):
+        start = "start: true\n" if i % per_day == 0 else ""
+        files[f"_episodes/{i + 1:02d}-episode.md"] = (
+            f"---\ntitle: Episode {i + 1}\nteaching: 30\nexercises: 15\n{start}"
+            f"questions:\n- What is step {i}?\nkeypoints:\n- Step {i} of {name}\n---\n"
+            f"![Figure](../fig/{name}-{i % max(1, n_figures)}.png)\n"
+        ).encode()
+
+    for i in range(n_figures):
+        shared = i % 2 == 0
+        seed = f"shared-{i}" if shared else f"{name}-{i}"
+        figure = hashlib.sha256(seed.encode()).digest() * (figure_kb * 32)
+        files[f"fig/{'shared' if shared else name}-{i}.png"] = b"\x89PNG\r\n\x1a\n" + figure
+
+    return files
+
+
+def lesson_entry(n, kind="workshop", n_days=3, start=datetime.date(2022, 1, 10)):
+    """Create the entry of a synthetic lesson in _config.yml.
+
+    Parameters
+    ----------
+    n: int
+        The number of the lesson.
+    kind: str
+        The kind of website, "workshop" or "course". The lessons of a workshop
+        have a date and start time for each day.
+    n_days: int
+        The number of days of the lesson.
+    start: datetime.date
+        The date of the first lesson.
+
+    Returns
+    -------
+    entry: str
+        The YAML for the lesson.
+    """
+    entry = textwrap.dedent(f"""\
+        - title: "Lesson {n}"
+          gh-name: lesson-{n}
+          type: episode
+          branch: gh-pages
+          order: {n + 1}
+        """)
+    if kind == "workshop":
+        dates = [str(start + datetime.timedelta(days=n * n_days + day)) for day in range(n_days)]
+        starts = ['"10:00"'] * n_days
+        entry += f"  date: [{', '.join(dates)}]\n  start-time: [{', '.join(starts)}]\n"
+
+    return entry
+
+
+def write_config(directory, lessons, kind="workshop"):
+    """Write the _config.yml of a synthetic website.
+
+    Parameters
+    ----------
+    directory: str
+        The root directory of the website.
+    lessons: list[str]
+        The YAML entry of each lesson, from lesson_entry.
+    kind: str
+        The kind of website, "workshop" or "course".
+    """
+    with open(Path(directory) / "_config.yml", "w") as fp:
+        fp.write(f"kind: {kind}\ntitle: Benchmark\ncarpentry: rsg\nstartdate: 2022-01-10\nenddate: 2030-01-01\n")
+        fp.write("lessons:\n")
+        fp.write(textwrap.indent("".join(lessons), "  "))
+
+
+def make_workshop(directory, n_lessons=50, n_days=3, n_sessions=8, n_episodes=6, n_setup_lines=100,
+                  kind="workshop", n_figures=10):
+    """Create a synthetic workshop, as it is after get_submodules.py has run.
+
+    Parameters
+    ----------
+    directory: str
+        The directory to create the workshop in.
+    n_lessons: int
+        The number of lessons in the workshop.
+    n_days: int
+        The number of days, and therefore schedule tables, for each lesson.
+    n_sessions: int
+        The number of rows in each schedule table.
+    n_episodes: int
+        The number of episodes in each lesson.
+    n_setup_lines: int
+        The number of lines in each lesson's setup.md.
+    kind: str
+        The kind of website, "workshop" or "course".
+    n_figures: int
+        The number of figures in each lesson.
+    """
+    directory = Path(directory)
+    lessons = []
+
+    for n in range(n_lessons):
+        name = f"lesson-{n}"
+        lessons.append(lesson_entry(n, kind, n_days))
+        files = lesson_files(n, n_days, n_sessions, n_episodes, n_figures, n_setup_lines)
+        for rel, content in files.items():
+            if rel.startswith("_episodes/"):
+                path = directory / "collections" / "_episodes" / f"{name}-lesson" / rel.split("/")[-1]
+            elif rel.startswith("fig/"):
+                path = directory / rel
+            else:
+                path = directory / "_includes" / "rsg" / f"{name}-lesson" / rel.split("/")[-1]
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(content)
+
+    write_config(directory, lessons, kind)
+
+
+def make_repo(path, files, branch="gh-pages"):
+    """Commit files to a new bare git repository.
+
+    Parameters
+    ----------
+    path: pathlib.Path
+        The bare repository to create.
+    files: dict[str, bytes]
+        The contents of each file, by its path in the repository.
+    branch: str
+        The branch to commit to.
+
+    Returns
+    -------
+    commit: str
+        The SHA of the commit.
+    """
+    work = path.with_suffix(".work")
+    for rel, content in files.items():
+        (work / rel).parent.mkdir(parents=True, exist_ok=True)
+        (work / rel).write_bytes(content)
+
+    env = {**os.environ, **GIT_ENV}
+    for command in (["init", "--quiet", "--initial-branch", branch], ["add", "--all"],
+                    ["commit", "--quiet", "--message", "Synthetic lesson"]):
+        subprocess.run(["git", *command], cwd=work, env=env, check=True)
+    subprocess.run(["git", "clone", "--quiet", "--bare", str(work), str(path)], env=env, check=True)
+    subprocess.run(["git", "config", "uploadpack.allowFilter", "true"], cwd=path, check=True)
+    commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=path, check=True, capture_output=True, text=True)
+    shutil.rmtree(work)
+
+    return commit.stdout.strip()
+
+
+def make_lesson_repos(directory, n_lessons=50, n_days=3, n_sessions=8, n_episodes=6, n_setup_lines=100,
+                      kind="workshop", n_figures=10):
+    """Create a synthetic website, and a bare repository for each of its lessons.
+
+    The repositories are in {directory}/git/{org}/{name}.git, including a
+    minimal reveal.js for the slides, and the website is in {directory}/site.
+
+    Parameters
+    ----------
+    directory: str
+        The directory to create the repositories and website in.
+    n_lessons, n_days, n_sessions, n_episodes, n_setup_lines, kind, n_figures
+        As for make_workshop.
+
+    Returns
+    -------
+    git_dir: pathlib.Path
+        The directory of the repositories.
+    site: pathlib.Path
+        The root directory of the website, which is a git repository.
+    reveal_commit: str
+        The commit of reveal.js which the slides use.
+    """
+    directory = Path(directory)
+    git_dir = directory / "git"
+    site = directory / "site"
+    lessons = []
+
+    for n in range(n_lessons):
+        files = lesson_files(n, n_days, n_sessions, n_episodes, n_figures, n_setup_lines)
+        files["slides/index.html"] = b'<link rel="stylesheet" href="reveal.js/css/reveal.css">' \
+                                     b'<script src="reveal.js/js/reveal.js"></script>'
+        make_repo(git_dir / ORG / f"lesson-{n}.git", files)
+        lessons.append(lesson_entry(n, kind, n_days))
+
+    reveal_commit = make_repo(git_dir / "hakimel" / "reveal.js.git",
+                              {"css/reveal.css": b"/* reveal */", "js/reveal.js": b"// reveal"}, branch="master")
+
+    shutil.copytree(BIN_DIR.parent / "_includes", site / "_includes", ignore=shutil.ignore_patterns("rsg"))
+    shutil.copytree(BIN_DIR.parent / "assets", site / "assets")
+    write_config(site, lessons, kind)
+    subprocess.run(["git", "init", "--quiet"], cwd=site, check=True)
+
+    return git_dir, site, reveal_commit
+
+
+class FakeGitHub:
+    """Serve a fake GitHub API for the repositories in a directory.
+
+    GET /repos/{org}/{name} returns 200 if {git_dir}/{org}/{name}.git exists,
+    and 404 otherwise. Each response has an ETag, and a request which sends it
+    back with If-None-Match gets a 304, in the same way as the real API. Use as
+    a context manager, which serves on a free port in a background thread.
+
+    Parameters
+    ----------
+    git_dir: str
+        The directory of the repositories.
+    """
+
+    def __init__(self, git_dir):
+        self.git_dir = Path(git_dir)
+        self.requests = 0
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                fake.requests += 1
+                match = re.match(r"/repos/([^/]+)/([^/]+)$", self.path)
+                status = 200 if match and (fake.git_dir / match[1] / f"{match[2]}.git").is_dir() else 404
+                etag = f'"{hashlib.sha1(f"{self.path} {status}".encode()).hexdigest()}"'
+                body = b"{}"
+                if self.headers.get("If-None-Match") == etag:
+                    status, body = 304, b""
+                self.send_response(status)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        return False
+
+
+def best_of(function, repeat):
+    """Get the shortest time taken to call a function, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def time_import(statement, repeat):
+    """Get the time taken to start Python and run an import statement.
+
+    The import is run in a new interpreter each time, so nothing is already
+    imported. The time to start an interpreter which imports nothing is
+    subtracted.
+    """
+    def run(code):
+        return best_of(lambda: subprocess.run([sys.executable, "-c", code], cwd=BIN_DIR, check=True), repeat)
+
+    return run(statement) - run("pass")
+
+
+def old_parse(html):
+    """Parse a schedule in the same way as get_schedules.py used to."""
+    import pandas
+    from bs4 import BeautifulSoup as bs
+    bs(html, "html.parser")
+    return pandas.read_html(StringIO(html), flavor="lxml")
+
+
+def old_shift(schedule, start):
+    """Move a day of a schedule to a start time, as get_schedules.py used to."""
+    original_start = datetime.datetime.strptime(schedule[0][0], "%H:%M")
+    delta_minutes = divmod((start - original_start).total_seconds(), 60)[0]
+    times = []
+    for time_string, session in schedule:
+        actual_time = datetime.datetime.strptime(time_string, "%H:%M") + datetime.timedelta(minutes=delta_minutes)
+        times.append(f"{actual_time.hour:02d}:{actual_time.minute:02d}")
+
+    return times
+
+
+def old_render(days):
+    """Render schedule.html from (name, title, date, schedule, start) days, as get_schedules.py used to."""
+    from bs4 import BeautifulSoup as bs
+
+    tables = []
+    for name, title, date, schedule, start in days:
+        table = f"""
+                <div class="col-md-6">
+                    <a href="{name}-schedule"><h3>{title}</h3></a>
+                    <h4>{date}</h4>
+                    <table class="table table-striped">
+                """
+        for time_string, (_, session) in zip(old_shift(schedule, start), schedule):
+            table += f"<tr> <td> {time_string} </td>    <td> {session} </td> </tr>\n"
+        table += """
+                    </table>
+                </div>
+                """
+        tables.append(table)
+
+    n_rows = (len(tables) + 1) // 2
+    html = ""
+    for i in range(n_rows):
+        html += "<div class=\"row\">"
+        html += tables[i]
+        if n_rows + i < len(tables):
+            html += tables[n_rows + i]
+        html += "</div>"
+
+    return bs(html, "html.parser").prettify()
+
+
+def old_clean_setup(filename):
+    """Clean up a setup.md in the same way as clean_setup_md.py used to."""
+    with open(filename, "r") as fp:
+        content = fp.read()
+        fp.seek(0)
+        try:
+            head = [next(fp) for _ in range(5)]
+        except StopIteration:
+            head = []
+    content = content.splitlines()
+    if re.findall("---", "\n".join(head)):
+        nfound = 0
+        for i, line in enumerate(content):
+            if line.startswith("---"):
+                nfound += 1
+            if nfound == 2:
+                break
+        content = content[i+1:]
+    for i, line in enumerate(content):
+        if line.startswith("#"):
+            line = line.rstrip("#")
+            nhashes = min(line.count("#") + 2, 5)
+            content[i] = "#" * nhashes + line.lstrip("#")
+
+    return "\n".join(content)
+
+
+def benchmark_setup(directory, args):
+    """Time the assembly of setup.md in a synthetic workshop.
+
+    Returns
+    -------
+    results: list[tuple[str, float, float]]
+        The name of each measurement, and the new and old time in seconds.
+    """
+    import clean_setup_md
+
+    filenames = sorted(Path(directory).glob("_includes/rsg/*-lesson/setup.md"))
+    new_clean = lambda filename: "\n".join(clean_setup_md.relevel_headings(  # noqa: E731
+        clean_setup_md.strip_front_matter(clean_setup_md.read_lines(filename))))
+    results = [(
+        "clean, per lesson",
+        best_of(lambda: [new_clean(filename) for filename in filenames], args.repeat) / len(filenames),
+        best_of(lambda: [old_clean_setup(filename) for filename in filenames], args.repeat) / len(filenames),
+    )]
+
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        Path("setup.md").unlink(missing_ok=True)
+        # The cleaned up files are cached, so the cache is cleared each time
+        # to time the script as it runs in a new process
+        run = lambda: (clean_setup_md.CLEANED.clear(), clean_setup_md.main())  # noqa: E731
+        results.append(("clean_setup_md.py", best_of(run, 1), None))
+        results.append(("  unchanged", best_of(run, args.repeat), None))
+    finally:
+        os.chdir(cwd)
+
+    return results
+
+
+def benchmark_schedules(directory, args):
+    """Time the parsing of the schedules in a synthetic workshop.
+
+    Returns
+    -------
+    results: list[tuple[str, float, float]]
+        The name of each measurement, and the new and old time in seconds. The
+        old time is None if pandas is not installed.
+    """
+    from schedule_table import parse_schedules
+
+    try:
+        import pandas  # noqa: F401
+        import lxml  # noqa: F401
+        have_pandas = True
+    except ImportError:
+        have_pandas = False
+
+    htmls = [path.read_text() for path in sorted(Path(directory).glob("_includes/rsg/*-lesson/schedule.html"))]
+    results = [(
+        "import",
+        time_import("import get_schedules", args.repeat),
+        time_import("import pandas, bs4", args.repeat) if have_pandas else None,
+    )]
+
+    # The parsed schedules are cached, so the uncached function is timed
+    new = best_of(lambda: [parse_schedules.__wrapped__(html) for html in htmls], args.repeat) / len(htmls)
+    old = best_of(lambda: [old_parse(html) for html in htmls], args.repeat) / len(htmls) if have_pandas else None
+    results.append(("parse, per lesson", new, old))
+
+    import get_schedules
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        run = lambda: (parse_schedules.cache_clear(), get_schedules.main())  # noqa: E731
+        results.append(("get_schedules.py", best_of(run, args.repeat), None))
+    finally:
+        os.chdir(cwd)
+
+    return results
+
+
+def benchmark_render(directory, args):
+    """Time moving the schedules to their start times, and rendering schedule.html.
+
+    Returns
+    -------
+    results: list[tuple[str, float, float]]
+        The name of each measurement, and the new and old time in seconds. The
+        old time for rendering is None if bs4 is not installed.
+    """
+    from schedule_table import parse_schedules
+    from schedule_html import DaySchedule, render_index
+
+    try:
+        import bs4  # noqa: F401
+        have_bs4 = True
+    except ImportError:
+        have_bs4 = False
+
+    days = []
+    for path in sorted(Path(directory).glob("_includes/rsg/*-lesson/schedule.html")):
+        name = path.parent.name[:-len("-lesson")]
+        for i, schedule in enumerate(parse_schedules(path.read_text())):
+            days.append((name, f"Day {i + 1}: {name}", f"{10 + i} January 2022", schedule,
+                         datetime.datetime(1900, 1, 1, 9, 30)))
+
+    def new_shift():
+        return [DaySchedule.from_rows(schedule).starting_at(start.hour * 60 + start.minute)
+                for _, _, _, schedule, start in days]
+
+    def new_render():
+        return render_index([day.render(name, title, date) for day, (name, title, date, _, _) in zip(new_shift(), days)])
+
+    results = [(
+        f"shift {len(days)} days",
+        best_of(new_shift, args.repeat),
+        best_of(lambda: [old_shift(schedule, start) for _, _, _, schedule, start in days], args.repeat),
+    ), (
+        "schedule.html",
+        best_of(new_render, args.repeat),
+        best_of(lambda: old_render(days), args.repeat) if have_bs4 else None,
+    )]
+
+    return results
+
+
+def benchmark_config(directory, args):
+    """Time loading _config.yml and its lessons, from the file and from the cache.
+
+    Returns
+    -------
+    results: list[tuple[str, float, float]]
+        The name of each measurement, and the new and old time in seconds.
+    """
+    import yaml
+    import site_config
+
+    path = Path(directory) / "_config.yml"
+    cache = Path(directory) / site_config.CACHE_FILE
+
+    def old_load():
+        # Each script opened _config.yml, and parsed the dates and times itself
+        with open(path) as fp:
+            website_config = yaml.load(fp, site_config.Loader)
+        for lesson in website_config["lessons"]:
+            for date in site_config.as_list(lesson.get("date")):
+                site_config.get_date_object(date)
+            for start in site_config.as_list(lesson.get("start-time")):
+                if start is not None:
+                    site_config.get_time_object(start)
+        return website_config
+
+    def new_load(cached):
+        # As a new process would, without the config or lessons in memory
+        site_config._LOADED.clear()
+        site_config._LESSONS.clear()
+        if not cached:
+            cache.unlink(missing_ok=True)
+        return site_config.get_lessons(site_config.load_config(path))
+
+    def new_build():
+        new_load(True)
+        for _ in range(2):
+            site_config.get_lessons(site_config.load_config(path))
+
+    return [
+        ("first load", best_of(lambda: new_load(False), args.repeat), best_of(old_load, args.repeat)),
+        ("load, cached", best_of(lambda: new_load(True), args.repeat), best_of(old_load, args.repeat)),
+        ("loads in a build", best_of(new_build, args.repeat), best_of(lambda: [old_load() for _ in range(3)], args.repeat)),
+    ]
+
+
+def benchmark_pipeline(directory, args):
+    """Time bin/build.py against local lesson repositories and a fake GitHub API.
+
+    The first build is timed in a fresh copy of the website each time, without
+    the lesson cache, so every lesson is cloned. Then each stage is timed on
+    its own with --force, and finally a build where nothing has changed.
+
+    Returns
+    -------
+    results: list[tuple[str, float, None]]
+        The name of each measurement, and the time in seconds.
+    """
+    from build import STAGES
+
+    git_dir, template, reveal_commit = make_lesson_repos(
+        Path(directory) / "pipeline", args.lessons, args.days, n_episodes=args.episodes,
+        n_setup_lines=args.setup_lines, kind=args.kind, n_figures=args.figures,
+    )
+    site = template.with_name("build")
+    env = {**os.environ, **GIT_ENV, "REVEAL_JS_COMMIT": reveal_commit}
+    env.pop("BUILD_TRACE", None)
+
+    with FakeGitHub(git_dir) as github:
+        def build(*options):
+            command = [sys.executable, str(BIN_DIR / "build.py"), str(site), "--workers", str(args.workers),
+                       "--no-cache", "--api-url", github.url, "--git-url", f"file://{git_dir}", *options]
+            process = subprocess.run(command, env=env, capture_output=True, text=True)
+            if process.returncode != 0:
+                raise RuntimeError(f"{' '.join(command)} failed:\n{process.stderr}")
+
+        def fresh_build():
+            shutil.rmtree(site, ignore_errors=True)
+            shutil.copytree(template, site, symlinks=True)
+            build()
+
+        results = [("first build", best_of(fresh_build, args.repeat), None)]
+        for stage in STAGES:
+            results.append((f"  {stage.name}", best_of(lambda: build("--stages", stage.name, "--force"), args.repeat),
+                            None))
+        results.append(("no-change build", best_of(build, args.repeat), None))
+
+    return results
+
+
+BENCHMARKS = {
+    "schedules": benchmark_schedules,
+    "render": benchmark_render,
+    "config": benchmark_config,
+    "setup": benchmark_setup,
+    "pipeline": benchmark_pipeline,
+}
+
+
+def compare(results, baseline):
+    """Get the change in each measurement from a previous run.
+
+    Parameters
+    ----------
+    results: dict
+        The results of this run, as written by --output.
+    baseline: dict
+        The results of a previous run.
+
+    Returns
+    -------
+    changes: dict[tuple[str, str], float]
+        The ratio of the new time to the previous time, for each benchmark and
+        measurement which is in both runs.
+    """
+    changes = {}
+    for name, measurements in results["results"].items():
+        for measurement, times in measurements.items():
+            previous = baseline.get("results", {}).get(name, {}).get(measurement)
+            if previous and previous["now"]:
+                changes[(name, measurement)] = times["now"] / previous["now"]
+
+    return changes
+
+
+def main():
+    """Main function of the script.
+
+    Create the synthetic workshop, run the benchmarks and print the results.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("benchmarks", nargs="*", metavar="BENCHMARK",
+                        help=f"the benchmarks to run, out of: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--kind", choices=["workshop", "course"], default="workshop",
+                        help="the kind of website to generate")
+    parser.add_argument("--lessons", type=int, default=50, help="the number of lessons in the workshop")
+    parser.add_argument("--days", type=int, default=3, help="the number of days of each lesson")
+    parser.add_argument("--episodes", type=int, default=6, help="the number of episodes in each lesson")
+    parser.add_argument("--figures", type=int, default=10, help="the number of figures in each lesson")
+    parser.add_argument("--setup-lines", type=int, default=2000, help="the number of lines in each setup.md")
+    parser.add_argument("--repeat", type=int, default=5, help="the number of times to repeat each measurement")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="the number of workers for the pipeline benchmark")
+    parser.add_argument("--output", metavar="FILE", help="write the results to FILE as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="compare the results with a previous --output")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark: {name}")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+
+    print(f"{args.lessons} lessons ({args.kind}), {args.days} days, {args.episodes} episodes and {args.figures} "
+          f"figures each, {args.setup_lines} lines of setup (best of {args.repeat})")
+    print(f"{'':20} {'now':>10} {'previously':>12}" + (f" {'vs baseline':>12}" if baseline else ""))
+
+    results = {
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_workshop(directory, args.lessons, args.days, n_episodes=args.episodes, n_setup_lines=args.setup_lines,
+                      kind=args.kind, n_figures=args.figures)
+        for name in args.benchmarks or BENCHMARKS:
+            print(f"{name}:")
+            measurements = results["results"][name] = {}
+            for measurement, new, old in BENCHMARKS[name](directory, args):
+                measurements[measurement.strip()] = {"now": new, "previously": old}
+                change = compare(results, baseline).get((name, measurement.strip())) if baseline else None
+                old = f"{old * 1000:10.2f}ms" if old is not None else f"{'-':>12}"
+                change = f" {change:11.2f}x" if change is not None else (f" {'-':>12}" if baseline else "")
+                print(f"  {measurement:18} {new * 1000:8.2f}ms {old}{change}")
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""Build the generated files for the website in a single process.
+
+The build is made up of stages, which are the other scripts in bin/. Each stage
+declares the stages it depends on, the files it reads (its inputs) and the
+files it writes (its outputs), which make a dependency graph:
+
+    submodules --> knit --> schedules
+               \\        \\-> assets
+                \\-> setup
+    favicons
+
+_config.yml is loaded and checked (see validate_config.py) once, and each stage
+is given its own copy. Stages run as soon as the stages they depend on have
+finished, so independent stages (e.g. favicons and schedules) run in parallel.
+After a stage has run, a hash of its inputs, and of the script itself and the
+modules in bin/ it imports, is written to .build/stages/{stage}.json. On the next build the stage is skipped
+if the hash has not changed and its outputs still exist. The submodules stage
+depends on the state of the lesson repositories rather than local files, so it
+is always run, but it only writes the files which have changed (see
+sync_tree.py). The knit stage is also always run, as it keeps its own hash of
+each episode (see knit_rmd.py), as is the assets stage, which only writes the
+figures which have changed (see fig_assets.py).
+"""
+
+import os
+import ast
+import copy
+import glob
+import json
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from sync_tree import file_hash
+import tracing
+from validate_config import check_config
+from site_config import load_config
+
+log = logging.getLogger(__name__)
+
+BIN_DIR = Path(__file__).resolve().parent
+STAMP_DIR = Path(".build/stages")
+
+
+@dataclass
+class Stage:
+    """A stage of the build.
+
+    Parameters
+    ----------
+    name: str
+        The name of the stage.
+    script: str
+        The script in bin/ which the stage runs.
+    deps: list[str]
+        The stages which have to finish before this stage is run.
+    inputs: list[str]
+        Glob patterns for the files the stage reads.
+    outputs: list[str]
+        Glob patterns for the files the stage writes.
+    always: bool
+        If True, the stage is run even if its inputs have not changed.
+    """
+    name: str
+    script: str
+    deps: list = field(default_factory=list)
+    inputs: list = field(default_factory=list)
+    outputs: list = field(default_factory=list)
+    always: bool = False
+
+
+STAGES = [
+    Stage(
+        "submodules", "get_submodules.py",
+        inputs=["_config.yml"],
+        outputs=["submodules", "collections/_episodes", "_includes/rsg"],
+        always=True,
+    ),
+    Stage(
+        "favicons", "make_favicons.py",
+        inputs=["assets/favicons/rsg/rsg_fav_base.png"],
+        outputs=["assets/favicons/rsg/favicon-*.png", "_data/favicons.json"],
+    ),
+    Stage(
+        "knit", "knit_rmd.py", deps=["submodules"],
+        inputs=["collections/_episodes_rmd/*/*.Rmd", "renv.lock", "*_setup.R"],
+        always=True,
+    ),
+    Stage(
+        "assets", "fig_assets.py", deps=["submodules", "knit"],
+        always=True,
+    ),
+    Stage(
+        "schedules", "get_schedules.py", deps=["submodules", "knit"],
+        inputs=["_config.yml", "_includes/rsg/*-lesson/schedule.html", "_includes/rsg/*-lesson/blurb.txt",
+                "collections/_episodes/*-lesson/*.md"],
+        outputs=["_includes/rsg/schedule.html", "collections/_episodes/*-lesson/00-schedule.md",
+                 "_data/episode_index.json"],
+    ),
+    Stage(
+        "setup", "clean_setup_md.py", deps=["submodules"],
+        inputs=["_config.yml", "_includes/rsg/*-lesson/setup.md"],
+        outputs=["setup.md"],
+    ),
+]
+
+
+def script_modules(script):
+    """Get a script and every module in bin/ which it imports, directly or not.
+
+    Parameters
+    ----------
+    script: str
+        The script in bin/.
+
+    Returns
+    -------
+    modules: list[str]
+        The file names of the script and the modules, in sorted order.
+    """
+    modules = set()
+    scripts = [script]
+    while scripts:
+        name = scripts.pop()
+        if name in modules:
+            continue
+        modules.add(name)
+        # Imports inside functions are included too, as the stage runs them
+        for node in ast.walk(ast.parse((BIN_DIR / name).read_text(encoding="utf-8"))):
+            if isinstance(node, ast.Import):
+                imported = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                imported = [node.module]
+            else:
+                continue
+            scripts += [f"{module.split('.')[0]}.py" for module in imported
+                        if (BIN_DIR / f"{module.split('.')[0]}.py").is_file()]
+
+    return sorted(modules)
+
+
+def inputs_digest(stage):
+    """Get a hash of the inputs of a stage.
+
+    The hash includes the path and contents of every input file, and the
+    contents of the script for the stage and of every module in bin/ it
+    imports, so changing the script, or e.g. schedule_html.py, also causes the
+    stage to be run again.
+
+    Parameters
+    ----------
+    stage: Stage
+        The stage to hash the inputs of.
+
+    Returns
+    -------
+    digest: str
+        The hex digest of the inputs.
+    """
+    sha1 = hashlib.sha1()
+    for module in script_modules(stage.script):
+        sha1.update(f"{module}\0{file_hash(BIN_DIR / module)}\0".encode())
+    paths = sorted({path for pattern in stage.inputs for path in glob.glob(pattern)})
+    for path in paths:
+        if os.path.isfile(path):
+            sha1.update(f"{path}\0{file_hash(path)}\0".encode())
+
+    return sha1.hexdigest()
+
+
+def outputs_exist(stage):
+    """Check that every output of a stage exists.
+
+    Parameters
+    ----------
+    stage: Stage
+        The stage to check.
+
+    Returns
+    -------
+    exist: bool
+        True if each output pattern matches at least one file.
+    """
+    return all(glob.glob(pattern) for pattern in stage.outputs)
+
+
+def read_stamp(stage):
+    """Get the hash of the inputs from when a stage was last run.
+
+    Returns
+    -------
+    digest: str
+        The hex digest, or None if the stage has not been run before.
+    """
+    try:
+        with open(STAMP_DIR / f"{stage.name}.json") as fp:
+            return json.load(fp)["digest"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_stamp(stage):
+    """Record the hash of the inputs of a stage which has just been run.
+
+    The hash is taken after the stage has run, as some stages modify their
+    inputs (get_schedules.py renames the episodes it reads).
+    """
+    STAMP_DIR.mkdir(parents=True, exist_ok=True)
+    with open(STAMP_DIR / f"{stage.name}.json", "w") as fp:
+        json.dump({"digest": inputs_digest(stage)}, fp)
+
+
+def run_stage(stage, website_config, args, resolver=None):
+    """Run the script for a stage.
+
+    Parameters
+    ----------
+    stage: Stage
+        The stage to run.
+    website_config: dict
+        The configuration for the website. The stage is given its own copy, so
+        it is free to modify it.
+    args: argparse.Namespace
+        The command line arguments of the build.
+    resolver: GitHubResolver
+        A resolver shared with the builds of other sites, for the submodules
+        stage (see batch_build.py).
+    """
+    website_config = copy.deepcopy(website_config)
+
+    if stage.name == "submodules":
+        import get_submodules
+        options = ["--workers", str(args.workers)]
+        for option in ("cache_dir", "cache_size", "api_url", "git_url", "packs"):
+            if getattr(args, option) is not None:
+                options += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+        if args.sparse:
+            options.append("--sparse")
+        if args.no_cache:
+            options.append("--no-cache")
+        get_submodules.get_submodules(website_config, get_submodules.parse_args(options), resolver)
+    elif stage.name == "knit":
+        import knit_rmd
+        knit_rmd.knit(args.workers, force=args.force)
+    elif stage.name == "assets":
+        import fig_assets
+        fig_assets.merge_figures(website_config, args.workers, args.fig_variants)
+    elif stage.name == "favicons":
+        import make_favicons
+        make_favicons.main()
+    elif stage.name == "schedules":
+        import get_schedules
+        get_schedules.main(website_config, args.packs)
+    elif stage.name == "setup":
+        import clean_setup_md
+        clean_setup_md.main(website_config, args.packs)
+
+
+def build(website_config, args, stages=STAGES, resolver=None):
+    """Run the stages of the build, in parallel where possible.
+
+    Parameters
+    ----------
+    website_config: dict
+        The configuration for the website.
+    args: argparse.Namespace
+        The command line arguments of the build.
+    stages: list[Stage]
+        Every stage of the build.
+    resolver: GitHubResolver
+        A resolver shared with the builds of other sites, which has already
+        looked up the lessons.
+
+    Returns
+    -------
+    results: dict[str, str]
+        Whether each stage was "run", "skipped" or "not selected".
+    """
+    selected = set(args.stages or [stage.name for stage in stages])
+    unknown = selected - {stage.name for stage in stages}
+    if unknown:
+        raise ValueError(f"Unknown build stage(s): {', '.join(sorted(unknown))}")
+
+    # Stages which were not selected are treated as already being done, so
+    # e.g. "--stages schedules" uses the submodules from a previous build
+
+    results = {stage.name: "not selected" for stage in stages if stage.name not in selected}
+    pending = [stage for stage in stages if stage.name in selected]
+    running = {}
+
+    def run(stage):
+        if not args.force and not stage.always and outputs_exist(stage) and read_stamp(stage) == inputs_digest(stage):
+            log.info(f"Skipping {stage.name}, as its inputs have not changed")
+            return "skipped"
+        log.info(f"Running {stage.name}")
+        with tracing.span(stage.name, "stage"):
+            run_stage(stage, website_config, args, resolver)
+        write_stamp(stage)
+        return "run"
+
+    with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+        while pending or running:
+            for stage in [stage for stage in pending if all(dep in results for dep in stage.deps)]:
+                pending.remove(stage)
+                running[executor.submit(run, stage)] = stage
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    results[stage.name] = future.result()
+                except Exception:
+                    log.error(f"The {stage.name} stage failed")
+                    for other in running:
+                        other.cancel()
+                    raise
+
+    return results
+
+
+def add_arguments(parser):
+    """Add the options of the build to a command line parser.
+
+    Parameters
+    ----------
+    parser: argparse.ArgumentParser
+        The parser to add the options to.
+    """
+    parser.add_argument("--stages", nargs="+", metavar="STAGE", choices=[stage.name for stage in STAGES],
+                        help=f"only run these stages, out of: {', '.join(stage.name for stage in STAGES)}")
+    parser.add_argument("--force", action="store_true",
+                        help="run every stage, even if its inputs have not changed")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="the number of lessons to fetch concurrently")
+    parser.add_argument("--fig-variants", action="store_true",
+                        help="write smaller variants of the large figures to fig/optimised/")
+    parser.add_argument("--sparse", action="store_true",
+                        help="only fetch the files from each lesson which are used by the build")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always clone the lesson repositories")
+    parser.add_argument("--cache-dir", help="the directory to cache lesson repositories in")
+    parser.add_argument("--cache-size", type=int, help="the maximum size of the cache, in MB")
+    parser.add_argument("--api-url", help="the base URL of the GitHub API")
+    parser.add_argument("--git-url", help="the base URL to clone lesson repositories from")
+    parser.add_argument("--packs", help="a directory of lesson packs, to use instead of fetching the lessons they hold")
+
+
+def main():
+    """Main function of the script.
+
+    Load the website config once, then run the stages of the build.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", nargs="?", default=".",
+                        help="the root directory of the website")
+    parser.add_argument("--trace", metavar="FILE", default=os.environ.get(tracing.TRACE_ENV),
+                        help=f"write a Chrome trace of the build to FILE, and print a summary "
+                             f"(default: ${tracing.TRACE_ENV})")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.trace:
+        tracing.enable(os.path.abspath(args.trace))
+    if args.packs:
+        args.packs = os.path.abspath(args.packs)
+    os.chdir(args.directory)
+
+    website_config = load_config()
+
+    # Check the config before any stage fetches or writes anything. The
+    # schedules from the previous build may be stale, so they are checked by
+    # the schedules stage instead
+    check_config(website_config, check_schedules=False)
+
+    results = build(website_config, args)
+    for stage in STAGES:
+        print(f"{stage.name}: {results[stage.name]}")
+
+
+if __name__ == "__main__":
+    main()
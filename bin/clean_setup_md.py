@@ -2,77 +2,190 @@
 
 """
 
-import re
-import yaml
-from enum import Enum
-from dateutil import parser
+import itertools
+from sync_tree import write_if_changed, file_hash
+from lesson_pack import read_manifest
+from site_config import get_lessons, load_config
+import tracing
 
-class LessonType(Enum):
-    """Enum for the different types of lessons.
+# The cleaned up setup.md of each lesson, by the hash of the file, so a lesson
+# which is shared by several sites in a batch build is only cleaned up once
+CLEANED = {}
+
+
+def read_blocks(filename, block_size=1 << 16):
+    """Read a file in blocks of whole lines.
+
+    Parameters
+    ----------
+    filename: str
+        The name of the file to read.
+    block_size: int
+        The approximate number of characters in each block.
+
+    Yields
+    ------
+    lines: list[str]
+        The lines in each block, without their line endings.
+    """
+    with open(filename, "r") as fp:
+        for block in iter(lambda: fp.readlines(block_size), []):
+            yield "".join(block).splitlines()
+
+
+def read_lines(filename):
+    """Read the lines of a file, without reading the whole file at once.
+
+    Parameters
+    ----------
+    filename: str
+        The name of the file to read.
+
+    Returns
+    -------
+    lines: Iterator[str]
+        Each line of the file, without its line ending.
     """
-    markdown = "episode"
-    r_markdown = "episode_r"
+    return itertools.chain.from_iterable(read_blocks(filename))
+
 
+def strip_front_matter(lines, n_head=5):
+    """Remove the front matter from the lines of a markdown file.
 
-def get_yaml_config():
-    """Open the YAML config file for the website.
+    The file is treated as having front matter if "---" appears in its first
+    n_head lines, in which case everything up to and including the second line
+    starting with "---" is removed.
+
+    Parameters
+    ----------
+    lines: Iterable[str]
+        The lines of the file.
+    n_head: int
+        The number of lines to look for front matter in.
 
     Returns
     -------
-    config: dict
-        The configuration for the website.
+    lines: Iterator[str]
+        The lines after the front matter.
     """
+    lines = iter(lines)
+    head = list(itertools.islice(lines, n_head))
+    lines = itertools.chain(head, lines)
+
+    if len(head) == n_head and any("---" in line for line in head):
+        nfound = 0
+        for line in lines:
+            if line.startswith("---"):
+                nfound += 1
+            if nfound == 2:
+                break
+
+    return lines
+
 
-    with open("_config.yml", "r") as fp:
-        config = yaml.load(fp, yaml.Loader)
+def relevel_headings(lines, offset=2, max_level=5):
+    """Make the headings in a markdown file smaller.
 
-    return config
+    Parameters
+    ----------
+    lines: Iterable[str]
+        The lines of the file.
+    offset: int
+        The number of levels to add to each heading.
+    max_level: int
+        The smallest heading level.
+
+    Yields
+    ------
+    line: str
+        The lines, with each heading moved down by offset levels.
+    """
+    for line in lines:
+        if line.startswith("#"):
+            line = line.rstrip("#")
+            text = line.lstrip("#")
+            nhashes = min(len(line) - len(text) + offset, max_level)
+            line = "#" * nhashes + text
+        yield line
 
 
-def get_file_and_head(filename, n_head=5):
-    """Get the contents of a file, and the head.
+def clean_setup_file(filename):
+    """Clean up a setup.md, unless a file with the same contents already has been.
 
     Parameters
     ----------
     filename: str
-        The name of the file to read.
-    n_head: int
-        The number of lines to include in the head.
+        The setup.md to clean up.
+
+    Returns
+    -------
+    content: str
+        The setup.md without its front matter, and with its headings moved
+        down two levels.
     """
-    with open(filename, "r") as fp:
-        content = fp.read()
-        fp.seek(0)
-        try:
-            head = [next(fp) for _ in range(n_head)]
-        except StopIteration:
-            head = []
+    digest = file_hash(filename)
+    if digest not in CLEANED:
+        with tracing.span(filename, "parse"):
+            tracing.count(files_read=1)
+            CLEANED[digest] = "\n".join(relevel_headings(strip_front_matter(read_lines(filename))))
+
+    return CLEANED[digest]
+
+
+def clean_lesson_setup(lesson, packs=None):
+    """Read a lesson's setup.md and clean it up for the workshop's setup.md.
+
+    Parameters
+    ----------
+    lesson: site_config.Lesson
+        The lesson, from _config.yml.
+    packs: str
+        A directory of lesson packs. If the lesson has a pack, the setup.md
+        which was cleaned up when the pack was made is used.
 
-    return content, head
+    Returns
+    -------
+    section: str
+        The section of the workshop's setup.md for the lesson.
+    """
+    manifest = read_manifest(packs, lesson.name) or {}
+    if manifest.get("setup") is not None:
+        content = manifest["setup"]
+    else:
+        content = clean_setup_file(f"_includes/rsg/{lesson.name}-lesson/setup.md")
 
+    return "\n### {}\n\n{}\n".format(lesson.title, content)
 
-def main():
+
+def main(website_config=None, packs=None):
     """Main function of the script.
 
     For each lesson, the setup.md file is read in, cleaned up and then added to
     setup_md_string. This string is then written to a file named setup.md in
-    the root directory, which is included in _includes/rsg/setup.html.
+    the root directory, which is included in _includes/rsg/setup.html. The
+    lessons are added in date (or course) order.
+
+    Parameters
+    ----------
+    website_config: dict
+        The configuration for the website. If None, it is read from _config.yml.
+    packs: str
+        A directory of lesson packs, whose cleaned up setup.md is used for the
+        lessons which have a pack.
     """
-    website_config = get_yaml_config()
-    lessons = website_config.get("lessons", None)
+    if website_config is None:
+        website_config = load_config()
+    lessons = get_lessons(website_config)
 
     if website_config.get("kind") == "workshop":
         if not lessons:
             raise ValueError("There are no lessons specified in _config.yml")
+        if any(lesson.first_date is None for lesson in lessons):
+            raise ValueError("The first date of every lesson in _config.yml must be a date")
 
-        for lesson in lessons:
-            date = lesson["date"]
-            if isinstance(date, list):
-                date = date[0]
-            lesson["date"] = parser.parse(date)
-
-        sorted_lessons = sorted(lessons, key=lambda x: x["date"])
+        sorted_lessons = sorted(lessons, key=lambda lesson: lesson.first_date)
     elif website_config.get("kind") == "course":
-        sorted_lessons = sorted(lessons, key=lambda x: x["order"])
+        sorted_lessons = sorted(lessons, key=lambda lesson: lesson.order)
 
     setup_md_string = """
 ## Setup
@@ -87,40 +200,13 @@ more features specifically for coding such as VS Code; there are also IDEs
 specific to languages will be listed in the appropriate section(s) below.
 """
 
-    for lesson in sorted_lessons:
-
-        filename = f"_includes/rsg/{lesson['gh-name']}-lesson/setup.md"
-        content, head = get_file_and_head(filename)
-        content = content.splitlines()
-
-        # First, remove the front matter from the setup.md file
-
-        if re.findall("---", "\n".join(head)):
-            nfound = 0
-            for i, line in enumerate(content):
-                if line.startswith("---"):
-                    nfound += 1
-                if nfound == 2:
-                    break
-            content = content[i+1:]
-
-        # Next, change the depth of the headings
-
-        for i, line in enumerate(content):
-            if line.startswith("#"):
-                line = line.rstrip("#")
-                nhashes = line.count("#") + 2
-                if nhashes > 5:
-                    nhashes = 5
-                line = "#" * nhashes + line.lstrip("#")
-                content[i] = line
+    # The sections are joined in the order of sorted_lessons
 
-        setup_md_string += "\n### {}\n\n{}\n".format(lesson["title"], "\n".join(content))
+    sections = [clean_lesson_setup(lesson, packs) for lesson in sorted_lessons]
 
-    # write out the new setup.md file to the root directory
+    # write out the new setup.md file to the root directory, if it has changed
 
-    with open("setup.md", "w") as fp:
-        fp.write(setup_md_string)
+    write_if_changed("setup.md", setup_md_string + "".join(sections))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,451 @@
+"""Deploy the website to gh-pages, publishing only the files which changed.
+
+    python bin/deploy_tree.py [directory] [--remote origin] [--branch gh-pages] [--dry-run]
+
+Rather than committing everything in the working directory to gh-pages (the
+lesson repositories in submodules/, the build scripts, the build state, ...),
+the deploy tree is made of only the files Jekyll uses to build the site: every
+file, apart from those matched by exclude: in _config.yml and DEPLOY_EXCLUDE,
+which are paths from the root of the website as they are for Jekyll, and those
+with a name in DEPLOY_EXCLUDE_NAMES, in any directory.
+
+Each file is hashed the way git hashes it, so it can be compared with the tree
+of the previous deploy without checking it out. Only the files which are new
+or different are written to the object store, the new tree is made from the
+previous tree with a temporary index, and it is committed on top of the
+previous deploy. Files with the same contents as in the previous deploy are
+not read again, as their hashes are kept in .build/deploy/ with their size
+and modification time, and the push only sends the objects which changed.
+
+The differences from the previous deploy (the files which were added, changed
+and removed, and their sizes) are printed and written to .build/deploy/diff.json.
+--remote can be any git remote or URL, e.g. a local bare repository to try a
+deploy without publishing it.
+"""
+
+import os
+import json
+import stat
+import fnmatch
+import hashlib
+import logging
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from site_config import load_config
+import tracing
+
+log = logging.getLogger(__name__)
+
+STATE_DIR = Path(".build/deploy")
+DEPLOY_REF = "refs/deploy/{branch}"
+
+# Files which are never deployed, as well as those in exclude: in _config.yml,
+# by their path from the root of the website
+DEPLOY_EXCLUDE = [
+    ".github", ".gitmodules", ".build", ".sass-cache", ".jekyll-cache", "_site", "submodules", "bin", "renv/library",
+]
+# Files which are never deployed by their name, in any directory
+DEPLOY_EXCLUDE_NAMES = [".git", "__pycache__", "*.pyc", ".DS_Store", "*~"]
+
+
+def git(*args, input=None, env=None, check=True):
+    """Run a git command, and get its output.
+
+    Parameters
+    ----------
+    args: list[str]
+        The arguments to git.
+    input: str
+        Text to send to the command.
+    env: dict
+        Environment variables to add to those of this process.
+    check: bool
+        If True, raise an exception if the command fails.
+
+    Returns
+    -------
+    output: str
+        The output of the command, without the trailing newline.
+    """
+    process = tracing.run(["git", *args], input=input, env={**os.environ, **(env or {})}, check=check,
+                          capture_output=True, text=True)
+
+    return process.stdout.rstrip("\n")
+
+
+def excluded(rel, patterns, names=()):
+    """Check if a file is excluded from the deploy.
+
+    A pattern excludes a file if it matches the path of the file, or of any of
+    the directories it is in, from the root of the website (so "Makefile" does
+    not exclude docs/Makefile, as with exclude: in Jekyll). A name excludes a
+    file if it matches the name of the file, or of any of its directories.
+
+    Parameters
+    ----------
+    rel: str
+        The path of the file, relative to the root of the website.
+    patterns: list[str]
+        The patterns, e.g. from exclude: in _config.yml.
+    names: list[str]
+        The patterns for the names of files, e.g. DEPLOY_EXCLUDE_NAMES.
+
+    Returns
+    -------
+    excluded: bool
+        True if the file should not be deployed.
+    """
+    parts = rel.split("/")
+    prefixes = ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+    for pattern in patterns:
+        pattern = pattern.rstrip("/")
+        if any(fnmatch.fnmatch(prefix, pattern) for prefix in prefixes):
+            return True
+
+    return any(fnmatch.fnmatch(part, name) for part in parts for name in names)
+
+
+def deploy_files(website_config, root="."):
+    """Get the files which make up the deploy tree.
+
+    Parameters
+    ----------
+    website_config: dict
+        The configuration for the website.
+    root: str
+        The root directory of the website.
+
+    Returns
+    -------
+    files: dict[str, str]
+        The path of each file, relative to root, and its git mode.
+    """
+    patterns = DEPLOY_EXCLUDE + list(website_config.get("exclude") or [])
+    files = {}
+
+    for directory, dirs, filenames in os.walk(root):
+        rel_dir = Path(directory).relative_to(root).as_posix()
+        rel_dir = "" if rel_dir == "." else f"{rel_dir}/"
+        # Links to directories are deployed as links, rather than followed
+        links = [d for d in dirs if os.path.islink(Path(directory, d))]
+        dirs[:] = sorted(d for d in dirs if d not in links and not excluded(rel_dir + d, patterns, DEPLOY_EXCLUDE_NAMES))
+        for name in filenames + links:
+            rel = rel_dir + name
+            if excluded(rel, patterns, DEPLOY_EXCLUDE_NAMES):
+                continue
+            mode = os.lstat(Path(root, rel)).st_mode
+            if stat.S_ISLNK(mode):
+                files[rel] = "120000"
+            elif stat.S_ISREG(mode):
+                files[rel] = "100755" if mode & stat.S_IXUSR else "100644"
+
+    return files
+
+
+def blob_hash(path):
+    """Hash a file the way git hashes a blob.
+
+    Parameters
+    ----------
+    path: str
+        The file, or symbolic link, to hash.
+
+    Returns
+    -------
+    digest: str
+        The hex digest, which is the id of the blob in git.
+    """
+    if os.path.islink(path):
+        content = os.readlink(path).encode()
+    else:
+        with open(path, "rb") as fp:
+            content = fp.read()
+        tracing.count(files_read=1)
+    sha1 = hashlib.sha1(f"blob {len(content)}\0".encode())
+    sha1.update(content)
+
+    return sha1.hexdigest()
+
+
+def read_hashes():
+    """Get the hashes of the files from the previous deploy, by path."""
+    try:
+        with open(STATE_DIR / "hashes.json") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def hash_files(files, root=".", workers=None):
+    """Get the blob hash and size of each file to deploy.
+
+    Files whose size and modification time are the same as when they were last
+    hashed are not read again.
+
+    Parameters
+    ----------
+    files: dict[str, str]
+        The files, from deploy_files.
+    root: str
+        The root directory of the website.
+    workers: int
+        The number of files to hash at once.
+
+    Returns
+    -------
+    hashes: dict[str, tuple[str, int]]
+        The blob hash and size of each file.
+    """
+    previous = read_hashes()
+
+    def entry(rel):
+        st = os.lstat(Path(root, rel))
+        key = [st.st_mtime_ns, st.st_size]
+        if previous.get(rel, [None])[:2] == key:
+            return rel, previous[rel]
+        return rel, key + [blob_hash(Path(root, rel))]
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        entries = dict(executor.map(entry, files))
+
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(STATE_DIR / "hashes.json", "w") as fp:
+        json.dump(entries, fp)
+
+    return {rel: (digest, size) for rel, (_, size, digest) in entries.items()}
+
+
+def fetch_previous(remote, branch):
+    """Fetch the previous deploy, if there is one.
+
+    Parameters
+    ----------
+    remote: str
+        The git remote, or URL, to deploy to.
+    branch: str
+        The branch to deploy to.
+
+    Returns
+    -------
+    commit: str
+        The commit of the previous deploy, or None if the branch does not
+        exist yet.
+    """
+    ref = DEPLOY_REF.format(branch=branch)
+    if not git("ls-remote", "--heads", remote, branch):
+        git("update-ref", "-d", ref, check=False)
+        return None
+    git("fetch", "--quiet", "--no-tags", remote, f"+refs/heads/{branch}:{ref}")
+
+    return git("rev-parse", ref)
+
+
+def tree_entries(commit):
+    """Get the mode, blob hash and size of each file in the tree of a commit.
+
+    Parameters
+    ----------
+    commit: str
+        The commit, or None for an empty tree.
+
+    Returns
+    -------
+    entries: dict[str, tuple[str, str, int]]
+        The mode, blob hash and size of each file, by path.
+    """
+    if commit is None:
+        return {}
+
+    entries = {}
+    output = git("ls-tree", "-r", "-l", "-z", "--full-tree", commit)
+    for line in output.split("\0"):
+        if not line:
+            continue
+        info, path = line.split("\t", 1)
+        mode, kind, digest, size = info.split()
+        if kind == "blob":
+            entries[path] = (mode, digest, int(size))
+
+    return entries
+
+
+def diff_trees(previous, files, hashes):
+    """Compare the deploy tree with the previous deploy.
+
+    Parameters
+    ----------
+    previous: dict[str, tuple[str, str, int]]
+        The files of the previous deploy, from tree_entries.
+    files: dict[str, str]
+        The mode of each file to deploy, from deploy_files.
+    hashes: dict[str, tuple[str, int]]
+        The blob hash and size of each file to deploy, from hash_files.
+
+    Returns
+    -------
+    diff: dict
+        The paths which were "added", "changed" and "removed", the number of
+        "unchanged" files, and the "bytes" of each kind of change.
+    """
+    added = sorted(rel for rel in files if rel not in previous)
+    changed = sorted(rel for rel in files if rel in previous and previous[rel][:2] != (files[rel], hashes[rel][0]))
+    removed = sorted(rel for rel in previous if rel not in files)
+
+    return {
+        "added": added,
+        "changed": changed,
+        "removed": removed,
+        "unchanged": len(files) - len(added) - len(changed),
+        "bytes": {
+            "added": sum(hashes[rel][1] for rel in added),
+            "changed": sum(hashes[rel][1] for rel in changed),
+            "removed": sum(previous[rel][2] for rel in removed),
+        },
+    }
+
+
+def write_tree(previous_commit, diff, files, hashes, root="."):
+    """Write the new and changed files to git, and make the deploy tree.
+
+    Parameters
+    ----------
+    previous_commit: str
+        The commit of the previous deploy, or None.
+    diff: dict
+        The differences from the previous deploy, from diff_trees.
+    files: dict[str, str]
+        The mode of each file to deploy, from deploy_files.
+    hashes: dict[str, tuple[str, int]]
+        The blob hash and size of each file to deploy, from hash_files.
+    root: str
+        The root directory of the website.
+
+    Returns
+    -------
+    tree: str
+        The id of the tree.
+    """
+    new = diff["added"] + diff["changed"]
+
+    # Only the new and changed files are written to the object store
+    regular = [rel for rel in new if files[rel] != "120000"]
+    if regular:
+        written = git("hash-object", "-w", "--no-filters", "--stdin-paths",
+                      input="\n".join(str(Path(root, rel)) for rel in regular) + "\n").split("\n")
+        for rel, digest in zip(regular, written):
+            if digest != hashes[rel][0]:
+                raise RuntimeError(f"{rel} changed while it was being deployed")
+    for rel in new:
+        if files[rel] == "120000":
+            git("hash-object", "-w", "--stdin", input=os.readlink(Path(root, rel)))
+
+    # The tree is made from the previous tree in a temporary index, so the
+    # index of the working directory is left alone
+    index = STATE_DIR / "index"
+    index.unlink(missing_ok=True)
+    env = {"GIT_INDEX_FILE": str(index.resolve())}
+    if previous_commit:
+        git("read-tree", previous_commit, env=env)
+    index_info = [f"0 {'0' * 40}\t{rel}" for rel in diff["removed"]]
+    index_info += [f"{files[rel]} {hashes[rel][0]}\t{rel}" for rel in new]
+    if index_info:
+        git("update-index", "-z", "--index-info", input="\0".join(index_info) + "\0", env=env)
+    tree = git("write-tree", env=env)
+    index.unlink(missing_ok=True)
+
+    return tree
+
+
+def deploy(website_config, remote="origin", branch="gh-pages", message=None, dry_run=False, workers=None):
+    """Deploy the website, if it has changed since the previous deploy.
+
+    Parameters
+    ----------
+    website_config: dict
+        The configuration for the website.
+    remote: str
+        The git remote, or URL, to push the deploy to.
+    branch: str
+        The branch to deploy to.
+    message: str
+        The commit message of the deploy.
+    dry_run: bool
+        If True, only work out the differences, without committing or pushing.
+    workers: int
+        The number of files to hash at once.
+
+    Returns
+    -------
+    diff: dict
+        The differences from the previous deploy, from diff_trees, with the
+        "previous" commit and the new "commit" (which is None if nothing was
+        committed).
+    """
+    with tracing.span("deploy", "copy"):
+        previous_commit = fetch_previous(remote, branch)
+        files = deploy_files(website_config)
+        hashes = hash_files(files, workers=workers)
+        diff = diff_trees(tree_entries(previous_commit), files, hashes)
+        diff["previous"] = previous_commit
+        diff["commit"] = None
+
+        if not dry_run and (diff["added"] or diff["changed"] or diff["removed"] or previous_commit is None):
+            tree = write_tree(previous_commit, diff, files, hashes)
+            source = git("rev-parse", "--short", "HEAD", check=False) or "the working directory"
+            parents = ["-p", previous_commit] if previous_commit else []
+            diff["commit"] = git("commit-tree", tree, *parents, "-m", message or f"Deploy {source}")
+            git("push", "--quiet", remote, f"{diff['commit']}:refs/heads/{branch}")
+            git("update-ref", DEPLOY_REF.format(branch=branch), diff["commit"])
+
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(STATE_DIR / "diff.json", "w") as fp:
+        json.dump(diff, fp, indent=1)
+
+    return diff
+
+
+def main():
+    """Main function of the script.
+
+    Deploy the website, and print the differences from the previous deploy.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", nargs="?", default=".",
+                        help="the root directory of the website")
+    parser.add_argument("--remote", default="origin",
+                        help="the git remote, or URL, to deploy to")
+    parser.add_argument("--branch", default="gh-pages",
+                        help="the branch to deploy to")
+    parser.add_argument("-m", "--message",
+                        help="the commit message of the deploy")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only print the differences from the previous deploy")
+    parser.add_argument("-j", "--workers", type=int,
+                        help="the number of files to hash at once")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    os.chdir(args.directory)
+    website_config = load_config()
+
+    try:
+        diff = deploy(website_config, args.remote, args.branch, args.message, args.dry_run, args.workers)
+    except subprocess.CalledProcessError as e:
+        raise SystemExit(f"{' '.join(e.cmd)} failed:\n{e.stderr}")
+
+    for kind in ("added", "changed", "removed"):
+        for rel in diff[kind]:
+            log.info(f"{kind:8} {rel}")
+    print(f"{len(diff['added'])} added ({diff['bytes']['added']} bytes), "
+          f"{len(diff['changed'])} changed ({diff['bytes']['changed']} bytes), "
+          f"{len(diff['removed'])} removed ({diff['bytes']['removed']} bytes), {diff['unchanged']} unchanged")
+    if diff["commit"]:
+        print(f"Deployed {diff['commit'][:10]} to {args.branch} on {args.remote}")
+    elif not args.dry_run:
+        print(f"{args.branch} on {args.remote} is up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Create an index of the episodes of each lesson for the Liquid templates.
+
+Without an index, the includes (syllabus.html, navbar.html, all_keypoints.html
+and manual_episode_order.html) find each episode by scanning the whole
+collection with `site.episodes | where: "slug", ...`, so the time to render
+the site grows with the square of the number of episodes. Instead, the front
+matter of each episode is read once and written to _data/episode_index.json,
+which the includes read as site.data.episode_index:
+
+    order       the slug of every episode, in the same order as site.episodes
+    episodes    for each slug: the title, url and lesson of the episode, its
+                teaching, exercise and break minutes, its questions and key
+                points, the day it is on and the number of minutes from the
+                start of that day, and the previous and next episode
+    lessons     for each lesson: the slugs of its episodes (without the
+                schedule page), whether it is taught over multiple days and
+                the number of minutes from the start of the last day to the end
+"""
+
+import re
+import json
+import string
+import logging
+from pathlib import Path
+import yaml
+try:
+    from yaml import CLoader as Loader
+except ImportError:
+    from yaml import Loader
+from sync_tree import write_if_changed
+import tracing
+
+log = logging.getLogger(__name__)
+
+EPISODE_DIR = Path("collections/_episodes")
+INDEX_PATH = Path("_data/episode_index.json")
+SCHEDULE_FILE = "00-schedule.md"
+
+
+def read_front_matter(path):
+    """Read the front matter of a file, without reading the rest of the file.
+
+    Parameters
+    ----------
+    path: str
+        The file to read.
+
+    Returns
+    -------
+    front_matter: dict
+        The front matter, or None if the file does not have any, in which case
+        Jekyll does not treat the file as a document.
+    """
+    tracing.count(files_read=1)
+    with open(path, "r", encoding="utf-8") as fp:
+        if fp.readline().rstrip() != "---":
+            return None
+        lines = []
+        for line in fp:
+            if line.rstrip() == "---":
+                break
+            lines.append(line)
+        else:
+            return None
+
+    return yaml.load("".join(lines), Loader) or {}
+
+
+def numbered_names(names, file_ext="md"):
+    """Get the name each episode of a lesson should have, numbered from 01.
+
+    The episodes are numbered in the order they are sorted in, keeping the
+    rest of their name, e.g. 01-intro.md and 03-more.md become 01-intro.md and
+    02-more.md. The schedule (00-schedule.md) is always first, so is not
+    renumbered.
+
+    Parameters
+    ----------
+    names: list[str]
+        The names of the files in the lesson.
+    file_ext: str
+        The file extension of the episodes.
+
+    Returns
+    -------
+    new_names: dict[str, str]
+        The new name of each episode, including those already named correctly.
+    """
+    episodes = sorted(name for name in names
+                      if re.match(rf"[0-9].*\.{file_ext}$", name) and name != SCHEDULE_FILE)
+
+    return {name: f"{i + 1:02d}{name[:-len(file_ext) - 1].lstrip(string.digits)}.{file_ext}"
+            for i, name in enumerate(episodes)}
+
+
+def slugify(string):
+    """Convert a string into a URL slug, in the same way as Jekyll.
+
+    Parameters
+    ----------
+    string: str
+        The string to convert.
+
+    Returns
+    -------
+    slug: str
+        The lower case string, with each run of characters which are not
+        letters or numbers replaced by a hyphen.
+    """
+    return re.sub(r"[\W_]+", "-", str(string)).strip("-").lower()
+
+
+def minutes(value):
+    """Get a number of minutes from the front matter, where missing is 0."""
+    return value if isinstance(value, int) and not isinstance(value, bool) else 0
+
+
+def create_episode_index(episode_dir=EPISODE_DIR):
+    """Create the index of the episodes in the episodes collection.
+
+    Parameters
+    ----------
+    episode_dir: str
+        The directory of the episodes collection.
+
+    Returns
+    -------
+    index: dict
+        The index, as described at the top of this file.
+    """
+    episode_dir = Path(episode_dir)
+    order = []
+    episodes = {}
+    lessons = {}
+
+    # Jekyll sorts the documents in a collection by their path, as none of the
+    # episodes have a date
+
+    for path in sorted(episode_dir.glob("*/*.md"), key=lambda p: p.relative_to(episode_dir).as_posix()):
+        front_matter = read_front_matter(path)
+        if front_matter is None:
+            continue
+
+        lesson_name = path.parent.name.removesuffix("-lesson")
+        slug = str(front_matter.get("slug", path.stem))
+        order.append(slug)
+        episodes[slug] = {
+            "slug": slug,
+            "title": front_matter.get("title", slug),
+            "url": f"/{slugify(slug)}",
+            "lesson": lesson_name,
+            "layout": front_matter.get("layout", "episode"),
+            "teaching": minutes(front_matter.get("teaching")),
+            "exercises": minutes(front_matter.get("exercises")),
+            "break": front_matter.get("break", False),
+            "start": bool(front_matter.get("start", False)),
+            "questions": front_matter.get("questions", []),
+            "keypoints": front_matter.get("keypoints", []),
+        }
+        lesson = lessons.setdefault(lesson_name, {"episodes": [], "multiday": False, "finish": 0})
+        if episodes[slug]["layout"] != "schedule":
+            lesson["episodes"].append(slug)
+
+    # The schedule of each lesson starts again on each episode which starts a
+    # new day, so the time of each episode is counted from the start of its day
+
+    for lesson in lessons.values():
+        day = 0
+        current = 0
+        for slug in lesson["episodes"]:
+            episode = episodes[slug]
+            if episode["start"]:
+                day += 1
+                lesson["multiday"] = True
+                if day > 1:
+                    episode["previous_day_finish"] = current
+                current = 0
+            episode["day"] = day
+            episode["offset"] = current
+            current += episode["teaching"] + episode["exercises"] + minutes(episode["break"])
+        lesson["finish"] = current
+
+    def link(i):
+        if not 0 <= i < len(order):
+            return None
+        return {"url": episodes[order[i]]["url"], "title": episodes[order[i]]["title"]}
+
+    for i, slug in enumerate(order):
+        episodes[slug]["previous"] = link(i - 1)
+        episodes[slug]["next"] = link(i + 1)
+
+    return {"order": order, "episodes": episodes, "lessons": lessons}
+
+
+def write_episode_index(index, path=INDEX_PATH):
+    """Write the index to _data, if it has changed.
+
+    The file is only written when its contents change, so that Jekyll does not
+    regenerate every page which uses it on every build.
+
+    Parameters
+    ----------
+    index: dict
+        The index to write.
+    path: str
+        The file to write the index to.
+
+    Returns
+    -------
+    written: bool
+        True if the file was written.
+    """
+    written = write_if_changed(path, json.dumps(index, indent=1, sort_keys=True, default=str))
+    if written:
+        log.info(f"Wrote the index of {len(index['order'])} episodes to {path}")
+
+    return written
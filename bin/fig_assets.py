@@ -0,0 +1,244 @@
+"""Merge the figures from every lesson into fig/.
+
+Each lesson's fig/ directory, and the figures knitted from its R Markdown
+episodes (collections/_episodes_rmd/{lesson}-lesson/fig/*.png), are merged into
+the top-level fig/ in the order the lessons are listed in _config.yml, so when
+two lessons have a figure with the same name, the figure from the later lesson
+is used. Figures with the same name but different contents are reported, as
+one of the lessons will show the wrong figure.
+
+The figures are synced through a content-addressed store in .build/assets/, so
+a figure which is used by several lessons, under any name, is only stored
+once, and only the figures which have changed are written (see sync_tree.py).
+
+With --variants, a recompressed copy of each large PNG, downscaled to at most
+--max-width pixels wide, is written to fig/optimised/ when it is smaller than
+the original, and the size of each is reported. This needs Pillow. The variants
+are cached by the hash of the original, so each figure is only encoded once.
+"""
+
+import os
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+from sync_tree import TreeSync, file_hash, prune_store
+from site_config import load_config
+import tracing
+
+log = logging.getLogger(__name__)
+
+FIG_DIR = "fig"
+STORE_DIR = Path(".build/assets/objects")
+VARIANT_CACHE_DIR = Path(".build/assets/variants")
+VARIANT_DIR = "optimised"
+DEFAULT_MAX_WIDTH = 1600
+DEFAULT_MIN_SIZE = 100  # KB
+
+
+def figure_sources(website_config):
+    """Get the figures of each lesson, in the order of _config.yml.
+
+    Parameters
+    ----------
+    website_config: dict
+        The configuration for the website.
+
+    Returns
+    -------
+    sources: list[tuple[str, str, pathlib.Path]]
+        The lesson, path relative to fig/ and file of each figure.
+    """
+    sources = []
+    for lesson_info in website_config.get("lessons", []):
+        lesson_name = lesson_info.get("gh-name")
+        if lesson_name is None:
+            continue
+        fig = Path(f"submodules/{lesson_name}/fig")
+        for root, dirs, files in os.walk(fig):
+            dirs[:] = sorted(d for d in dirs if d != ".git")
+            for file in sorted(files):
+                path = Path(root) / file
+                sources.append((lesson_name, path.relative_to(fig).as_posix(), path))
+        for path in sorted(Path(f"collections/_episodes_rmd/{lesson_name}-lesson/fig").glob("*.png")):
+            sources.append((lesson_name, path.name, path))
+
+    return sources
+
+
+def find_collisions(sources):
+    """Find the figures which have the same name but different contents.
+
+    Parameters
+    ----------
+    sources: list[tuple[str, str, pathlib.Path]]
+        The figures of each lesson, from figure_sources.
+
+    Returns
+    -------
+    collisions: dict[str, list[str]]
+        For each clashing name, the lessons which have a figure with that
+        name, in order. The figure from the last lesson is the one used.
+    """
+    by_name = {}
+    for lesson_name, rel, path in sources:
+        by_name.setdefault(rel, []).append((lesson_name, path))
+
+    # Only the names used more than once need to be hashed
+    collisions = {}
+    for rel, figures in by_name.items():
+        if len(figures) > 1 and len({file_hash(path) for _, path in figures}) > 1:
+            collisions[rel] = [lesson_name for lesson_name, _ in figures]
+
+    return collisions
+
+
+def make_variant(src, digest, max_width=DEFAULT_MAX_WIDTH):
+    """Recompress a PNG, downscaling it if it is wider than max_width.
+
+    Parameters
+    ----------
+    src: pathlib.Path
+        The PNG to recompress.
+    digest: str
+        The hash of the PNG, which the variant is cached by.
+    max_width: int
+        The maximum width of the variant, in pixels.
+
+    Returns
+    -------
+    variant: pathlib.Path
+        The variant, in the variant cache.
+    """
+    variant = VARIANT_CACHE_DIR / f"{digest}-{max_width}.png"
+    if variant.is_file():
+        return variant
+
+    variant.parent.mkdir(parents=True, exist_ok=True)
+    with tracing.span(src.name, "render"), Image.open(src) as image:
+        if image.width > max_width:
+            image = image.resize((max_width, round(image.height * max_width / image.width)), Image.LANCZOS)
+        image.save(f"{variant}.tmp", format="PNG", optimize=True)
+    os.replace(f"{variant}.tmp", variant)
+
+    return variant
+
+
+def add_variants(sync, executor, max_width=DEFAULT_MAX_WIDTH, min_size=DEFAULT_MIN_SIZE):
+    """Add a smaller variant of each large PNG to the sync.
+
+    Parameters
+    ----------
+    sync: TreeSync
+        The sync for fig/, with the figures already added.
+    executor: concurrent.futures.Executor
+        The executor to encode the variants with.
+    max_width: int
+        The maximum width of the variants, in pixels.
+    min_size: int
+        The size, in KB, of the smallest PNG to make a variant of.
+
+    Returns
+    -------
+    sizes: list[tuple[str, int, int]]
+        The path, original size and variant size of each variant which was
+        smaller than its original.
+    """
+    pngs = [(rel, src) for rel, src in sync.plan.items()
+            if rel.lower().endswith(".png") and not rel.startswith(f"{VARIANT_DIR}/")
+            and src.stat().st_size >= min_size * 1024]
+
+    def variant(item):
+        rel, src = item
+        return rel, src, make_variant(src, file_hash(src), max_width)
+
+    sizes = []
+    for rel, src, path in executor.map(variant, pngs):
+        original, smaller = src.stat().st_size, path.stat().st_size
+        if smaller < original:
+            sync.add_file(path, f"{VARIANT_DIR}/{rel}")
+            sizes.append((rel, original, smaller))
+
+    return sizes
+
+
+def log_size_report(sizes, n_largest=10):
+    """Log the size of the variants, and the figures with the largest savings."""
+    original = sum(size for _, size, _ in sizes)
+    smaller = sum(size for _, _, size in sizes)
+    log.info(f"{len(sizes)} variant(s): {original / 1024:.0f} KB reduced to {smaller / 1024:.0f} KB")
+    for rel, size, variant_size in sorted(sizes, key=lambda s: s[2] - s[1])[:n_largest]:
+        log.info(f"  {rel}: {size / 1024:.0f} KB -> {variant_size / 1024:.0f} KB")
+
+
+def merge_figures(website_config, workers=None, variants=False, max_width=DEFAULT_MAX_WIDTH):
+    """Merge the figures of every lesson into fig/.
+
+    Parameters
+    ----------
+    website_config: dict
+        The configuration for the website.
+    workers: int
+        The number of files to write, or variants to encode, at once.
+    variants: bool
+        If True, write smaller variants of the large PNGs to fig/optimised/.
+    max_width: int
+        The maximum width of the variants, in pixels.
+
+    Returns
+    -------
+    collisions: dict[str, list[str]]
+        The clashing figure names, from find_collisions.
+    """
+    sources = figure_sources(website_config)
+    collisions = find_collisions(sources)
+    for rel, lesson_names in collisions.items():
+        log.warning(f"fig/{rel} is different in {', '.join(lesson_names)}, using the one from {lesson_names[-1]}")
+
+    sync = TreeSync(FIG_DIR, store=STORE_DIR)
+    for _, rel, path in sources:
+        sync.add_file(path, rel)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        if variants and Image is None:
+            log.error("Pillow is not installed, so the figure variants can not be made")
+        elif variants:
+            log_size_report(add_variants(sync, executor, max_width))
+        stats = sync.apply(executor)
+
+    prune_store(STORE_DIR)
+    log.info(f"fig: {stats['written']} written ({stats['deduplicated']} deduplicated), "
+             f"{stats['unchanged']} unchanged, {stats['removed']} removed, {len(collisions)} name collision(s)")
+
+    return collisions
+
+
+def main():
+    """Main function of the script.
+
+    Merge the figures of the lessons in the website config into fig/.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", nargs="?", default=".",
+                        help="the root directory of the website")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="the number of files to write at once")
+    parser.add_argument("--variants", action="store_true",
+                        help="write smaller variants of the large PNGs to fig/optimised/")
+    parser.add_argument("--max-width", type=int, default=DEFAULT_MAX_WIDTH,
+                        help="the maximum width of the variants, in pixels")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    os.chdir(args.directory)
+    website_config = load_config()
+
+    merge_figures(website_config, args.workers, args.variants, args.max_width)
+
+
+if __name__ == "__main__":
+    main()
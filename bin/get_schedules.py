@@ -5,110 +5,80 @@ schedule for each lesson is modified by a delta time to account for different
 start times to what is in the schedule. The schedules are written to HTML in an
 (n x 2) array, with the first column being filled first (in date order) just
 like in an academic journal. This script updates _includes/rsg/schedule.html,
-and creates a detailed 00-schedule.md file for each lesson.
+creates a detailed 00-schedule.md file for each lesson and writes the index of
+the episodes to _data/episode_index.json (see episode_index.py).
 """
 
-import datetime
-import yaml
-import math
-import pandas
-import glob
+import logging
 import textwrap
-from bs4 import BeautifulSoup as bs
 from pathlib import Path
-import string
-from enum import Enum
-import dateutil
+from schedule_table import parse_schedules
+from schedule_html import DaySchedule, render_course_lesson, render_index
+from episode_index import create_episode_index, write_episode_index, numbered_names, SCHEDULE_FILE
+from sync_tree import write_if_changed
+from lesson_pack import read_manifest
+from validate_config import check_config
+from site_config import LessonType, get_date_object, get_lessons, load_config
+import tracing
 
+log = logging.getLogger(__name__)
 
-class LessonType(Enum):
-    """Enum for the different types of lessons.
-    """
-    markdown = "episode"
-    r_markdown = "episode_r"
-
-
-def get_yaml_config():
-    """Open the YAML config file for the website.
-
-    Returns
-    -------
-    config: dict
-        The configuration for the website.
-    """
-    with open("_config.yml", "r") as fp:
-        config = yaml.load(fp, yaml.Loader)
-
-    return config
-
-
-def get_date_object(datestr):
-    """Convert a date string into a datetime object.
 
-    On failure to convert a string, None is returned.
+def plan_renames(directory, file_ext="md"):
+    """Work out which episodes need to be renamed to be numbered from 01.
 
     Parameters
     ----------
-    datestr: str
-        The string of the date, in format YYYY-MM-DD. But any which dateutil
-        accepts is also acceptable.
+    directory: str
+        The directory containing the episodes of a lesson.
+    file_ext: str
+        The file extension of the episodes.
 
     Returns
     -------
-    date: datetime.date
-        The date object. If unable to parse, then None is returned instead.
+    renames: list[tuple[pathlib.Path, pathlib.Path]]
+        The current and new path of each episode which is not already named
+        correctly.
     """
-    if datestr is None:
-        return None
+    directory = Path(directory)
+    new_names = numbered_names([path.name for path in directory.glob(f"[0-9]*.{file_ext}")], file_ext)
 
-    if isinstance(datestr, datetime.date):
-        return datestr
-    elif not isinstance(datestr, str):
-        raise ValueError(f"datestr is not a string but {type(datestr)}")
+    return [(directory / name, directory / new_name) for name, new_name in new_names.items() if name != new_name]
 
-    try:
-        date =  dateutil.parser.parse(datestr).date()
-    except dateutil.parser.ParserError:
-        date =  None
 
-    return date
+def apply_renames(renames):
+    """Rename files, even when a file is being renamed to the name of another.
 
-
-def get_time_object(time_string):
-    """Convert a string into a datetime object.
-
-    If unable to parse the string, a ValueError exception is raised as we
-    cannot continue when there are missing time objects.
+    If any of the new names is already taken, every file is first moved to a
+    temporary name so that renames which form a chain or a cycle (e.g. 01-a ->
+    02-a while 02-a -> 01-a) do not overwrite each other.
 
     Parameters
     ----------
-    time_string: str
-        The time string to convert.
+    renames: list[tuple[pathlib.Path, pathlib.Path]]
+        The current and new path of each file.
 
     Returns
     -------
-    time_object: datetime.datetime
-        The converted string as a datetime object.
+    n_renamed: int
+        The number of files which were renamed.
     """
-    if type(time_string) is str:
-        try:
-            time = datetime.datetime.strptime(time_string, "%I:%M %p")   # start-time: 9:30 am
-        except ValueError:
-            time = datetime.datetime.strptime(time_string, "%H:%M")      # start-time: "9:30"
-    elif type(time_string) is int:
-        hours, minutes = divmod(time_string, 60)
-        time = datetime.datetime.strptime(f"{hours}:{minutes}", "%H:%M") # start-time: 9:30
-    else:
-        raise ValueError(f"start-time {time_string} is an invalid format: accept 24 hr (15:00) or 12 hr with am/pm (3:00 pm)")
+    if any(dest.exists() for _, dest in renames):
+        renames = [(src.rename(src.with_name(f".{src.name}.renaming")), dest) for src, dest in renames]
+    for src, dest in renames:
+        src.rename(dest)
+
+    return len(renames)
 
-    return time
 
 def create_detailed_lesson_schedules(lesson_name, lesson_type, start_time):
     """Create a detailed lesson schedule landing page for each lesson.
 
     The schedule is based on a modifed version of syllabus.html to work better
     with the workshop format. This function also renames the ordering of
-    lessons.
+    lessons. Only the episodes which are not numbered correctly are renamed,
+    and the schedule is only written if it has changed, so running this again
+    does not touch any files.
 
     Parameters
     ----------
@@ -118,14 +88,14 @@ def create_detailed_lesson_schedules(lesson_name, lesson_type, start_time):
         The type of lesson.
     start_time: str
         The start time of the lesson.
+
+    Returns
+    -------
+    n_touched: int
+        The number of files which were renamed or written.
     """
-    file_ext = "md"
     containing_directory = f"collections/_episodes/{lesson_name}-lesson"
-
-    for i, file in enumerate(sorted(glob.glob(f"{containing_directory}/[0-9]*.{file_ext}"))):
-        filepath = Path(file)
-        new_file_name = f"{i + 1:02d}{filepath.stem.lstrip(string.digits)}.{file_ext}"
-        filepath.rename(f"{containing_directory}/{new_file_name}")
+    n_touched = apply_renames(plan_renames(containing_directory))
 
     schedule_markdown = textwrap.dedent(f"""---
     title: Lesson Schedule
@@ -135,8 +105,10 @@ def create_detailed_lesson_schedules(lesson_name, lesson_type, start_time):
     {{% include syllabus.html  name="{lesson_name}" start_time={start_time} %}}
     """)
 
-    with open(f"{containing_directory}/00-schedule.md", "w") as fp:
-        fp.write("\n".join([line.lstrip() for line in schedule_markdown.splitlines()]))
+    schedule_markdown = "\n".join([line.lstrip() for line in schedule_markdown.splitlines()])
+    n_touched += write_if_changed(f"{containing_directory}/{SCHEDULE_FILE}", schedule_markdown)
+
+    return n_touched
 
 
 def create_index_schedules(schedules):
@@ -150,38 +122,52 @@ def create_index_schedules(schedules):
     ----------
     schedules: list[dict]
         The list of schedules to write to the file. Each schedule is a dict
-        with keys "date" which is the date for the lesson and "schedule" which
-        is the html table for the schedule.
+        with keys "order_on" which is the date (or order) of the lesson and
+        "schedule" which is the formatted html for the schedule.
+
+    Returns
+    -------
+    written: bool
+        True if the file was written, rather than already being up to date.
     """
-    n_lessons = len(schedules)
-    n_rows = math.ceil(n_lessons / 2)
     ordered_schedules = sorted(schedules, key=lambda x: x["order_on"])
 
-    left = ordered_schedules[:n_rows]
-    right = ordered_schedules[n_rows:]
-  
-    html = ""
-    for i in range(n_rows):
-        html += "<div class=\"row\">"
-        html += left[i]["schedule"]
-        if i < len(right):
-            html += right[i]["schedule"]
-        html += "</div>"
-
-    with open("_includes/rsg/schedule.html", "w") as fp:
-        fp.write(bs(html, "html.parser").prettify())
+    with tracing.span("schedule.html", "render"):
+        html = render_index([schedule["schedule"] for schedule in ordered_schedules])
+        return write_if_changed("_includes/rsg/schedule.html", html)
 
 
-def main():
+def main(website_config=None, packs=None):
     """Main function of the script.
 
     Handles all of the top level logic, for iterating through lessons to create
     the schedule HTML. Each lesson (and day) schedule is placed into an list,
     which is put into date order and written to HTML. Additionally, this script
     also creates a 00-schedule.md file for each lesson, which is used to create
-    a detailed syllabus.
+    a detailed syllabus, and an index of the episodes in _data for the
+    templates.
+
+    Parameters
+    ----------
+    website_config: dict
+        The configuration for the website. If None, it is read from _config.yml.
+    packs: str
+        A directory of lesson packs. The schedules and blurbs of the lessons
+        which have a pack are read from its manifest, rather than being parsed
+        again (see lesson_pack.py).
+
+    Raises
+    ------
+    ConfigError
+        If there are problems with the lessons in the config, including a
+        lesson whose schedule.html does not have a table for each date.
     """
-    website_config = get_yaml_config()
+    if website_config is None:
+        website_config = load_config()
+
+    # The lessons have been fetched by now, so their schedules are up to date
+    # and can be checked against the config
+    check_config(website_config)
 
     website_kind = website_config.get('kind')
 
@@ -194,21 +180,25 @@ def main():
 
     # Iterate over each lesson, to add their schedule to the html_schedules string
 
-    lessons = website_config.get("lessons", None)
+    lessons = get_lessons(website_config)
     if not lessons:
         raise ValueError("No lessons found in the workshop configuration file (_config.yml)")
     lesson_schedules = []
+    n_touched = 0
 
     for lesson in lessons:
-        lesson_type = LessonType(lesson.get("type", None))  # have to differentiate between markdown and r-markdown lessons
-        lesson_title = lesson.get("title", None)
-        lesson_name = lesson.get("gh-name", None)
-        lesson_dates = lesson.get("date", None)             # can be a list
-        lesson_starts = lesson.get("start-time", None)      # can be a list
-        lesson_order = lesson.get("order", None)
-
+        lesson_type = lesson.type  # have to differentiate between markdown and r-markdown lessons
+        lesson_title = lesson.title
+        lesson_name = lesson.name
+        lesson_dates = lesson.dates                # one for each day
+        lesson_starts = lesson.starts              # in minutes since midnight, one for each day
+        lesson_order = lesson.order
+
+        if lesson_type is None:
+            raise ValueError(f"{lesson_name} lesson has an unknown type, expected one of: "
+                             f"{', '.join(t.value for t in LessonType)}")
         if website_kind == 'workshop':
-            assrt_opts = (lesson_name, lesson_dates, lesson_title, lesson_starts)
+            assrt_opts = (lesson_name, lesson_dates or None, lesson_title, lesson_starts or None)
         if website_kind == 'course':
             assrt_opts = (lesson_name, lesson_title, lesson_order)
         if [thing for thing in assrt_opts if thing is None]:
@@ -216,28 +206,19 @@ def main():
                 raise ValueError(f"gh-name, title, date, and start-time are required for workshop")
             if website_kind == 'course':
                 raise ValueError(f"lesson_name, lesson_title, lesson_order are required for course")
-            
+        if website_kind == 'workshop' and (None in lesson_dates or None in lesson_starts):
+            raise ValueError(f"A date or start-time of {lesson_name} lesson can not be parsed")
 
-        # Since we allow multiple dates and start times per lesson, we need to be
-        # able to iterate over even single values so turn into list. When done,
-        # convert the dates from str to datetime.date objects.
-
-        if website_kind == 'workshop':
-            if type(lesson_dates) is not list:
-                lesson_dates = [lesson_dates]
-            if type(lesson_starts) is not list:
-                lesson_starts = [lesson_starts]
+        # Get the (time, session) rows of each schedule table for the lesson,
+        # from its pack if it has one
 
-            lesson_dates = [get_date_object(date) for date in lesson_dates]
-
-        # Get the schedule(s) for the lesson into a dataframe and also the html
-        # so we can search for the permalinks.
-
-        with open(f"_includes/rsg/{lesson_name}-lesson/schedule.html", "r") as fp:
-            schedule_html = fp.read()
-
-        soup = bs(schedule_html, "html.parser")
-        all_schedules = pandas.read_html(schedule_html, flavor="lxml")
+        manifest = read_manifest(packs, lesson_name) or {}
+        if manifest.get("schedules") is not None:
+            all_schedules = manifest["schedules"]
+        else:
+            with tracing.span(lesson_name, "parse"), \
+                    open(f"_includes/rsg/{lesson_name}-lesson/schedule.html", "r") as fp:
+                all_schedules = parse_schedules(fp.read())
 
         if website_kind == 'workshop':
             if len(all_schedules) != len(lesson_dates):
@@ -250,9 +231,6 @@ def main():
             # Loop over each schedule table, if the lesson has multiple schedules
 
             for i, schedule in enumerate(all_schedules):
-                schedule.columns = ["time", "session"]
-                start_time = get_time_object(lesson_starts[i])
-                original_start = get_time_object(schedule["time"][0])
                 datestr = lesson_dates[i].strftime("%d %B %Y")
 
                 if workshop_start_date and lesson_dates[i] < workshop_start_date:
@@ -260,63 +238,51 @@ def main():
                 if workshop_end_date and lesson_dates[i] > workshop_end_date:
                     raise ValueError(f"The date for {lesson_name} day {i + 1} is after the workshop end date")
 
-                # Calculate the time difference between the start time and the start
-                # time in the original schedule. This delta time (in minutes) is added
-                # to each time in the original schedule
+                # Move every session in the original schedule by the difference
+                # between its start time and the start time in _config.yml, and
+                # render the schedule table for this day of the lesson
 
-                delta_minutes = divmod((start_time - original_start).total_seconds(), 60)[0]
-
-                # Construct the schedule table for this lesson, adding delta_minutes to
-                # each original entry, and add the schedule table to the html template
+                day = DaySchedule.from_rows(schedule).starting_at(lesson_starts[i])
 
                 if len(all_schedules) > 1:
                     title = f"Day {i + 1}: {lesson_title}"
                 else:
                     title = lesson_title
 
-                table = f"""
-                <div class="col-md-6">
-                    <a href="{lesson_name}-schedule"><h3>{title}</h3></a>
-                    <h4>{datestr}</h4>
-                    <table class="table table-striped">
-                """
-
-                for time, session in zip(schedule["time"], schedule["session"]):
-                    actual_time = datetime.datetime.strptime(time, "%H:%M") + datetime.timedelta(minutes=delta_minutes)
-                    table += f"<tr> <td> {actual_time.hour:02d}:{actual_time.minute:02d} </td>    <td> {session} </td> </tr>\n"
-
-                table += """
-                    </table>
-                </div>
-                """
+                table = day.render(lesson_name, title, datestr)
 
                 lesson_schedules.append({"order_on": lesson_dates[i], "schedule": table})
 
-            start_time = get_time_object(lesson_starts[0])
-            start_time_minutes = start_time.hour * 60 + start_time.minute
-            create_detailed_lesson_schedules(lesson_name, lesson_type, start_time_minutes)
+            n_touched += create_detailed_lesson_schedules(lesson_name, lesson_type, lesson_starts[0])
         elif website_kind == 'course':
             path = Path(f"_includes/rsg/{lesson_name}-lesson/blurb.txt")
 
-            if path.is_file():
+            if manifest.get("blurb") is not None:
+                blurb = manifest["blurb"]
+            elif path.is_file():
                 with open(f"_includes/rsg/{lesson_name}-lesson/blurb.txt", "r") as fp:
                     blurb = fp.read()
             else:
                 blurb = "See course schedule for lesson details"
 
-            table = f"""
-                <div class="col-md-6">
-                    <a href="{lesson_name}-schedule"><h3>{lesson_title}</h3></a>
-                    {blurb}
-                </div>
-                """
+            table = render_course_lesson(lesson_name, lesson_title, blurb)
 
             lesson_schedules.append({"order_on": lesson_order, "schedule": table})
 
-            create_detailed_lesson_schedules(lesson_name, lesson_type, 0)
+            n_touched += create_detailed_lesson_schedules(lesson_name, lesson_type, 0)
             # make some untimed schedules
 
-    create_index_schedules(lesson_schedules)
+    n_touched += create_index_schedules(lesson_schedules)
+
+    # Now the episodes have been renumbered, index them for the templates
+
+    with tracing.span("episode index", "parse"):
+        n_touched += write_episode_index(create_episode_index())
+    if n_touched:
+        log.info(f"Schedules: {n_touched} file(s) renamed or written")
+    else:
+        log.info("Schedules are up to date")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     main()
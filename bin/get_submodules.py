@@ -1,160 +1,692 @@
 """Parse the curriculum collection (from _config.yml) and place the content
 from each lesson into the appropriate directory structure.
+
+Lessons are processed in phases. First, each lesson is checked against the
+GitHub API and cloned into submodules/, so each repository is fetched exactly
+once. This phase is I/O bound and can be run concurrently with --workers.
+Second, all of the clones are registered as submodules in one pass, as git does
+not allow concurrent writes to the index. Finally, the files from each lesson
+are synced into place. The files are planned in the order the lessons are
+listed in _config.yml, so when lessons share a file (in data/, ...) the
+output is the same no matter how many workers are used. Only the files which
+have changed since the last build are written, and files from lessons which
+have been removed are deleted (see sync_tree.py).
+
+With --packs, the lessons which have a lesson pack in the directory are
+extracted from it instead, without looking them up or cloning them, and are
+not registered as submodules (see lesson_pack.py).
 """
 
 import os
-from enum import Enum
+import argparse
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
 import logging
-from yaml import load
-try:
-    from yaml import CLoader as Loader
-except ImportError:
-    from yaml import Loader
 from pathlib import Path
-from distutils.dir_util import copy_tree
 import requests
-from shutil import copy2 as copy, rmtree
+from requests.adapters import HTTPAdapter
+from shutil import rmtree
+from lesson_pack import open_pack, REVEAL_JS_PACK
+from lesson_cache import LessonCache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE, directory_size
+from github_resolver import GitHubResolver
+from sync_tree import TreeSync
+import reveal_store
+import tracing
+from validate_config import ConfigError, check_config
+from site_config import LessonType, load_config
+from knit_rmd import knitted_outputs
+from episode_index import numbered_names
 
 log = logging.getLogger(__name__)
 
-class LessonType(Enum):
-    """Enum for the different types of lessons.
+DEFAULT_ORG = "Southampton-RSG-Training"
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+GITHUB_GIT_URL = os.environ.get("GITHUB_GIT_URL", "https://github.com")
+REVEAL_JS_COMMIT = os.environ.get("REVEAL_JS_COMMIT", "8a54118f43")
+
+# The directories which the build uses from each lesson. Files in the top level
+# of the repository, such as setup.md and renv.lock, are always checked out
+SPARSE_PATHS = ["_episodes", "_episodes_rmd", "fig", "data", "slides", "_includes/rsg"]
+
+
+def get_http_session(n_workers):
+    """Create a HTTP session which can be shared between worker threads.
+
+    Parameters
+    ----------
+    n_workers: int
+        The number of threads which will use the session. The connection pool
+        is sized so that each worker can keep its connection alive.
+
+    Returns
+    -------
+    session: requests.Session
+        The pooled HTTP session.
     """
-    markdown = "episode"
-    r_markdown = "episode_r"
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=n_workers, pool_maxsize=n_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
 
-# Remove previously existing directories, to start fresh
+    return session
 
-rmtree("submodules", ignore_errors=True)
-rmtree("collections", ignore_errors=True)
-rmtree("slides", ignore_errors=True)
 
-# Open the website config, which contains a list of the lessons we want in the
-# workshop, then create the directory "submodules" which will contain the files
-# for each lesson
+def git(*args, cwd=None):
+    """Run a git command, raising an exception if it fails.
 
-with open('_config.yml') as config:
-    website_config = load(config, Loader=Loader)
-log.info(f"Getting submodules specified in {website_config['lessons']}")
-Path("submodules").mkdir(parents=True, exist_ok=True)
+    Parameters
+    ----------
+    args: str
+        The arguments to pass to git.
+    cwd: str
+        The directory to run the command in.
+    """
+    tracing.run(["git", *args], cwd=cwd, check=True)
 
-# Now process each lesson in the list
 
-for n, lesson_info in enumerate(website_config['lessons']):
-    #
-    if lesson_info.get('type', None) in ["episode", "episode_r"]:
-        #
-        lesson_type = LessonType(lesson_info.get("type", None))
-        if lesson_type == LessonType.markdown:
-            directory = "_episodes"
-        elif lesson_type == LessonType.r_markdown:
-            directory = "_episodes_rmd"
-        else:
-            raise ValueError(f"Unknown lesson type {lesson_type}")
-
-        # Create the command to pull the subdirectory from GitHub
-        org_name = lesson_info.get("org-name", "Southampton-RSG-Training")
-        lesson_name = lesson_info.get('gh-name', None)
-        if lesson_name is None:
-            raise ValueError(f"No lesson name specified for lesson {n}")
-        gh_branch = lesson_info.get('branch', 'gh-pages')
-        # Check this repository exists
-        r = requests.get(f'https://api.github.com/repos/{org_name}/{lesson_name}')
-        if r.status_code != 200:
-            log.warning(f'Lesson {lesson_name} does not exist in {org_name} trying in default org')
-            r = requests.get(f'https://api.github.com/repos/Southampton-RSG-Training/{lesson_name}')
-            if r.status_code == 200:
-                log.warning(f"Lesson {lesson_name} found in 'Southampton-RSG-Training' using as fallback")
-                org_name = "Southampton-RSG-Training"
-            else:
-                raise f"Lesson {lesson_name} does not exist in '{org_name}', or 'Southampton-RSG-Training'"
-        else:
-            r = requests.get(f'https://api.github.com/repos/{org_name}/{lesson_name}/branches/{gh_branch}')
-            if r.status_code != 200:
-                log.warning(f'Branch {gh_branch} does not exist in {org_name}/{lesson_name} trying default branch')
-                r = requests.get(f'https://api.github.com/repos/{org_name}/{lesson_name}/branches/gh-pages')
-                if r.status_code == 200:
-                    log.warning(f'Branch {gh_branch} found in {org_name}/{lesson_name} using as fallback')
-                    gh_branch = "gh-pages"
-                else:
-                    raise f"Branch '{gh_branch}' or 'gh-pages' does not exist in '{org_name}/{lesson_name}', or 'Southampton-RSG-Training'"
-
-
-
-        log.info(f"Getting lesson with parameters:\n org-name: {org_name} \n gh-name: {lesson_name} \n branch: {gh_branch} \n type: {lesson_type.value}")
-        os.system(f"git submodule add --force -b {gh_branch} https://github.com/Southampton-RSG-Training/{lesson_name}.git submodules/{lesson_name}")
-        os.system("git submodule update --remote --merge")
-
-        # move required files from the subdirectories to _includes/rsg/{lesson_name}/...
-        # lesson destinations need to be appended with -lesson to avoid gh-pages naming conflicts
-
-        # Things to move to ./ -- only for Rmd set up files
-        if lesson_type == LessonType.r_markdown:
-            for file in ["renv.lock", f"{lesson_name}_setup.R"]:
-                copy(f"submodules/{lesson_name}/{file}", f"./{file.split('/')[-1]}")
-                log.info(f"Copied submodules/{lesson_name}/{file} to ./")
-
-        # Things to move to ./_includes/rsg -- for lesson schedules and setup
-        dest = f"_includes/rsg/{lesson_name}-lesson"
-        Path(dest).mkdir(parents=True, exist_ok=True)
-        for file in ["setup.md", "_includes/rsg/schedule.html", "blurb.txt"]:
-            try:
-                copy(f"submodules/{lesson_name}/{file}", f"{dest}/{file.split('/')[-1]}")
-                log.info(f"Copied submodules/{lesson_name}/{file} to {dest}")
-            except:
-                log.error(f"Cannot find or move submodules/{lesson_name}/{file}, but carrying on anyway")
+def git_path(path):
+    """Get the location of a path inside the .git directory of the website.
 
-        # Things to move to ./collections/... -- episodes and extras
-        dest = f"collections/{directory}/{lesson_name}-lesson"
-        Path(dest).mkdir(parents=True, exist_ok=True)
-        copy_tree(f"submodules/{lesson_name}/{directory}/", dest)
-        for file in ["reference.md"]:
-            try:
-                dest = f"collections/{directory}/{lesson_name}-lesson"
-                Path(dest).mkdir(parents=True, exist_ok=True)
-                copy(f"submodules/{lesson_name}/{file}", f"{dest}/{file.split('/')[-1]}")
-                log.info(f"Copied submodules/{lesson_name}/{file} to {dest}")
-            except:
-                log.error(f"Cannot find or move submodules/{lesson_name}/{file}, but carrying on anyway")
+    Parameters
+    ----------
+    path: str
+        The path, relative to the .git directory.
+
+    Returns
+    -------
+    path: str
+        The path, relative to the current directory.
+    """
+    process = tracing.run(["git", "rev-parse", "--git-path", path], check=True, capture_output=True, text=True)
+
+    return process.stdout.strip()
+
+
+def episode_directory(lesson_info):
+    """Get the type of a lesson, and the directory its episodes are in.
 
-        # Move figures
-        copy_tree(f"submodules/{lesson_name}/fig", "fig/")
-        # Move data
-        try:
-            copy_tree(f"submodules/{lesson_name}/data", "data/")
-        except:
-            log.info(f"No data file to move in {lesson_name}")
-
-        # Things to move only for Rmd set up files
-        if lesson_type == LessonType.r_markdown:
-            # Set the destination to the lesson collection, R needs these in the 'resource path'
-            dest = f"collections/{directory}/{lesson_name}-lesson"
-            # Move the figures for this lesson
-            #copy_tree(f"submodules/{lesson_name}/fig", f"{dest}/fig/")
-            # Move the footer and navbar
-            #Path(f"{dest}/_includes/").mkdir(parents=True, exist_ok=True)
-            #copy("_includes/workshop_footer.html", f"{dest}/_includes/")
-            #copy("_includes/navbar.html", f"{dest}/_includes/")
-
-# Now need to do the same for slides, but have to do it afterwards because we
-# need a specific version of reveal.js, so we need to avoid the git submodule
-# update
-
-os.system("git submodule add --force https://github.com/hakimel/reveal.js.git submodules/reveal.js")
-os.system("cd submodules/reveal.js && git checkout 8a54118f43")
-
-for n, lesson_info in enumerate(website_config['lessons']):
-    #
+    Parameters
+    ----------
+    lesson_info: dict
+        The entry for the lesson in _config.yml.
+
+    Returns
+    -------
+    lesson_type: LessonType
+        The type of the lesson.
+    directory: str
+        The directory of the episodes in the lesson repository.
+    """
     lesson_type = LessonType(lesson_info.get("type", None))
+    if lesson_type == LessonType.markdown:
+        directory = "_episodes"
+    elif lesson_type == LessonType.r_markdown:
+        directory = "_episodes_rmd"
+    else:
+        raise ValueError(f"Unknown lesson type {lesson_type}")
+
+    return lesson_type, directory
+
+
+def resolve_lesson(resolver, n, lesson_info):
+    """Check that the repository and branch for a lesson exist.
+
+    If the repository does not exist in the requested organisation, then the
+    default organisation is tried instead. If the branch does not exist, then
+    gh-pages is used instead.
+
+    Parameters
+    ----------
+    resolver: GitHubResolver
+        The resolver used to look up repositories and branches.
+    n: int
+        The index of the lesson in _config.yml.
+    lesson_info: dict
+        The entry for the lesson in _config.yml.
+
+    Returns
+    -------
+    lesson: dict
+        The resolved lesson, with keys "name", "org", "branch", "commit",
+        "type" and "directory".
+
+    Raises
+    ------
+    ConfigError
+        If neither the repository nor the branch can be found.
+    """
+    lesson_type, directory = episode_directory(lesson_info)
+
+    org_name = lesson_info.get("org-name", DEFAULT_ORG)
     lesson_name = lesson_info.get('gh-name', None)
     if lesson_name is None:
-        raise ValueError("No lesson name specified for lesson {n}")
-
-    if Path(f"submodules/{lesson_name}/slides").is_dir():
-        Path(f"slides/{lesson_name}-lesson").mkdir(parents=True, exist_ok=True)
-        copy_tree(f"submodules/{lesson_name}/slides", f"slides/{lesson_name}-lesson")
-        # The lesson reveal.js folder which gets copied is empty, so delete that
-        # directory and then copy in the reveal.js submodule downloaded earlier
-        rmtree(f"slides/{lesson_name}-lesson/reveal.js", ignore_errors=True)
-        Path(f"slides/{lesson_name}-lesson/reveal.js").mkdir(parents=True, exist_ok=True)
-        copy_tree("submodules/reveal.js", f"slides/{lesson_name}-lesson/")
+        raise ValueError(f"No lesson name specified for lesson {n}")
+    gh_branch = lesson_info.get('branch', 'gh-pages')
+
+    # Check this repository exists
+    if not resolver.repo_exists(org_name, lesson_name):
+        log.warning(f'Lesson {lesson_name} does not exist in {org_name} trying in default org')
+        if resolver.repo_exists(DEFAULT_ORG, lesson_name):
+            log.warning(f"Lesson {lesson_name} found in '{DEFAULT_ORG}' using as fallback")
+            org_name = DEFAULT_ORG
+        else:
+            raise ConfigError([f"Lesson {lesson_name} does not exist in '{org_name}', or '{DEFAULT_ORG}'"])
+
+    # Check the branch exists
+    branches = resolver.branches(org_name, lesson_name)
+    if gh_branch not in branches:
+        log.warning(f'Branch {gh_branch} does not exist in {org_name}/{lesson_name} trying default branch')
+        if "gh-pages" in branches:
+            log.warning(f'Branch {gh_branch} found in {org_name}/{lesson_name} using as fallback')
+            gh_branch = "gh-pages"
+        else:
+            raise ConfigError([f"Branch '{gh_branch}' or 'gh-pages' does not exist in '{org_name}/{lesson_name}'"])
+
+    return {
+        "name": lesson_name,
+        "org": org_name,
+        "branch": gh_branch,
+        "commit": branches[gh_branch],
+        "type": lesson_type,
+        "directory": directory,
+    }
+
+
+def pack_lesson(pack, lesson_info):
+    """Get a lesson from its lesson pack, instead of looking it up on GitHub.
+
+    Parameters
+    ----------
+    pack: lesson_pack.LessonPack
+        The pack for the lesson.
+    lesson_info: dict
+        The entry for the lesson in _config.yml.
+
+    Returns
+    -------
+    lesson: dict
+        The lesson, with the same keys as from resolve_lesson, and "pack".
+    """
+    lesson_type, directory = episode_directory(lesson_info)
+    manifest = pack.manifest
+    branch = lesson_info.get("branch", "gh-pages")
+    if manifest["branch"] != branch:
+        log.warning(f"The pack for {manifest['name']} is of branch {manifest['branch']}, not {branch}, "
+                    f"using it anyway")
+
+    return {
+        "name": manifest["name"],
+        "org": manifest["org"],
+        "branch": manifest["branch"],
+        "commit": manifest["commit"],
+        "type": lesson_type,
+        "directory": directory,
+        "pack": pack,
+    }
+
+
+def fetch_lesson(lesson, git_url=GITHUB_GIT_URL, sparse=False, path=None):
+    """Clone the repository for a lesson into submodules/.
+
+    The commit the lesson was resolved to is checked out, even if the branch
+    has moved on since it was resolved. In sparse mode, only the latest commit
+    (or the resolved commit) is fetched and only the paths in SPARSE_PATHS
+    (plus the files at the top of the repository) are checked out. File
+    contents are only downloaded for the paths which are checked out.
+
+    Parameters
+    ----------
+    lesson: dict
+        The resolved lesson, from resolve_lesson.
+    git_url: str
+        The base URL to clone repositories from.
+    sparse: bool
+        If True, make a shallow, partial and sparse clone.
+    path: str
+        The directory to clone into, instead of submodules/{lesson}.
+
+    Returns
+    -------
+    sizes: tuple[int, int]
+        The size of the git objects in the clone, in bytes, and the
+        number of bytes written to the working tree.
+    """
+    log.info(f"Getting lesson with parameters:\n org-name: {lesson['org']} \n gh-name: {lesson['name']} \n branch: {lesson['branch']} \n type: {lesson['type'].value}")
+    path = path or f"submodules/{lesson['name']}"
+    if sparse:
+        git("clone", "--quiet", "--depth", "1", "--filter=blob:none", "--sparse", "--branch", lesson["branch"],
+            lesson_url(lesson, git_url), path)
+        git("sparse-checkout", "set", *SPARSE_PATHS, cwd=path)
+    else:
+        git("clone", "--quiet", "--branch", lesson["branch"], lesson_url(lesson, git_url), path)
+
+    # The branch may have moved since the commit was looked up, and the clone
+    # is cached as that commit, so check out the commit rather than the tip
+    head = tracing.run(["git", "rev-parse", "HEAD"], cwd=path, check=True, capture_output=True, text=True)
+    if head.stdout.strip() != lesson["commit"]:
+        log.warning(f"{lesson['org']}/{lesson['name']} {lesson['branch']} has moved since it was looked up, "
+                    f"checking out {lesson['commit'][:10]}")
+        if sparse:
+            git("fetch", "--quiet", "--depth", "1", "--filter=blob:none", "origin", lesson["commit"], cwd=path)
+        git("checkout", "--quiet", "-B", lesson["branch"], lesson["commit"], cwd=path)
+
+    return directory_size(f"{path}/.git/objects"), directory_size(path, exclude=".git")
+
+
+def lesson_url(lesson, git_url=GITHUB_GIT_URL):
+    """Get the URL of the git repository for a lesson.
+
+    Parameters
+    ----------
+    lesson: dict
+        The resolved lesson, from resolve_lesson.
+    git_url: str
+        The base URL to clone repositories from.
+
+    Returns
+    -------
+    url: str
+        The URL of the repository.
+    """
+    return f"{git_url}/{lesson['org']}/{lesson['name']}.git"
+
+
+def stage_lesson(lesson, syncs):
+    """Add the files which belong only to this lesson to the syncs.
+
+    Parameters
+    ----------
+    lesson: dict
+        The resolved lesson, from resolve_lesson.
+    syncs: dict[str, TreeSync]
+        The syncs for each destination, from create_syncs.
+    """
+    # move required files from the subdirectories to _includes/rsg/{lesson_name}/...
+    # lesson destinations need to be appended with -lesson to avoid gh-pages naming conflicts
+    lesson_name = lesson["name"]
+    directory = lesson["directory"]
+
+    # Things to move to ./_includes/rsg -- for lesson schedules and setup
+    for file in ["setup.md", "_includes/rsg/schedule.html", "blurb.txt"]:
+        if not syncs["includes"].add_file(f"submodules/{lesson_name}/{file}",
+                                          f"{lesson_name}-lesson/{file.split('/')[-1]}"):
+            log.error(f"Cannot find or move submodules/{lesson_name}/{file}, but carrying on anyway")
+
+    # Things to move to ./collections/... -- episodes and extras
+    dest = f"{directory}/{lesson_name}-lesson"
+    syncs["collections"].add_tree(f"submodules/{lesson_name}/{directory}", dest)
+    if lesson["type"] == LessonType.markdown:
+        number_episodes(syncs["collections"], dest)
+    for file in ["reference.md"]:
+        if not syncs["collections"].add_file(f"submodules/{lesson_name}/{file}", f"{dest}/{file.split('/')[-1]}"):
+            log.error(f"Cannot find or move submodules/{lesson_name}/{file}, but carrying on anyway")
+
+
+def number_episodes(sync, dest):
+    """Give the episodes of a lesson the names get_schedules.py numbers them to.
+
+    The episodes are synced with their final names, rather than being synced
+    with their original names and then renamed after every build.
+
+    Parameters
+    ----------
+    sync: TreeSync
+        The sync the episodes have been added to.
+    dest: str
+        The directory of the episodes, relative to the sync.
+    """
+    names = [rel[len(dest) + 1:] for rel in sync.plan if posixpath.dirname(rel) == dest]
+    new_names = {f"{dest}/{name}": f"{dest}/{new_name}" for name, new_name in numbered_names(names).items()}
+    sync.plan = {new_names.get(rel, rel): src for rel, src in sync.plan.items()}
+
+
+def merge_lesson(lesson, syncs):
+    """Add the files which are shared between lessons to the syncs.
+
+    This has to be done one lesson at a time, in the order of _config.yml, so
+    that a file with the same name in two lessons is always taken from the
+    same lesson.
+
+    Parameters
+    ----------
+    lesson: dict
+        The resolved lesson, from resolve_lesson.
+    syncs: dict[str, TreeSync]
+        The syncs for each destination, from create_syncs.
+    """
+    lesson_name = lesson["name"]
+
+    # Things to move to ./ -- only for Rmd set up files
+    if lesson["type"] == LessonType.r_markdown:
+        for file in ["renv.lock", f"{lesson_name}_setup.R"]:
+            if not syncs["root"].add_file(f"submodules/{lesson_name}/{file}", file.split('/')[-1]):
+                log.error(f"Cannot find or move submodules/{lesson_name}/{file}, but carrying on anyway")
+
+    # Move data (the figures are merged by fig_assets.py)
+    if not syncs["data"].add_tree(f"submodules/{lesson_name}/data"):
+        log.info(f"No data file to move in {lesson_name}")
+
+
+def stage_slides(lesson, syncs, reveal_files):
+    """Add the slides for a lesson to the syncs.
+
+    The slides use the shared copy of reveal.js in slides/, rather than their
+    own copy, so the references to reveal.js in each HTML file are rewritten.
+
+    Parameters
+    ----------
+    lesson: dict
+        The resolved lesson, from resolve_lesson.
+    syncs: dict[str, TreeSync]
+        The syncs for each destination, from create_syncs.
+    reveal_files: set[str]
+        The files in the reveal.js checkout.
+
+    Returns
+    -------
+    has_slides: bool
+        True if the lesson has slides.
+    """
+    lesson_name = lesson["name"]
+    dest = f"{lesson_name}-lesson"
+    slides = syncs["slides"]
+
+    if not slides.add_tree(f"submodules/{lesson_name}/slides", dest):
+        return False
+
+    # The lesson reveal.js folder which gets copied is empty, so drop that
+    # directory and point the slides to the reveal.js submodule downloaded
+    # earlier instead
+    slides.discard(f"{dest}/reveal.js")
+    store = f"../{reveal_store.store_name(REVEAL_JS_COMMIT)}"
+    for rel, src in list(slides.plan.items()):
+        if rel.startswith(f"{dest}/") and Path(rel).suffix in reveal_store.SLIDE_SUFFIXES:
+            html_path = rel[len(dest) + 1:]
+            with open(src, encoding="utf-8") as fp:
+                html = fp.read()
+            html = reveal_store.rewrite_references(html, html_path, store, reveal_files)
+            slides.add_content(html.encode("utf-8"), rel)
+
+    return True
+
+
+def create_syncs():
+    """Create a sync for each of the directories the lessons are copied to.
+
+    collections/ and slides/ only contain files copied from the lessons, so
+    anything else in them is removed. The other directories also contain files
+    from this repository, so only files which were copied from a lesson on a
+    previous build are removed.
+
+    Returns
+    -------
+    syncs: dict[str, TreeSync]
+        The sync for each destination.
+    """
+    return {
+        "includes": TreeSync("_includes/rsg"),
+        # 00-schedule.md is created later by get_schedules.py, and the knitted
+        # R Markdown episodes, and the figures knitr writes next to the Rmd
+        # files, by knit_rmd.py
+        "collections": TreeSync("collections", prune=True,
+                                keep=["*/*/00-schedule.md", "_episodes_rmd/*/fig/*", *knitted_outputs()]),
+        "root": TreeSync("."),
+        "data": TreeSync("data"),
+        "slides": TreeSync("slides", prune=True),
+    }
+
+
+def fetch_reveal_js(git_url=GITHUB_GIT_URL, sparse=False, path="submodules/reveal.js"):
+    """Clone reveal.js, at the version the lesson slides are written for.
+
+    Parameters
+    ----------
+    git_url: str
+        The base URL to clone repositories from.
+    sparse: bool
+        If True, only download the file contents for the pinned commit. The
+        history is still needed, as the commit is not a branch tip.
+    path: str
+        The directory to clone into.
+    """
+    if sparse:
+        git("clone", "--quiet", "--filter=blob:none", "--no-checkout", f"{git_url}/hakimel/reveal.js.git", path)
+    else:
+        git("clone", "--quiet", f"{git_url}/hakimel/reveal.js.git", path)
+    git("checkout", "--quiet", REVEAL_JS_COMMIT, cwd=path)
+
+
+def register_submodules(lessons, git_url=GITHUB_GIT_URL, reveal_js=True):
+    """Register the cloned lessons, and reveal.js, as submodules.
+
+    The repositories have already been cloned, so this does not fetch
+    anything. The submodules are added one at a time, as git does not allow
+    concurrent writes to the index.
+
+    Parameters
+    ----------
+    lessons: list[dict]
+        The resolved lessons, from resolve_lesson.
+    git_url: str
+        The base URL the repositories were cloned from.
+    reveal_js: bool
+        If True, also register reveal.js.
+    """
+    for lesson in lessons:
+        git("submodule", "add", "--quiet", "--force", "-b", lesson["branch"], lesson_url(lesson, git_url),
+            f"submodules/{lesson['name']}")
+    if reveal_js:
+        git("submodule", "add", "--quiet", "--force", f"{git_url}/hakimel/reveal.js.git", "submodules/reveal.js")
+
+    # The clones were made outside of git submodule, so move their .git
+    # directories into .git/modules like a submodule clone would have done
+    git("submodule", "absorbgitdirs")
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments.
+
+    Parameters
+    ----------
+    argv: list[str]
+        The arguments to parse. If None, sys.argv is used.
+
+    Returns
+    -------
+    args: argparse.Namespace
+        The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", nargs="?", default=".",
+                        help="the root directory of the website")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="the number of lessons to fetch concurrently")
+    parser.add_argument("--sparse", action="store_true",
+                        help="only fetch the latest commit and the files which are used by the build")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="the directory to cache lesson repositories in")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE,
+                        help="the maximum size of the cache, in MB")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always clone the lesson repositories")
+    parser.add_argument("--api-url", default=GITHUB_API_URL,
+                        help="the base URL of the GitHub API")
+    parser.add_argument("--git-url", default=GITHUB_GIT_URL,
+                        help="the base URL to clone lesson repositories from")
+    parser.add_argument("--packs",
+                        help="a directory of lesson packs, to use instead of fetching the lessons they hold")
+
+    return parser.parse_args(argv)
+
+
+def get_submodules(website_config, args, resolver=None):
+    """Fetch the lessons in the website config and put their files in place.
+
+    Reads the lessons from _config.yml, then fetches each lesson using a pool
+    of worker threads. Once the lessons are registered as submodules, their
+    files, the shared files and the slides for each lesson are synced into
+    place using the same pool.
+
+    Parameters
+    ----------
+    website_config: dict
+        The configuration for the website.
+    args: argparse.Namespace
+        The options, from parse_args.
+    resolver: GitHubResolver
+        A resolver shared with the builds of other sites, which has already
+        looked up the lessons (see batch_build.py). The lesson cache is then
+        not evicted, as the other builds may still be restoring from it.
+
+    Raises
+    ------
+    ConfigError
+        If there are problems with the lessons in the config, which are
+        checked before anything is fetched. The schedules are not checked, as
+        they are only up to date once the lessons have been fetched.
+    """
+    check_config(website_config, check_schedules=False)
+    n_workers = max(1, args.workers)
+
+    # Remove the previous submodules, to start fresh. The directories the
+    # lessons are copied to are synced instead, so unchanged files are left
+    # alone
+
+    rmtree("submodules", ignore_errors=True)
+    rmtree(git_path("modules/submodules"), ignore_errors=True)
+
+    # Create the directory "submodules" which will contain the files for each
+    # lesson
+
+    log.info(f"Getting submodules specified in {website_config['lessons']}")
+    Path("submodules").mkdir(parents=True, exist_ok=True)
+
+    lessons_info = [
+        (n, lesson_info) for n, lesson_info in enumerate(website_config['lessons'])
+        if lesson_info.get('type', None) in ["episode", "episode_r"]
+    ]
+    shared = resolver is not None
+    if not shared:
+        resolver = GitHubResolver(get_http_session(n_workers), args.api_url, args.git_url,
+                                  None if args.no_cache else Path(args.cache_dir) / "http")
+
+    cache = None if args.no_cache else LessonCache(args.cache_dir, args.cache_size * 1024 ** 2)
+    mode = "-sparse" if args.sparse else ""
+
+    # The lessons which have a lesson pack are extracted from it, rather than
+    # being looked up and fetched
+
+    packs = {n: open_pack(args.packs, lesson_info["gh-name"]) for n, lesson_info in lessons_info}
+    reveal_pack = open_pack(args.packs, REVEAL_JS_PACK)
+    if reveal_pack and not reveal_pack.manifest["commit"].startswith(REVEAL_JS_COMMIT):
+        log.warning(f"The reveal.js pack is of commit {reveal_pack.manifest['commit']}, not {REVEAL_JS_COMMIT}, "
+                    f"so reveal.js will be fetched")
+        reveal_pack.close()
+        reveal_pack = None
+
+    def fetch(lesson):
+        path = f"submodules/{lesson['name']}"
+        key = lesson["commit"] + mode
+        with tracing.span(f"fetch {lesson['name']}", "lesson"):
+            if "pack" in lesson:
+                lesson["sizes"] = (0, lesson["pack"].extract(path))
+            elif cache and cache.restore(lesson["org"], lesson["name"], key, path):
+                lesson["sizes"] = None
+            else:
+                lesson["sizes"] = fetch_lesson(lesson, args.git_url, args.sparse)
+                if cache:
+                    cache.put(lesson["org"], lesson["name"], key, path)
+        return lesson
+
+    def fetch_reveal():
+        key = REVEAL_JS_COMMIT + mode
+        if reveal_pack:
+            reveal_pack.extract("submodules/reveal.js", paths=None)
+            return
+        if cache and cache.restore("hakimel", "reveal.js", key, "submodules/reveal.js"):
+            return
+        fetch_reveal_js(args.git_url, args.sparse)
+        if cache:
+            cache.put("hakimel", "reveal.js", key, "submodules/reveal.js")
+
+    # Each lesson repository, and reveal.js, is fetched exactly once. The
+    # clone already checks out the tip of the requested branch, so there is no
+    # need to update the submodules again once they have been added
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        reveal_js = executor.submit(fetch_reveal)
+
+        # Look up every repository in one batch, before resolving the lessons
+
+        resolver.prefetch([
+            (lesson_info.get("org-name", DEFAULT_ORG), lesson_info.get("gh-name", None))
+            for n, lesson_info in lessons_info if packs[n] is None
+        ], executor)
+        lessons = [pack_lesson(packs[n], lesson_info) if packs[n] else resolve_lesson(resolver, n, lesson_info)
+                   for n, lesson_info in lessons_info]
+        lessons = list(executor.map(fetch, lessons))
+        reveal_js.result()
+        for pack in [*packs.values(), reveal_pack]:
+            if pack:
+                pack.close()
+
+        for lesson in lessons:
+            if "pack" in lesson:
+                log.info(f"{lesson['name']}: extracted from {lesson['pack'].path}, {lesson['sizes'][1]} bytes written")
+            elif lesson["sizes"] is None:
+                log.info(f"{lesson['name']}: restored from the cache")
+            else:
+                objects, written = lesson["sizes"]
+                log.info(f"{lesson['name']}: {objects} bytes of git objects, {written} bytes written")
+
+        # Lessons from packs are not git repositories, so are not registered
+        register_submodules([lesson for lesson in lessons if "pack" not in lesson], args.git_url,
+                            reveal_js=reveal_pack is None)
+
+        # Now the lessons are in place, their files can be staged. All of the
+        # files are planned in the order of _config.yml, so a file with the
+        # same name in two lessons is always taken from the same lesson, and
+        # then only the changed files are written
+
+        syncs = create_syncs()
+        reveal_files = reveal_store.list_files("submodules/reveal.js")
+        has_slides = False
+        for lesson in lessons:
+            stage_lesson(lesson, syncs)
+            merge_lesson(lesson, syncs)
+            has_slides |= stage_slides(lesson, syncs, reveal_files)
+
+        # A single copy of reveal.js is shared by all of the slides
+        if has_slides:
+            syncs["slides"].add_tree("submodules/reveal.js", reveal_store.store_name(REVEAL_JS_COMMIT))
+
+        for sync in syncs.values():
+            sync.apply(executor)
+
+    missing = reveal_store.verify_slides("slides")
+    if missing:
+        raise FileNotFoundError("Slides are missing reveal.js files:\n" + "\n".join(missing))
+
+    if cache and not shared:
+        cache.evict()
+
+
+def main():
+    """Main function of the script.
+
+    Open the website config, which contains a list of the lessons we want in
+    the workshop, and then get the lessons.
+    """
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.packs:
+        args.packs = os.path.abspath(args.packs)
+    os.chdir(args.directory)
+
+    website_config = load_config()
+
+    get_submodules(website_config, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Look up lesson repositories and branches with as few requests as possible.
+
+Whether a repository exists is checked with the GitHub API. The responses are
+cached on disk with their ETag, and are revalidated with If-None-Match, so a
+repeated build only receives "304 Not Modified" responses, which do not count
+towards the API rate limit. The branches of a repository, and the commits they
+point to, are all found at once with a single git ls-remote, rather than one
+API request per branch.
+
+All of the repositories in _config.yml can be looked up in a single batch with
+prefetch, after which resolving each lesson does not need any more requests.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from pathlib import Path
+import tracing
+
+log = logging.getLogger(__name__)
+
+
+class GitHubResolver:
+    """Find out which lesson repositories and branches exist.
+
+    Parameters
+    ----------
+    session: requests.Session
+        The HTTP session to send requests with, which is reused for every
+        request.
+    api_url: str
+        The base URL of the GitHub API.
+    git_url: str
+        The base URL of the git repositories.
+    cache_dir: str
+        The directory to cache API responses in. If None, responses are only
+        cached in memory.
+    """
+
+    def __init__(self, session, api_url, git_url, cache_dir=None):
+        self.session = session
+        self.api_url = api_url
+        self.git_url = git_url
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self._results = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+        token = os.environ.get("GITHUB_TOKEN")
+        if token:
+            self.session.headers["Authorization"] = f"token {token}"
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _memoize(self, key, function, *args):
+        """Call a function once for each key, even from multiple threads."""
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._results:
+                self._results[key] = function(*args)
+
+        return self._results[key]
+
+    def get(self, path):
+        """Send a conditional GET request to the GitHub API.
+
+        If a response for the same URL has been cached, its ETag is sent so the
+        API can reply with "304 Not Modified" instead of the full response.
+
+        Parameters
+        ----------
+        path: str
+            The path of the API endpoint, e.g. /repos/{org}/{name}.
+
+        Returns
+        -------
+        status_code: int
+            The status code of the response. A 304 response is returned as
+            the status code of the cached response.
+        """
+        url = f"{self.api_url}{path}"
+        cache_file = None
+        cached = None
+        headers = {}
+
+        if self.cache_dir:
+            cache_file = self.cache_dir / f"{hashlib.sha1(url.encode()).hexdigest()}.json"
+            try:
+                with open(cache_file) as fp:
+                    cached = json.load(fp)
+                headers["If-None-Match"] = cached["etag"]
+            except (OSError, ValueError, KeyError):
+                cached = None
+
+        with tracing.span(path, "http"):
+            r = self.session.get(url, headers=headers)
+        if r.status_code == 304 and cached:
+            log.info(f"{url} has not been modified")
+            return cached["status"]
+
+        etag = r.headers.get("ETag")
+        if cache_file and etag:
+            with open(cache_file, "w") as fp:
+                json.dump({"url": url, "etag": etag, "status": r.status_code}, fp)
+
+        return r.status_code
+
+    def repo_exists(self, org, name):
+        """Check if a repository exists.
+
+        Parameters
+        ----------
+        org: str
+            The organisation the repository belongs to.
+        name: str
+            The name of the repository.
+
+        Returns
+        -------
+        exists: bool
+            True if the repository exists.
+        """
+        return self._memoize(("repo", org, name), lambda: self.get(f"/repos/{org}/{name}") == 200)
+
+    def branches(self, org, name):
+        """Get every branch of a repository, and the commit it points to.
+
+        Parameters
+        ----------
+        org: str
+            The organisation the repository belongs to.
+        name: str
+            The name of the repository.
+
+        Returns
+        -------
+        branches: dict[str, str]
+            The SHA of the commit at the tip of each branch.
+        """
+        return self._memoize(("branches", org, name), self._ls_remote, org, name)
+
+    def _ls_remote(self, org, name):
+        process = tracing.run(
+            ["git", "ls-remote", "--heads", f"{self.git_url}/{org}/{name}.git"],
+            capture_output=True, text=True, env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+        )
+        if process.returncode != 0:
+            log.warning(f"Unable to list the branches of {org}/{name}")
+            return {}
+
+        branches = {}
+        for line in process.stdout.splitlines():
+            sha, ref = line.split()
+            branches[ref.removeprefix("refs/heads/")] = sha
+
+        return branches
+
+    def prefetch(self, repos, executor):
+        """Look up a batch of repositories concurrently.
+
+        Parameters
+        ----------
+        repos: list[tuple[str, str]]
+            The organisation and name of each repository.
+        executor: concurrent.futures.Executor
+            The executor to run the look ups with.
+        """
+        repos = list(dict.fromkeys(repos))
+        exists = list(executor.map(lambda repo: self.repo_exists(*repo), repos))
+        list(executor.map(lambda repo: self.branches(*repo), [repo for repo, e in zip(repos, exists) if e]))
@@ -0,0 +1,240 @@
+"""Knit the R Markdown episodes which have changed since the last build.
+
+Each collections/_episodes_rmd/{lesson}-lesson/{episode}.Rmd is rendered to
+collections/_episodes/{lesson}-lesson/{episode}.md, numbered in the same way as
+get_schedules.py numbers the episodes. An episode is only rendered again if the
+hash of the Rmd file, renv.lock and the lesson's {lesson}_setup.R has changed,
+or its output is missing. The hashes and the outputs are recorded in
+.build/knit.json, and the outputs of episodes which have been removed or
+renamed are deleted.
+
+Each render is a separate process, so several episodes are rendered at once
+with --workers. Once an episode has been rendered, the {: .challenge} style
+tags which knitr misplaces are fixed in a single pass over its output.
+
+The command which renders an episode can be changed with --renderer (or the
+KNIT_RENDERER environment variable), e.g. to test the build without R. The
+command is split like a shell command, and {input} and {output_dir} are
+replaced with the Rmd file and the directory to write the output to.
+"""
+
+import os
+import re
+import json
+import shlex
+import hashlib
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from shutil import rmtree
+from episode_index import numbered_names
+import tracing
+
+log = logging.getLogger(__name__)
+
+RMD_DIR = Path("collections/_episodes_rmd")
+MD_DIR = Path("collections/_episodes")
+MANIFEST = Path(".build/knit.json")
+DEFAULT_RENDERER = os.environ.get(
+    "KNIT_RENDERER",
+    "Rscript -e 'rmarkdown::render(commandArgs(TRUE)[1], knit_root_dir=getwd(), output_dir=commandArgs(TRUE)[2])' "
+    "{input} {output_dir}",
+)
+
+# knitr puts the tag after a block quote on the same line as its last line,
+# e.g. "> text{: .output}", rather than on a line of its own
+INLINE_TAG = re.compile(r"([>\s]*)(>\s)(.*?)(\{: \.[a-zA-Z]+\})")
+# and a challenge tag has to start a line
+CHALLENGE_TAG = re.compile(r"(?<!\n)\{: .challenge\}")
+
+
+def load_manifest():
+    """Get the hash and output of each episode from the last build."""
+    try:
+        with open(MANIFEST) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def knitted_outputs():
+    """Get the outputs of every episode which has been knitted.
+
+    Returns
+    -------
+    outputs: list[str]
+        The path of each output, relative to collections/.
+    """
+    return [Path(record["output"]).relative_to(MD_DIR.parent).as_posix() for record in load_manifest().values()]
+
+
+def episode_hash(rmd):
+    """Get the hash of everything which the output of an episode depends on.
+
+    Parameters
+    ----------
+    rmd: pathlib.Path
+        The Rmd file of the episode.
+
+    Returns
+    -------
+    hash: str
+        The hex digest of the Rmd file, renv.lock and the lesson's setup file.
+    """
+    lesson_name = rmd.parent.name.removesuffix("-lesson")
+    sha1 = hashlib.sha1()
+    for path in (rmd, Path("renv.lock"), Path(f"{lesson_name}_setup.R")):
+        sha1.update(f"{path}\0".encode())
+        if path.is_file():
+            sha1.update(path.read_bytes())
+
+    return sha1.hexdigest()
+
+
+def fix_tags(path):
+    """Put the tags which knitr misplaces on their own lines.
+
+    This does the same as the two perl one-liners which were previously run
+    over every episode, in one pass over a single output.
+
+    Parameters
+    ----------
+    path: pathlib.Path
+        The rendered markdown file.
+    """
+    tmp = Path(f"{path}.knit-tmp")
+    previous = ""
+
+    with open(path, "r", encoding="utf-8") as fin, open(tmp, "w", encoding="utf-8") as fout:
+        for line in fin:
+            line = INLINE_TAG.sub(r"\1\2\3\n\1\4\n\1", line)
+            # The last character of the previous line is included, so the
+            # look behind works across lines
+            line = CHALLENGE_TAG.sub("\n{: .challenge}", previous + line)[len(previous):]
+            fout.write(line)
+            previous = line[-1:]
+
+    os.replace(tmp, path)
+
+
+def render(rmd, output, renderer=DEFAULT_RENDERER):
+    """Render an episode, and fix the tags in the output.
+
+    The episode is rendered into a directory of its own, so that episodes
+    which are rendered at the same time can not overwrite each other, and then
+    moved to output.
+
+    Parameters
+    ----------
+    rmd: pathlib.Path
+        The Rmd file to render.
+    output: pathlib.Path
+        The markdown file to write.
+    renderer: str
+        The command which renders the episode.
+    """
+    render_dir = output.parent / f".knit-{rmd.stem}"
+    render_dir.mkdir(parents=True, exist_ok=True)
+
+    try:
+        command = [arg.format(input=rmd, output_dir=render_dir) for arg in shlex.split(renderer)]
+        with tracing.span(rmd.name, "render"):
+            process = tracing.run(command, "render", capture_output=True, text=True)
+        if process.returncode != 0:
+            raise RuntimeError(f"Unable to render {rmd}:\n{process.stderr}")
+        rendered = render_dir / f"{rmd.stem}.md"
+        if not rendered.is_file():
+            raise FileNotFoundError(f"Rendering {rmd} did not create {rendered}")
+        fix_tags(rendered)
+        os.replace(rendered, output)
+    finally:
+        rmtree(render_dir, ignore_errors=True)
+
+    log.info(f"Rendered {rmd} to {output}")
+
+
+def knit(workers=1, renderer=DEFAULT_RENDERER, force=False):
+    """Render the episodes which have changed.
+
+    Parameters
+    ----------
+    workers: int
+        The number of episodes to render at once.
+    renderer: str
+        The command which renders an episode.
+    force: bool
+        If True, render every episode.
+
+    Returns
+    -------
+    stats: dict
+        The number of episodes which were "rendered" and "unchanged".
+    """
+    old_manifest = load_manifest()
+    manifest = {}
+    stale = []
+
+    for lesson_dir in sorted(path for path in RMD_DIR.glob("*") if path.is_dir()):
+        # The outputs are given the names get_schedules.py numbers them to,
+        # so they are not renamed, and therefore rendered again, every build
+        rmds = sorted(lesson_dir.glob("*.Rmd"))
+        new_names = numbered_names([f"{rmd.stem}.md" for rmd in rmds])
+        for rmd in rmds:
+            output = MD_DIR / lesson_dir.name / new_names.get(f"{rmd.stem}.md", f"{rmd.stem}.md")
+            record = {"hash": episode_hash(rmd), "output": output.as_posix()}
+            if not force and old_manifest.get(rmd.as_posix()) == record and output.is_file():
+                manifest[rmd.as_posix()] = record
+            else:
+                stale.append((rmd, output, record))
+
+    def run(item):
+        rmd, output, record = item
+        render(rmd, output, renderer)
+        manifest[rmd.as_posix()] = record
+
+    # The manifest is written even if a render fails, so the episodes which did
+    # render are not rendered again
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            list(executor.map(run, stale))
+    finally:
+        MANIFEST.parent.mkdir(parents=True, exist_ok=True)
+        with open(MANIFEST, "w") as fp:
+            json.dump(manifest, fp, indent=0, sort_keys=True)
+
+    outputs = {record["output"] for record in manifest.values()}
+    for record in old_manifest.values():
+        if record["output"] not in outputs:
+            Path(record["output"]).unlink(missing_ok=True)
+
+    stats = {"rendered": len(stale), "unchanged": len(manifest) - len(stale)}
+    log.info(f"Knitted the R Markdown episodes: {stats}")
+
+    return stats
+
+
+def main():
+    """Main function of the script.
+
+    Render the episodes which have changed since the last build.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", nargs="?", default=".",
+                        help="the root directory of the website")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="the number of episodes to render at once")
+    parser.add_argument("--renderer", default=DEFAULT_RENDERER,
+                        help="the command to render an episode, with {input} and {output_dir} placeholders")
+    parser.add_argument("--force", action="store_true",
+                        help="render every episode, even if it has not changed")
+    args = parser.parse_args()
+
+    os.chdir(args.directory)
+    stats = knit(args.workers, args.renderer, args.force)
+    print(f"{stats['rendered']} episode(s) rendered, {stats['unchanged']} unchanged")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""A persistent, on-disk cache of lesson repositories.
+
+Each entry is a clone of a lesson repository at a specific commit, so an entry
+never goes stale: when a branch moves on, it resolves to a different commit and
+therefore a different entry. The cache is bounded in size, and the least
+recently used entries are evicted first.
+
+The layout of the cache directory is:
+
+    {cache_dir}/{org}/{name}/{key}/repo/        the clone, including .git
+    {cache_dir}/{org}/{name}/{key}/entry.json   its size, and when it was used
+"""
+
+import os
+import json
+import time
+import logging
+import tempfile
+from pathlib import Path
+from shutil import copytree, rmtree
+import tracing
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "rsg-lessons"
+DEFAULT_CACHE_SIZE = 2048  # MB
+
+
+class LessonCache:
+    """A size-bounded, least recently used cache of lesson repositories.
+
+    Parameters
+    ----------
+    directory: str
+        The directory to store the cache in.
+    max_size: int
+        The maximum size of the cache, in bytes.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE * 1024 ** 2):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _entry(self, org, name, key):
+        return self.directory / org / name / key
+
+    def get(self, org, name, key):
+        """Get the location of a cached repository.
+
+        Parameters
+        ----------
+        org: str
+            The organisation the repository belongs to.
+        name: str
+            The name of the repository.
+        key: str
+            The commit SHA of the cached clone.
+
+        Returns
+        -------
+        path: pathlib.Path
+            The location of the repository, or None if it is not in the cache.
+        """
+        entry = self._entry(org, name, key)
+        if not (entry / "entry.json").is_file():
+            return None
+
+        # Touch the entry so it is the most recently used
+        os.utime(entry / "entry.json")
+
+        return entry / "repo"
+
+    def restore(self, org, name, key, dest):
+        """Copy a cached repository to dest.
+
+        Parameters
+        ----------
+        org: str
+            The organisation the repository belongs to.
+        name: str
+            The name of the repository.
+        key: str
+            The commit SHA of the cached clone.
+        dest: str
+            Where to copy the repository to.
+
+        Returns
+        -------
+        restored: bool
+            True if the repository was in the cache and has been copied.
+        """
+        path = self.get(org, name, key)
+        if path is None:
+            return False
+
+        with tracing.span(f"restore {org}/{name}", "copy"):
+            copytree(path, dest, symlinks=True)
+        log.info(f"Restored {org}/{name} at {key} from the cache")
+
+        return True
+
+    def put(self, org, name, key, src):
+        """Add a repository to the cache.
+
+        The repository is copied to a temporary directory in the cache first,
+        so an entry only appears once it is complete.
+
+        Parameters
+        ----------
+        org: str
+            The organisation the repository belongs to.
+        name: str
+            The name of the repository.
+        key: str
+            The commit SHA of the clone.
+        src: str
+            The location of the clone to add.
+        """
+        entry = self._entry(org, name, key)
+        if (entry / "entry.json").is_file():
+            return
+
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(prefix=f".{key}-", dir=entry.parent))
+        with tracing.span(f"cache {org}/{name}", "copy"):
+            copytree(src, tmp / "repo", symlinks=True)
+        with open(tmp / "entry.json", "w") as fp:
+            json.dump({"size": directory_size(tmp / "repo"), "added": time.time()}, fp)
+
+        try:
+            tmp.rename(entry)
+        except OSError:
+            # Another build added the same entry first
+            rmtree(tmp, ignore_errors=True)
+
+    def entries(self):
+        """Get every entry in the cache.
+
+        Returns
+        -------
+        entries: list[tuple[float, int, pathlib.Path]]
+            The time each entry was last used, its size in bytes and its
+            location, with the least recently used first.
+        """
+        entries = []
+        for metadata in self.directory.glob("*/*/*/entry.json"):
+            try:
+                with open(metadata) as fp:
+                    size = json.load(fp)["size"]
+                entries.append((metadata.stat().st_mtime, size, metadata.parent))
+            except (OSError, ValueError, KeyError):
+                continue
+
+        return sorted(entries)
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits.
+
+        Returns
+        -------
+        n_evicted: int
+            The number of entries which were removed.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        n_evicted = 0
+
+        for _, size, entry in entries:
+            if total <= self.max_size:
+                break
+            rmtree(entry, ignore_errors=True)
+            total -= size
+            n_evicted += 1
+            log.info(f"Evicted {entry} from the cache")
+
+        return n_evicted
+
+
+def directory_size(path, exclude=None):
+    """Get the total size of the files in a directory.
+
+    Parameters
+    ----------
+    path: str
+        The directory to measure.
+    exclude: str
+        The name of a directory, in the top level of path, to not include.
+
+    Returns
+    -------
+    size: int
+        The total size of the files, in bytes.
+    """
+    path = str(path)
+    size = 0
+    for root, dirs, files in os.walk(path):
+        if root == path and exclude in dirs:
+            dirs.remove(exclude)
+        size += sum(os.lstat(os.path.join(root, file)).st_size for file in files)
+
+    return size
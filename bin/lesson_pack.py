@@ -0,0 +1,375 @@
+"""Create and read lesson packs, so websites can be built without fetching.
+
+A lesson pack is a single zip file holding everything the build uses from one
+lesson: the episodes, figures, data, slides and includes, and the files at the
+top of the repository (setup.md, blurb.txt, renv.lock, ...). The first member
+is manifest.json, which holds
+
+    format      the version of the pack format, PACK_FORMAT
+    org, name, branch, commit
+                where the lesson came from
+    files       the size and sha1 of each file in the pack
+    schedules   the (time, session) rows of each table in the lesson's
+                schedule.html, already parsed (see schedule_table.py)
+    setup       the lesson's setup.md, already cleaned up (see
+                clean_setup_md.py)
+    blurb       the lesson's blurb.txt
+
+The packs for a website are kept in one directory, as {gh-name}.zip, and
+reveal.js as reveal.js.zip. When a build is given the directory (--packs), the
+lessons which have a pack are extracted from it rather than being looked up
+and cloned, and get_schedules.py and clean_setup_md.py read the schedules and
+setup from the manifests instead of parsing the files again. A zip has an index
+of its members, so the manifest, or any one file, is read without reading the
+rest of the pack. With a pack for every lesson, and for reveal.js, the build
+needs no network access.
+
+The packs are created from the lessons of a website which has been built:
+
+    python bin/lesson_pack.py [directory] --output ../packs
+"""
+
+import os
+import json
+import stat
+import logging
+import zipfile
+import argparse
+import hashlib
+from pathlib import Path
+from schedule_table import parse_schedules
+from site_config import load_config
+import tracing
+
+log = logging.getLogger(__name__)
+
+PACK_FORMAT = 1
+MANIFEST = "manifest.json"
+REVEAL_JS_PACK = "reveal.js"
+
+# The directories which the build uses from each lesson, as in
+# get_submodules.SPARSE_PATHS. Files at the top of a lesson are always packed
+PACK_PATHS = ("_episodes", "_episodes_rmd", "fig", "data", "slides", "_includes/rsg")
+
+# Members which are already compressed are stored as they are
+STORED_SUFFIXES = {".png", ".jpg", ".jpeg", ".gif", ".zip", ".gz", ".pdf", ".woff", ".woff2"}
+
+# Every member has the same timestamp, so packing the same files twice gives
+# the same pack
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+
+
+def pack_path(packs, name):
+    """Get the path of the pack for a lesson.
+
+    Parameters
+    ----------
+    packs: str
+        The directory of lesson packs.
+    name: str
+        The gh-name of the lesson, or REVEAL_JS_PACK.
+
+    Returns
+    -------
+    path: pathlib.Path
+        The path the pack is at, if it exists.
+    """
+    return Path(packs) / f"{name}.zip"
+
+
+def packed_files(directory, paths=PACK_PATHS):
+    """Get the files in a lesson which are put in its pack.
+
+    Parameters
+    ----------
+    directory: str
+        The checkout of the lesson.
+    paths: list[str]
+        The directories to pack, as well as the files at the top of the lesson.
+        If None, every file is packed.
+
+    Returns
+    -------
+    files: list[str]
+        The paths of the files, relative to directory, in sorted order.
+    """
+    files = []
+    for root, dirs, filenames in os.walk(directory):
+        dirs[:] = [d for d in dirs if d != ".git"]
+        rel_root = Path(root).relative_to(directory)
+        for filename in filenames:
+            rel = (rel_root / filename).as_posix()
+            if filename == ".git" or not Path(root, filename).is_file():
+                continue
+            if paths is None or rel_root == Path(".") or wanted(rel, paths):
+                files.append(rel)
+
+    return sorted(files)
+
+
+def wanted(rel, paths):
+    """Check if a file is in one of the directories the build uses."""
+    return any(rel.startswith(f"{path}/") for path in paths)
+
+
+def read_text(path):
+    """Read a text file, or return None if it does not exist."""
+    try:
+        with open(path, "r", encoding="utf-8") as fp:
+            return fp.read()
+    except OSError:
+        return None
+
+
+def write_pack(directory, path, metadata, paths=PACK_PATHS):
+    """Write the pack for a lesson, from a checkout of the lesson.
+
+    Parameters
+    ----------
+    directory: str
+        The checkout of the lesson.
+    path: str
+        The file to write the pack to.
+    metadata: dict
+        The org, name, branch and commit of the lesson, for the manifest.
+    paths: list[str]
+        The directories to pack, as well as the files at the top of the
+        lesson. If None, every file is packed (e.g. for reveal.js).
+
+    Returns
+    -------
+    manifest: dict
+        The manifest of the pack.
+    """
+    from clean_setup_md import clean_setup_file
+
+    directory = Path(directory)
+    files = packed_files(directory, paths)
+    manifest = {"format": PACK_FORMAT, **metadata, "files": {}}
+
+    for rel in files:
+        content = (directory / rel).read_bytes()
+        manifest["files"][rel] = {"size": len(content), "sha1": hashlib.sha1(content).hexdigest()}
+
+    schedule = read_text(directory / "_includes/rsg/schedule.html")
+    manifest["schedules"] = parse_schedules(schedule) if schedule is not None else None
+    manifest["setup"] = clean_setup_file(directory / "setup.md") if (directory / "setup.md").is_file() else None
+    manifest["blurb"] = read_text(directory / "blurb.txt")
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(f"{path}.tmp")
+    with tracing.span(f"pack {metadata['name']}", "copy"), zipfile.ZipFile(tmp, "w") as pack:
+        pack.writestr(zipfile.ZipInfo(MANIFEST, ZIP_DATE), json.dumps(manifest, indent=1),
+                      compress_type=zipfile.ZIP_DEFLATED)
+        for rel in files:
+            info = zipfile.ZipInfo(rel, ZIP_DATE)
+            info.external_attr = (os.stat(directory / rel).st_mode & 0o777 | stat.S_IFREG) << 16
+            info.compress_type = zipfile.ZIP_STORED if Path(rel).suffix.lower() in STORED_SUFFIXES \
+                else zipfile.ZIP_DEFLATED
+            pack.writestr(info, (directory / rel).read_bytes())
+            tracing.count(files_read=1)
+    os.replace(tmp, path)
+
+    return manifest
+
+
+class LessonPack:
+    """A lesson pack, which is opened to read its manifest and members.
+
+    Parameters
+    ----------
+    path: str
+        The pack file.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a lesson pack, or it is from a newer version of the
+        pack format.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._zip = zipfile.ZipFile(self.path)
+        try:
+            self.manifest = json.loads(self._zip.read(MANIFEST))
+        except (KeyError, ValueError):
+            self._zip.close()
+            raise ValueError(f"{self.path} is not a lesson pack, as it has no {MANIFEST}")
+        if self.manifest.get("format") != PACK_FORMAT:
+            self._zip.close()
+            raise ValueError(f"{self.path} is a lesson pack of format {self.manifest.get('format')}, "
+                             f"but only format {PACK_FORMAT} can be read")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        self._zip.close()
+
+    def read(self, rel):
+        """Read one file from the pack, without reading the others."""
+        return self._zip.read(rel)
+
+    def extract(self, dest, paths=PACK_PATHS):
+        """Extract the files the build uses into a directory.
+
+        Parameters
+        ----------
+        dest: str
+            The directory to extract the files into, which is created if it
+            does not exist.
+        paths: list[str]
+            The directories to extract, as well as the files at the top of the
+            lesson. If None, every file is extracted.
+
+        Returns
+        -------
+        written: int
+            The number of bytes which were extracted.
+        """
+        written = 0
+        with tracing.span(f"unpack {self.path.name}", "copy"):
+            for info in self._zip.infolist():
+                if info.filename == MANIFEST or info.is_dir():
+                    continue
+                if paths is not None and "/" in info.filename and not wanted(info.filename, paths):
+                    continue
+                target = self._zip.extract(info, dest)
+                mode = (info.external_attr >> 16) & 0o777
+                if mode:
+                    os.chmod(target, mode)
+                written += info.file_size
+                tracing.count(files_written=1)
+
+        return written
+
+
+def open_pack(packs, name):
+    """Open the pack for a lesson, if there is one.
+
+    Parameters
+    ----------
+    packs: str
+        The directory of lesson packs, or None.
+    name: str
+        The gh-name of the lesson, or REVEAL_JS_PACK.
+
+    Returns
+    -------
+    pack: LessonPack
+        The opened pack, or None if packs is None or there is no pack for the
+        lesson.
+    """
+    if packs is None:
+        return None
+    path = pack_path(packs, name)
+    if not path.is_file():
+        return None
+
+    return LessonPack(path)
+
+
+def read_manifest(packs, name):
+    """Read the manifest of a lesson's pack, without reading its files.
+
+    Parameters
+    ----------
+    packs: str
+        The directory of lesson packs, or None.
+    name: str
+        The gh-name of the lesson.
+
+    Returns
+    -------
+    manifest: dict
+        The manifest, or None if there is no pack for the lesson.
+    """
+    pack = open_pack(packs, name)
+    if pack is None:
+        return None
+    with pack:
+        return pack.manifest
+
+
+def git_output(*args, cwd):
+    """Run a git command in a checkout, and get its output."""
+    process = tracing.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True)
+
+    return process.stdout.strip()
+
+
+def checkout_metadata(directory, name):
+    """Get the org, name, branch and commit of a checkout for its manifest."""
+    url = git_output("remote", "get-url", "origin", cwd=directory)
+
+    return {
+        "org": url.rstrip("/").removesuffix(".git").split("/")[-2],
+        "name": name,
+        "branch": git_output("rev-parse", "--abbrev-ref", "HEAD", cwd=directory),
+        "commit": git_output("rev-parse", "HEAD", cwd=directory),
+    }
+
+
+def pack_site(website_config, output):
+    """Pack each lesson of a website which has been built, and reveal.js.
+
+    Parameters
+    ----------
+    website_config: dict
+        The configuration for the website.
+    output: str
+        The directory to write the packs to.
+
+    Returns
+    -------
+    manifests: list[dict]
+        The manifest of each pack.
+    """
+    manifests = []
+    names = [lesson["gh-name"] for lesson in website_config["lessons"]
+             if lesson.get("type", None) in ["episode", "episode_r"]]
+
+    for name in names:
+        directory = f"submodules/{name}"
+        if not Path(directory).is_dir():
+            raise FileNotFoundError(f"{directory} does not exist, so build the website before packing its lessons")
+        manifest = write_pack(directory, pack_path(output, name), checkout_metadata(directory, name))
+        manifests.append(manifest)
+
+    if Path("submodules/reveal.js").is_dir():
+        metadata = checkout_metadata("submodules/reveal.js", REVEAL_JS_PACK)
+        manifests.append(write_pack("submodules/reveal.js", pack_path(output, REVEAL_JS_PACK), metadata, None))
+
+    return manifests
+
+
+def main():
+    """Main function of the script.
+
+    Pack each lesson of a website which has been built, and print the size of
+    each pack.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", nargs="?", default=".",
+                        help="the root directory of the website")
+    parser.add_argument("-o", "--output", required=True,
+                        help="the directory to write the packs to")
+    args = parser.parse_args()
+    output = Path(args.output).resolve()
+
+    os.chdir(args.directory)
+    website_config = load_config()
+
+    for manifest in pack_site(website_config, output):
+        path = pack_path(output, manifest["name"])
+        print(f"{path}: {len(manifest['files'])} files, {path.stat().st_size} bytes, "
+              f"commit {manifest['commit'][:10]}")
+
+
+if __name__ == "__main__":
+    main()
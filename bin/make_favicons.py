@@ -1,7 +1,129 @@
+"""Generate the favicons for the website from the base favicon.
+
+The favicons are only generated again if the base favicon, or the set of icons
+to generate, has changed since they were last generated, which is recorded in
+.build/favicons.json. Only the public API of the favicons package is used, so
+the build does not depend on its internals.
+
+The icons which were generated are listed in _data/favicons.json, which
+_includes/favicons.html reads as site.data.favicons to only link to the icons
+which exist:
+
+    files   the file name of each icon
+    icons   for each icon: its file name, rel, width and height
+"""
+
+import json
+import hashlib
+import logging
+from pathlib import Path
 from favicons import Favicons
+from sync_tree import write_if_changed
+import tracing
+
+log = logging.getLogger(__name__)
 
 favicon_dir = "assets/favicons/rsg/"
 base_favicon = favicon_dir+"rsg_fav_base.png"
+STAMP_PATH = Path(".build/favicons.json")
+MANIFEST_PATH = Path("_data/favicons.json")
+
+
+def favicons_digest(favicons):
+    """Get a hash of the base favicon and the icons to generate from it.
+
+    Parameters
+    ----------
+    favicons: favicons.Favicons
+        The favicon generator.
+
+    Returns
+    -------
+    digest: str
+        The hex digest of the base favicon and the format of each icon.
+    """
+    sha1 = hashlib.sha1(Path(favicons.source).read_bytes())
+    sha1.update(json.dumps(favicons.formats(), sort_keys=True).encode())
+
+    return sha1.hexdigest()
+
+
+def read_stamp():
+    """Get the hash from when the favicons were last generated, or None."""
+    try:
+        with open(STAMP_PATH) as fp:
+            return json.load(fp)["digest"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_stamp(digest):
+    """Record the hash of the favicons which have just been generated."""
+    STAMP_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(STAMP_PATH, "w") as fp:
+        json.dump({"digest": digest}, fp)
+
+
+def write_manifest(favicons, path=MANIFEST_PATH):
+    """Write the list of icons to _data, if it has changed.
+
+    Parameters
+    ----------
+    favicons: favicons.Favicons
+        The favicon generator.
+    path: str
+        The file to write the list to.
+
+    Returns
+    -------
+    written: bool
+        True if the file was written.
+    """
+    icons = [
+        {"file": name, "rel": fmt["rel"], "width": fmt["dimensions"][0], "height": fmt["dimensions"][1]}
+        for name, fmt in zip(favicons.filenames(), favicons.formats())
+    ]
+    manifest = {"files": [icon["file"] for icon in icons], "icons": icons}
+
+    return write_if_changed(path, json.dumps(manifest, indent=1))
+
+
+def generate(favicons):
+    """Generate each icon, if the base favicon or the set of icons has changed.
+
+    Parameters
+    ----------
+    favicons: favicons.Favicons
+        The favicon generator, which has been entered.
+
+    Returns
+    -------
+    generated: bool
+        True if the icons were generated, or False if they were up to date.
+    """
+    digest = favicons_digest(favicons)
+    if read_stamp() == digest and all((favicons.output_directory / name).is_file() for name in favicons.filenames()):
+        log.info("Skipping the favicons, as the base favicon has not changed")
+        return False
+
+    with tracing.span("favicons", "render"):
+        favicons.sgenerate()
+
+    write_stamp(digest)
+    log.info(f"Generated {len(favicons.filenames())} favicons from {favicons.source}")
+
+    return True
+
+
+def main():
+    """Main function of the script.
+
+    Generate every size of favicon from the base favicon, if it has changed.
+    """
+    with Favicons(base_favicon, favicon_dir) as favicons:
+        generate(favicons)
+        write_manifest(favicons)
+
 
-with Favicons(base_favicon, favicon_dir) as favicons:
-    favicons.generate()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Share a single copy of reveal.js between the slide decks of every lesson.
+
+Each lesson's slides are written to use a copy of reveal.js in the same
+directory as the slides, e.g. a deck at slides/{lesson}-lesson/index.html loads
+css/reveal.css. Instead of copying reveal.js into every deck, one copy is kept
+at slides/reveal.js-{commit}/ and the references in each deck are rewritten to
+point to it, e.g. ../reveal.js-{commit}/css/reveal.css. As the store is named
+after the reveal.js commit, a deck can never point at a different version of
+reveal.js than the one it was rewritten for.
+"""
+
+import os
+import re
+import posixpath
+from pathlib import Path
+
+# Quoted strings which could be relative paths, in attributes (src="...") or
+# in scripts (e.g. the plugin dependencies passed to Reveal.initialize)
+QUOTED_PATH = re.compile(r"""(?P<quote>["'])(?P<path>[^"'\s<>(){}]+?)(?P=quote)""")
+SLIDE_SUFFIXES = {".html", ".htm"}
+
+
+def store_name(commit):
+    """Get the name of the directory the reveal.js store is kept in.
+
+    Parameters
+    ----------
+    commit: str
+        The reveal.js commit in the store.
+
+    Returns
+    -------
+    name: str
+        The name of the directory, relative to slides/.
+    """
+    return f"reveal.js-{commit}"
+
+
+def list_files(directory):
+    """Get every file in a directory, ignoring .git.
+
+    Parameters
+    ----------
+    directory: str
+        The directory to list.
+
+    Returns
+    -------
+    files: set[str]
+        The paths of the files, relative to directory.
+    """
+    files = set()
+    for root, dirs, filenames in os.walk(directory):
+        dirs[:] = [d for d in dirs if d != ".git"]
+        rel_root = Path(root).relative_to(directory)
+        files.update((rel_root / file).as_posix() for file in filenames if file != ".git")
+
+    return files
+
+
+def split_path(reference):
+    """Split a reference into its path and its query string or fragment.
+
+    Returns
+    -------
+    path: str
+        The path of the reference, or None if it is not a relative path.
+    suffix: str
+        The query string and/or fragment.
+    """
+    if not reference or reference.startswith(("/", "#", "data:")) or ":" in reference.split("/")[0]:
+        return None, ""
+    match = re.match(r"([^?#]*)(.*)", reference)
+
+    return match.group(1), match.group(2)
+
+
+def rewrite_references(html, html_path, store, store_files):
+    """Rewrite the references to reveal.js in a slide deck to use the store.
+
+    A reference is rewritten if it points to a file which is in reveal.js,
+    either directly (css/reveal.css) or through the lesson's own, empty,
+    reveal.js directory (reveal.js/css/reveal.css).
+
+    Parameters
+    ----------
+    html: str
+        The contents of the HTML file.
+    html_path: str
+        The path of the HTML file, relative to the deck.
+    store: str
+        The path of the store, relative to the deck.
+    store_files: set[str]
+        The files in the store.
+
+    Returns
+    -------
+    html: str
+        The HTML, with references to the store.
+    """
+    html_dir = posixpath.dirname(html_path)
+
+    def replace(match):
+        path, suffix = split_path(match.group("path"))
+        if not path:
+            return match.group(0)
+        target = posixpath.normpath(posixpath.join(html_dir, path))
+        if target.startswith("reveal.js/"):
+            target = target[len("reveal.js/"):]
+        if target not in store_files:
+            return match.group(0)
+        new_path = posixpath.relpath(posixpath.join(store, target), html_dir or ".")
+        return f"{match.group('quote')}{new_path}{suffix}{match.group('quote')}"
+
+    return QUOTED_PATH.sub(replace, html)
+
+
+def verify_slides(slides_dir="slides"):
+    """Check every slide deck can find the reveal.js files it uses.
+
+    Every relative reference in the HTML files of each deck which points into
+    a reveal.js store, or to a file which is part of reveal.js, has to exist.
+
+    Parameters
+    ----------
+    slides_dir: str
+        The directory containing the decks and the reveal.js store(s).
+
+    Returns
+    -------
+    missing: list[str]
+        A description of each reference which could not be found.
+    """
+    slides_dir = Path(slides_dir)
+    if not slides_dir.is_dir():
+        return []
+
+    stores = [path for path in slides_dir.iterdir() if path.is_dir() and path.name.startswith("reveal.js-")]
+    reveal_files = set().union(*(list_files(store) for store in stores))
+    missing = []
+
+    for deck in sorted(slides_dir.glob("*-lesson")):
+        for html_path in sorted(deck.rglob("*")):
+            if html_path.suffix not in SLIDE_SUFFIXES:
+                continue
+            with open(html_path, encoding="utf-8", errors="replace") as fp:
+                html = fp.read()
+            for match in QUOTED_PATH.finditer(html):
+                path, _ = split_path(match.group("path"))
+                if not path:
+                    continue
+                target = Path(os.path.normpath(html_path.parent / path))
+                try:
+                    rel = target.relative_to(slides_dir).as_posix()
+                except ValueError:
+                    continue
+                in_store = rel.startswith("reveal.js-")
+                looks_like_reveal = rel.split("/", 1)[-1] in reveal_files
+                if (in_store or looks_like_reveal) and not target.is_file():
+                    missing.append(f"{html_path}: {match.group('path')}")
+
+    return missing
@@ -0,0 +1,206 @@
+"""Move lesson schedules to their start times, and render them as HTML.
+
+The times of each day of a schedule are kept as whole minutes since midnight,
+in an array, so moving a day to the start time in _config.yml is one pass of
+integer additions over the array, rather than parsing each time again with
+strptime. Each time is then formatted by looking it up in TIME_LABELS.
+
+_includes/rsg/schedule.html is rendered with templates which already hold the
+indentation of the output, so each block is formatted as it is written and the
+document is joined once, rather than being built up with += and then parsed
+again by BeautifulSoup to format it. For a workshop, the output is the same as
+BeautifulSoup's prettify gave, apart from markup in titles and sessions now
+being escaped:
+
+    <div class="row">
+     <div class="col-md-6">
+      <a href="{lesson}-schedule">
+       <h3>
+        {title}
+       ...
+
+For a course, the blurb.txt of each lesson is HTML which is inserted as it is
+written, without its whitespace being changed. prettify put each of its tags
+and each run of text on a line of its own, indented by how deeply it is
+nested, so the HTML differs in its whitespace from before, but not in how it
+is displayed.
+"""
+
+from array import array
+from html import escape
+
+MINUTES_PER_DAY = 24 * 60
+
+# "HH:MM" for each minute of the day
+TIME_LABELS = [f"{hours:02d}:{minutes:02d}" for hours in range(24) for minutes in range(60)]
+
+ROW = """\
+   <tr>
+    <td>
+     {time}
+    </td>
+    <td>
+     {session}
+    </td>
+   </tr>
+"""
+
+DAY = """\
+ <div class="col-md-6">
+  <a href="{lesson}-schedule">
+   <h3>
+    {title}
+   </h3>
+  </a>
+  <h4>
+   {date}
+  </h4>
+  <table class="table table-striped">
+{rows}\
+  </table>
+ </div>
+"""
+
+COURSE_LESSON = """\
+ <div class="col-md-6">
+  <a href="{lesson}-schedule">
+   <h3>
+    {title}
+   </h3>
+  </a>
+  {blurb}
+ </div>
+"""
+
+ROW_OF_LESSONS = """\
+<div class="row">
+{lessons}\
+</div>
+"""
+
+# The format method of each template, which is called for each block
+_row = ROW.format
+_day = DAY.format
+_course_lesson = COURSE_LESSON.format
+_row_of_lessons = ROW_OF_LESSONS.format
+
+
+def to_minutes(time):
+    """Convert a time in a schedule table (e.g. "09:30") to minutes since midnight.
+
+    Raises
+    ------
+    ValueError
+        If the time is not in 24 hour format.
+    """
+    hours, sep, minutes = time.strip().partition(":")
+    if not sep or not hours.isdigit() or not minutes.isdigit() or int(hours) > 23 or int(minutes) > 59:
+        raise ValueError(f"The time '{time}' in a schedule is not in 24 hr format (15:00)")
+
+    return int(hours) * 60 + int(minutes)
+
+
+class DaySchedule:
+    """The sessions of one day of a lesson, and the minute each one starts.
+
+    Parameters
+    ----------
+    minutes: array.array
+        The start of each session, in minutes since midnight.
+    sessions: list[str]
+        The title of each session.
+    """
+
+    __slots__ = ("minutes", "sessions")
+
+    def __init__(self, minutes, sessions):
+        self.minutes = minutes
+        self.sessions = sessions
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Create a day from the (time, session) rows of a schedule table."""
+        return cls(array("H", [to_minutes(time) for time, _ in rows]), [session for _, session in rows])
+
+    def starting_at(self, start):
+        """Move every session, so that the day starts at a different time.
+
+        Parameters
+        ----------
+        start: int
+            The new start time of the day, in minutes since midnight.
+
+        Returns
+        -------
+        day: DaySchedule
+            The day, with each session moved by the same amount. Times which
+            pass midnight wrap around, as they did with datetime.
+        """
+        if not self.minutes:
+            return self
+        delta = start - self.minutes[0]
+
+        return DaySchedule(array("H", [(minute + delta) % MINUTES_PER_DAY for minute in self.minutes]), self.sessions)
+
+    def render(self, lesson, title, date):
+        """Render the day as a column of _includes/rsg/schedule.html.
+
+        Parameters
+        ----------
+        lesson: str
+            The gh-name of the lesson.
+        title: str
+            The title of the day.
+        date: str
+            The date of the day, as it is displayed.
+
+        Returns
+        -------
+        html: str
+            The formatted HTML of the column.
+        """
+        rows = "".join([_row(time=TIME_LABELS[minute], session=escape(session, quote=False))
+                        for minute, session in zip(self.minutes, self.sessions)])
+
+        return _day(lesson=lesson, title=escape(title, quote=False), date=date, rows=rows)
+
+
+def render_course_lesson(lesson, title, blurb):
+    """Render a lesson of a course, which has no times, as a column.
+
+    Parameters
+    ----------
+    lesson: str
+        The gh-name of the lesson.
+    title: str
+        The title of the lesson.
+    blurb: str
+        The HTML describing the lesson, e.g. from its blurb.txt, which is
+        inserted as it is, apart from leading and trailing whitespace.
+
+    Returns
+    -------
+    html: str
+        The formatted HTML of the column.
+    """
+    return _course_lesson(lesson=lesson, title=escape(title, quote=False), blurb=blurb.strip())
+
+
+def render_index(columns):
+    """Render the columns of the lessons two to a row, filling the left side first.
+
+    Parameters
+    ----------
+    columns: list[str]
+        The HTML of each column, in order.
+
+    Returns
+    -------
+    html: str
+        The formatted HTML of every row.
+    """
+    n_rows = (len(columns) + 1) // 2
+    left = columns[:n_rows]
+    right = columns[n_rows:] + [""]
+
+    return "".join([_row_of_lessons(lessons=left[i] + right[i]) for i in range(n_rows)])
@@ -0,0 +1,114 @@
+"""Parse the schedule tables in a lesson's schedule.html.
+
+Each lesson has an _includes/rsg/{lesson}-lesson/schedule.html, containing one
+table for each day of the lesson. Each row of a table is the start time of a
+session and its title, e.g.
+
+    <table>
+      <tr> <td> 09:00 </td> <td> <a href="...">Introduction</a> </td> </tr>
+      <tr> <td> 09:30 </td> <td> Break </td> </tr>
+    </table>
+
+The tables are read in a single pass with the standard library's HTMLParser,
+which is much faster to import and run than building a document tree. The
+text of each cell is extracted in the same way as pandas.read_html: markup is
+removed and whitespace is collapsed. Header rows, made only of <th> cells or
+inside <thead>, are skipped. The tables of each schedule are kept, so a
+schedule which is shared by several sites in a batch build (see batch_build.py)
+is only parsed once.
+"""
+
+import re
+import functools
+from html.parser import HTMLParser
+
+WHITESPACE = re.compile(r"\s+")
+
+
+class ScheduleParser(HTMLParser):
+    """Collect the (time, session) rows of each table in a HTML document.
+
+    Feed the document to the parser, then read the tables from the tables
+    attribute. Tables nested inside a cell are treated as part of the cell.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tables = []
+        self._depth = 0
+        self._in_head = False
+        self._row = None
+        self._row_is_header = True
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "table":
+            self._depth += 1
+            if self._depth == 1:
+                self.tables.append([])
+        elif self._depth != 1:
+            return
+        elif tag == "thead":
+            self._in_head = True
+        elif tag == "tr":
+            self._row = []
+            self._row_is_header = True
+        elif tag in ("td", "th") and self._row is not None:
+            self._end_cell()
+            self._cell = []
+            if tag == "td":
+                self._row_is_header = False
+        elif tag == "br" and self._cell is not None:
+            self._cell.append(" ")
+
+    def handle_endtag(self, tag):
+        if tag == "table":
+            if self._depth == 1:
+                self._end_row()
+            self._depth = max(0, self._depth - 1)
+        elif self._depth != 1:
+            return
+        elif tag == "thead":
+            self._in_head = False
+        elif tag in ("td", "th"):
+            self._end_cell()
+        elif tag in ("tr", "tbody", "tfoot"):
+            self._end_row()
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+    def _end_cell(self):
+        if self._cell is not None:
+            self._row.append(WHITESPACE.sub(" ", "".join(self._cell)).strip())
+            self._cell = None
+
+    def _end_row(self):
+        self._end_cell()
+        if self._row and not self._row_is_header and not self._in_head:
+            time, session = (self._row + ["", ""])[:2]
+            self.tables[-1].append((time, session))
+        self._row = None
+
+
+@functools.lru_cache(maxsize=None)
+def parse_schedules(html):
+    """Get the rows of every schedule table in a HTML document.
+
+    Parameters
+    ----------
+    html: str
+        The contents of schedule.html.
+
+    Returns
+    -------
+    schedules: list[list[tuple[str, str]]]
+        For each table, the time and session of each row. The same list is
+        returned each time a document is parsed, so it must not be modified.
+    """
+    parser = ScheduleParser()
+    parser.feed(html)
+    parser.close()
+
+    return parser.tables
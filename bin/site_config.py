@@ -0,0 +1,362 @@
+"""Load _config.yml, and the lessons in it, once for every script in bin/.
+
+Each script used to open _config.yml and parse it on its own, and then parse
+the dates and start times of each lesson again with dateutil and strptime.
+Instead, load_config parses the file (with the C YAML loader, when PyYAML has
+been built with it) and turns each lesson into a Lesson, which holds
+
+    name, org, branch, title, order
+                as they are in _config.yml
+    type        the LessonType, or None if it is not a known type
+    dates       a datetime.date for each day, or None for a date which can
+                not be parsed
+    starts      the start time of each day, in minutes since midnight, or
+                None for a time which can not be parsed
+
+The config and its lessons are pickled to .build/config.pickle, next to
+_config.yml, with the modification time, size and sha1 of the file. The next
+time the config is loaded, by a later stage or a later build, the pickle is
+used if the file has the same modification time and size, or else if it has
+the same hash (e.g. after a git checkout), so neither the YAML nor the dates
+are parsed again. The lessons are also kept in memory by their entry in the
+config, so get_lessons is a lookup for a config which has been loaded, even
+when a stage has been given its own copy of it.
+
+Mistakes in the config are not reported here, but by validate_config.py.
+"""
+
+import os
+import pickle
+import hashlib
+import datetime
+import logging
+import threading
+from enum import Enum
+from pathlib import Path
+import yaml
+try:
+    from yaml import CLoader as Loader
+except ImportError:
+    from yaml import Loader
+import dateutil.parser
+import tracing
+
+log = logging.getLogger(__name__)
+
+CONFIG_FILE = "_config.yml"
+CACHE_FILE = Path(".build/config.pickle")
+
+# The version of the pickled cache, which is changed whenever Lesson is, so an
+# old cache is parsed again rather than unpickled into the wrong shape
+CACHE_FORMAT = 1
+
+# The lessons which have been normalised, by the repr of their entry in the
+# config, and the pickled config of each file which has been loaded
+_LESSONS = {}
+_LOADED = {}
+_lock = threading.Lock()
+
+
+class LessonType(Enum):
+    """Enum for the different types of lessons.
+    """
+    markdown = "episode"
+    r_markdown = "episode_r"
+
+
+def as_list(value):
+    """Get a value from _config.yml which can be a single value or a list."""
+    return value if isinstance(value, list) else [value]
+
+
+def get_date_object(datestr):
+    """Convert a date string into a datetime object.
+
+    On failure to convert a string, None is returned.
+
+    Parameters
+    ----------
+    datestr: str
+        The string of the date, in format YYYY-MM-DD. But any which dateutil
+        accepts is also acceptable.
+
+    Returns
+    -------
+    date: datetime.date
+        The date object. If unable to parse, then None is returned instead.
+    """
+    if datestr is None:
+        return None
+
+    if isinstance(datestr, datetime.date):
+        return datestr
+    elif not isinstance(datestr, str):
+        raise ValueError(f"datestr is not a string but {type(datestr)}")
+
+    try:
+        date = dateutil.parser.parse(datestr).date()
+    except dateutil.parser.ParserError:
+        date = None
+
+    return date
+
+
+def get_time_object(time_string):
+    """Convert a string into a datetime object.
+
+    If unable to parse the string, a ValueError exception is raised as we
+    cannot continue when there are missing time objects.
+
+    Parameters
+    ----------
+    time_string: str
+        The time string to convert.
+
+    Returns
+    -------
+    time_object: datetime.datetime
+        The converted string as a datetime object.
+    """
+    if type(time_string) is str:
+        try:
+            time = datetime.datetime.strptime(time_string, "%I:%M %p")   # start-time: 9:30 am
+        except ValueError:
+            time = datetime.datetime.strptime(time_string, "%H:%M")      # start-time: "9:30"
+    elif type(time_string) is int:
+        hours, minutes = divmod(time_string, 60)
+        time = datetime.datetime.strptime(f"{hours}:{minutes}", "%H:%M") # start-time: 9:30
+    else:
+        raise ValueError(f"start-time {time_string} is an invalid format: accept 24 hr (15:00) or 12 hr with am/pm (3:00 pm)")
+
+    return time
+
+
+def parse_date(value):
+    """Parse a date from _config.yml, or return None if it is not a date."""
+    try:
+        return get_date_object(value if isinstance(value, datetime.date) else str(value))
+    except ValueError:
+        return None
+
+
+def parse_start(value):
+    """Parse a start-time from _config.yml into minutes since midnight, or None if it is not a time."""
+    try:
+        time = get_time_object(value)
+    except ValueError:
+        return None
+
+    return time.hour * 60 + time.minute
+
+
+class Lesson:
+    """A lesson from _config.yml, with its dates and start times parsed.
+
+    Parameters
+    ----------
+    name: str
+        The gh-name of the lesson.
+    org: str
+        The org-name of the lesson, or None for the default organisation.
+    branch: str
+        The branch of the lesson, or None for the default branch.
+    title: str
+        The title of the lesson.
+    type: LessonType
+        The type of the lesson, or None if it is not a known type.
+    dates: list[datetime.date]
+        The date of each day of the lesson, or None for those which can not be
+        parsed. Empty if the lesson has no date, e.g. in a course.
+    starts: list[int]
+        The start time of each day, in minutes since midnight, or None for
+        those which can not be parsed.
+    order: int
+        The order of the lesson in a course.
+    """
+
+    __slots__ = ("name", "org", "branch", "title", "type", "dates", "starts", "order")
+
+    def __init__(self, name, org, branch, title, type, dates, starts, order):
+        self.name = name
+        self.org = org
+        self.branch = branch
+        self.title = title
+        self.type = type
+        self.dates = dates
+        self.starts = starts
+        self.order = order
+
+    def __repr__(self):
+        return f"Lesson({self.name!r}, {self.type}, dates={self.dates}, starts={self.starts})"
+
+    @classmethod
+    def from_config(cls, lesson_info):
+        """Create a lesson from its entry in _config.yml."""
+        lesson_type = lesson_info.get("type", None)
+        dates = lesson_info.get("date", None)
+        starts = lesson_info.get("start-time", None)
+
+        return cls(
+            lesson_info.get("gh-name", None),
+            lesson_info.get("org-name", None),
+            lesson_info.get("branch", None),
+            lesson_info.get("title", None),
+            LessonType(lesson_type) if lesson_type in [t.value for t in LessonType] else None,
+            [parse_date(date) for date in as_list(dates)] if dates is not None else [],
+            [parse_start(start) for start in as_list(starts)] if starts is not None else [],
+            lesson_info.get("order", None),
+        )
+
+    @property
+    def first_date(self):
+        """The date of the first day of the lesson, or None."""
+        return self.dates[0] if self.dates else None
+
+
+def lesson_key(lesson_info):
+    """Get the key of a lesson's entry in _config.yml, which is the same for a copy of it."""
+    return repr(lesson_info)
+
+
+def get_lesson(lesson_info):
+    """Get a lesson from its entry in _config.yml, parsing it only the first time."""
+    key = lesson_key(lesson_info)
+    lesson = _LESSONS.get(key)
+    if lesson is None:
+        lesson = _LESSONS[key] = Lesson.from_config(lesson_info)
+
+    return lesson
+
+
+def get_lessons(website_config):
+    """Get the lessons in the config, with their dates and start times parsed.
+
+    Parameters
+    ----------
+    website_config: dict
+        The configuration for the website.
+
+    Returns
+    -------
+    lessons: list[Lesson]
+        Each lesson, in the order it is in the config. Entries which are not a
+        mapping of keys to values are left out.
+    """
+    return [get_lesson(lesson_info) for lesson_info in website_config.get("lessons", None) or []
+            if isinstance(lesson_info, dict)]
+
+
+def read_cache(cache):
+    """Read the cached config and lessons, if there is a cache.
+
+    Returns
+    -------
+    cached: dict
+        The "mtime", "size" and "sha1" of _config.yml when it was cached, its
+        pickled "config", and its "lessons". None if there is no cache, or it
+        can not be read.
+    """
+    try:
+        with open(cache, "rb") as fp:
+            cached = pickle.load(fp)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.warning(f"Can not read {cache}, so _config.yml will be parsed again: {e}")
+        return None
+
+    if not isinstance(cached, dict) or cached.get("format") != CACHE_FORMAT:
+        return None
+
+    return cached
+
+
+def write_cache(cache, cached):
+    """Write the cached config and lessons, replacing the previous cache."""
+    tmp = cache.with_name(f"{cache.name}.{os.getpid()}.tmp")
+    try:
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "wb") as fp:
+            pickle.dump(cached, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache)
+    except OSError as e:
+        log.warning(f"Can not write {cache}: {e}")
+        tmp.unlink(missing_ok=True)
+
+
+def parse_config(path, stat, cache):
+    """Get the cached config and lessons, parsing the config if it has changed.
+
+    Parameters
+    ----------
+    path: pathlib.Path
+        The config file.
+    stat: os.stat_result
+        The stat of the config file.
+    cache: pathlib.Path
+        The file the parsed config is cached in.
+
+    Returns
+    -------
+    cached: dict
+        The cache of the config, as in read_cache.
+    """
+    cached = read_cache(cache)
+    if cached is not None and (cached["mtime"], cached["size"]) == (stat.st_mtime_ns, stat.st_size):
+        return cached
+
+    content = path.read_bytes()
+    digest = hashlib.sha1(content).hexdigest()
+    if cached is not None and cached["sha1"] == digest:
+        # The file has been touched (e.g. by a checkout), but has not changed
+        cached.update(mtime=stat.st_mtime_ns, size=stat.st_size)
+        write_cache(cache, cached)
+        return cached
+
+    website_config = yaml.load(content, Loader)
+    cached = {
+        "format": CACHE_FORMAT,
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha1": digest,
+        "config": pickle.dumps(website_config, protocol=pickle.HIGHEST_PROTOCOL),
+        "lessons": get_lessons(website_config) if isinstance(website_config, dict) else [],
+    }
+    write_cache(cache, cached)
+
+    return cached
+
+
+def load_config(path=CONFIG_FILE, cache=None):
+    """Load _config.yml, from the cache if the file has not changed.
+
+    Parameters
+    ----------
+    path: str
+        The config file.
+    cache: str
+        The file to cache the parsed config in. If None, it is
+        .build/config.pickle in the directory of the config.
+
+    Returns
+    -------
+    website_config: dict
+        The configuration for the website. Each call gets its own copy, so it
+        is free to modify it.
+    """
+    path = Path(path).resolve()
+    cache = Path(cache) if cache is not None else path.parent / CACHE_FILE
+    stat = os.stat(path)
+
+    with _lock:
+        loaded = _LOADED.get(path)
+        if loaded is None or loaded[0] != (stat.st_mtime_ns, stat.st_size):
+            with tracing.span(str(path.name), "parse"):
+                cached = parse_config(path, stat, cache)
+            website_config = pickle.loads(cached["config"])
+            if isinstance(website_config, dict):
+                lessons_info = [info for info in website_config.get("lessons", None) or [] if isinstance(info, dict)]
+                _LESSONS.update(zip(map(lesson_key, lessons_info), cached["lessons"]))
+            loaded = _LOADED[path] = ((stat.st_mtime_ns, stat.st_size), cached["config"])
+
+    return pickle.loads(loaded[1])
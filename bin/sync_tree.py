@@ -0,0 +1,466 @@
+"""Incrementally synchronise files into a destination directory.
+
+This replaces distutils.dir_util.copy_tree, which rewrites every file on every
+build. A manifest of the size and hash of each file which was synced into a
+destination is kept in .build/sync/, so that on the next build only the files
+which have changed are written. Unchanged files keep their modification time,
+which lets Jekyll regenerate incrementally. Files which were synced previously,
+but are no longer in any of the sources, are removed.
+
+Where possible, files are reflinked (copy-on-write) or hardlinked rather than
+copied, which avoids writing the data at all when the source and destination
+are on the same filesystem. A sync can also be given a content-addressed store,
+in which each distinct file is kept once, named by its hash, and every copy of
+it in the destination is linked to that one file.
+"""
+
+import os
+import json
+import errno
+import fnmatch
+import hashlib
+import logging
+from pathlib import Path
+from shutil import copy2
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+import tracing
+
+log = logging.getLogger(__name__)
+
+MANIFEST_DIR = Path(".build/sync")
+FICLONE = 0x40049409  # from linux/fs.h
+IGNORED_NAMES = {".git"}
+STORE_MODE = 0o444  # the objects in a store are read-only
+
+
+def file_hash(path):
+    """Get the SHA-1 hash of the contents of a file.
+
+    Parameters
+    ----------
+    path: str
+        The file to hash.
+
+    Returns
+    -------
+    hash: str
+        The hex digest of the file.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            sha1.update(chunk)
+    tracing.count(files_read=1)
+
+    return sha1.hexdigest()
+
+
+def link_or_copy(src, dest, hardlink=True):
+    """Place a copy of src at dest, without writing the data if possible.
+
+    A reflink is tried first, then a hardlink (unless hardlink is False), and
+    finally a normal copy. The file is created next to dest and then renamed,
+    so dest is never partially written.
+
+    Parameters
+    ----------
+    src: str
+        The file to copy.
+    dest: str
+        The location to copy the file to.
+    hardlink: bool
+        If False, dest is never a hardlink of src, so writing to src in place
+        does not change it.
+
+    Returns
+    -------
+    method: str
+        How the file was placed: "reflink", "hardlink" or "copy".
+    """
+    tmp = f"{dest}.sync-tmp"
+    method = "copy"
+
+    try:
+        if fcntl is None:
+            raise OSError(errno.ENOTSUP, "reflinks are not supported")
+        with open(src, "rb") as fsrc, open(tmp, "wb") as fdest:
+            fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+        method = "reflink"
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        try:
+            if not hardlink:
+                raise OSError(errno.EPERM, "hardlinks are not wanted")
+            os.link(src, tmp)
+            method = "hardlink"
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+            copy2(src, tmp)
+
+    os.replace(tmp, dest)
+
+    return method
+
+
+class TreeSync:
+    """Synchronise files from one or more sources into a destination.
+
+    Sources are added with add_tree, add_file and add_content, and nothing is
+    written until apply is called. When the same file is added more than once,
+    the last one added is used, in the same way as copying each source in turn.
+
+    Parameters
+    ----------
+    dest: str
+        The destination directory.
+    prune: bool
+        If True, files in dest which are not in any source are removed, even if
+        they were not synced there. Otherwise, only files which were synced
+        previously are removed.
+    keep: list[str]
+        Glob patterns, relative to dest, for files which are never removed.
+    manifest_dir: str
+        The directory to store the manifest in.
+    store: str
+        If given, the directory of a content-addressed store. Files with the
+        same contents are placed by linking to a single copy in the store, so
+        they only take up space once. The copies in the store are made
+        read-only, as writing to a placed file in place would change every
+        file which is linked to it.
+    """
+
+    def __init__(self, dest, prune=False, keep=(), manifest_dir=MANIFEST_DIR, store=None):
+        self.dest = Path(dest)
+        self.prune = prune
+        self.keep = list(keep)
+        self.store = Path(store) if store is not None else None
+        name = "root" if self.dest == Path(".") else self.dest.as_posix().strip("/").replace("/", "__")
+        self.manifest = Path(manifest_dir) / f"{name}.json"
+        self.plan = {}
+
+    def add_tree(self, src, subdir=""):
+        """Add every file in a directory.
+
+        Parameters
+        ----------
+        src: str
+            The directory to add. If it does not exist, nothing is added.
+        subdir: str
+            The directory, relative to dest, to put the files in.
+
+        Returns
+        -------
+        exists: bool
+            True if the directory exists.
+        """
+        src = Path(src)
+        if not src.is_dir():
+            return False
+
+        for root, dirs, files in os.walk(src):
+            dirs[:] = sorted(d for d in dirs if d not in IGNORED_NAMES)
+            rel_root = Path(subdir) / Path(root).relative_to(src)
+            for file in sorted(files):
+                if file not in IGNORED_NAMES:
+                    self.plan[(rel_root / file).as_posix()] = Path(root) / file
+
+        return True
+
+    def add_file(self, src, rel):
+        """Add a single file.
+
+        Parameters
+        ----------
+        src: str
+            The file to add.
+        rel: str
+            The path of the file, relative to dest.
+
+        Returns
+        -------
+        exists: bool
+            True if the file exists, otherwise it is not added.
+        """
+        if not Path(src).is_file():
+            return False
+        self.plan[Path(rel).as_posix()] = Path(src)
+
+        return True
+
+    def add_content(self, content, rel):
+        """Add a file which has been generated, rather than copied.
+
+        Parameters
+        ----------
+        content: bytes
+            The contents of the file.
+        rel: str
+            The path of the file, relative to dest.
+        """
+        self.plan[Path(rel).as_posix()] = content
+
+    def discard(self, subdir):
+        """Stop a directory, which has already been added, from being synced.
+
+        Parameters
+        ----------
+        subdir: str
+            The directory, relative to dest, to discard.
+        """
+        prefix = f"{Path(subdir).as_posix()}/"
+        self.plan = {rel: src for rel, src in self.plan.items() if not rel.startswith(prefix)}
+
+    def store_path(self, digest):
+        """Get the path of a file in the content-addressed store.
+
+        Parameters
+        ----------
+        digest: str
+            The hash of the contents of the file.
+
+        Returns
+        -------
+        path: pathlib.Path
+            The file in the store, which may not exist yet.
+        """
+        return self.store / digest[:2] / digest[2:]
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def _kept(self, rel):
+        return any(fnmatch.fnmatch(rel, pattern) for pattern in self.keep)
+
+    def apply(self, executor=None):
+        """Write the changed files to dest, and remove the stale ones.
+
+        Parameters
+        ----------
+        executor: concurrent.futures.Executor
+            If given, files are placed concurrently using this executor.
+
+        Returns
+        -------
+        stats: dict
+            The number of files which were "written", "unchanged" and
+            "removed", the number of "bytes" written, and the number of
+            written files which were "deduplicated" by linking them to a copy
+            already in the store.
+        """
+        with tracing.span(f"sync {self.dest}", "copy"):
+            stats = self._apply(executor)
+        log.info(f"Synced {self.dest}: {stats}")
+
+        return stats
+
+    def _apply(self, executor):
+        old_manifest = self._load_manifest()
+        new_manifest = {}
+        to_write = []
+
+        for rel, src in self.plan.items():
+            record = old_manifest.get(rel)
+            dest = self.dest / rel
+
+            if isinstance(src, bytes):
+                size, src_mtime = len(src), None
+                digest = hashlib.sha1(src).hexdigest()
+            else:
+                src_stat = src.stat()
+                size, src_mtime = src_stat.st_size, src_stat.st_mtime_ns
+                # Only hash the source again if it has changed size or time
+                if record and record["size"] == size and record["src_mtime"] == src_mtime:
+                    digest = record["hash"]
+                else:
+                    digest = file_hash(src)
+
+            new_manifest[rel] = {"size": size, "hash": digest, "src_mtime": src_mtime}
+            try:
+                dest_stat = dest.stat()
+            except FileNotFoundError:
+                dest_stat = None
+            if (record and record["hash"] == digest and dest_stat and dest_stat.st_size == size
+                    and dest_stat.st_mtime_ns == record.get("dest_mtime")):
+                new_manifest[rel]["dest_mtime"] = record["dest_mtime"]
+                continue
+            to_write.append((rel, src, dest))
+
+        def write(item):
+            rel, src, dest = item
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            if isinstance(src, bytes):
+                with open(f"{dest}.sync-tmp", "wb") as fp:
+                    fp.write(src)
+                os.replace(f"{dest}.sync-tmp", dest)
+            else:
+                link_or_copy(src, dest)
+            new_manifest[rel]["dest_mtime"] = dest.stat().st_mtime_ns
+
+        def write_stored(items):
+            # Every item has the same contents, so the object is only added to
+            # the store once, and then each destination is linked to it
+            rel, src, dest = items[0]
+            obj = self.store_path(new_manifest[rel]["hash"])
+            stored = obj.is_file()
+            if not stored:
+                obj.parent.mkdir(parents=True, exist_ok=True)
+                if isinstance(src, bytes):
+                    with open(f"{obj}.sync-tmp", "wb") as fp:
+                        fp.write(src)
+                    os.replace(f"{obj}.sync-tmp", obj)
+                else:
+                    # The object is not linked to its source, which could be
+                    # written to in place, as that would change it too
+                    link_or_copy(src, obj, hardlink=False)
+            # Hardlinks share their mode, so this also stops the placed files
+            # being written to in place
+            os.chmod(obj, STORE_MODE)
+            for rel, src, dest in items:
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                link_or_copy(obj, dest)
+                new_manifest[rel]["dest_mtime"] = dest.stat().st_mtime_ns
+            return len(items) - (0 if stored else 1)
+
+        if self.store is not None:
+            groups = {}
+            for item in to_write:
+                groups.setdefault(new_manifest[item[0]]["hash"], []).append(item)
+            mapped = executor.map(write_stored, groups.values()) if executor else map(write_stored, groups.values())
+            deduplicated = sum(mapped)
+        else:
+            deduplicated = 0
+            if executor:
+                list(executor.map(write, to_write))
+            else:
+                for item in to_write:
+                    write(item)
+
+        # Remove stale files, which are no longer in any of the sources
+
+        stale = {rel for rel in old_manifest if rel not in new_manifest}
+        if self.prune and self.dest.is_dir():
+            for root, dirs, files in os.walk(self.dest):
+                for file in files:
+                    rel = (Path(root).relative_to(self.dest) / file).as_posix()
+                    if rel not in new_manifest:
+                        stale.add(rel)
+        stale = {rel for rel in stale if not self._kept(rel)}
+
+        for rel in sorted(stale):
+            try:
+                (self.dest / rel).unlink()
+            except FileNotFoundError:
+                pass
+        for rel in sorted(stale, reverse=True):
+            remove_empty_parents(self.dest / rel, self.dest)
+        if self.prune and self.dest.is_dir():
+            for root, dirs, files in os.walk(self.dest, topdown=False):
+                if Path(root) != self.dest and not os.listdir(root):
+                    os.rmdir(root)
+
+        self.manifest.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.manifest, "w") as fp:
+            json.dump(new_manifest, fp, indent=0, sort_keys=True)
+
+        stats = {
+            "written": len(to_write),
+            "unchanged": len(self.plan) - len(to_write),
+            "removed": len(stale),
+            "bytes": sum(new_manifest[rel]["size"] for rel, _, _ in to_write),
+            "deduplicated": deduplicated,
+        }
+        tracing.count(files_written=len(to_write))
+
+        return stats
+
+
+def write_if_changed(path, content):
+    """Write a generated file, unless it already has the same contents.
+
+    Leaving an unchanged file alone keeps its modification time, so Jekyll
+    does not regenerate the pages which use it.
+
+    Parameters
+    ----------
+    path: str
+        The file to write.
+    content: str
+        The contents of the file.
+
+    Returns
+    -------
+    written: bool
+        True if the file was written.
+    """
+    path = Path(path)
+    try:
+        with open(path, "r", encoding="utf-8") as fp:
+            if fp.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(f"{path}.sync-tmp", "w", encoding="utf-8") as fp:
+        fp.write(content)
+    os.replace(f"{path}.sync-tmp", path)
+    tracing.count(files_written=1)
+
+    return True
+
+
+def remove_empty_parents(path, stop):
+    """Remove the empty directories above path, up to but not including stop.
+
+    Parameters
+    ----------
+    path: pathlib.Path
+        The removed file whose parents should be removed.
+    stop: pathlib.Path
+        The directory to stop at.
+    """
+    parent = path.parent
+    while parent != stop and stop in parent.parents:
+        try:
+            parent.rmdir()
+        except OSError:
+            break
+        parent = parent.parent
+
+
+def prune_store(store):
+    """Remove the files in a content-addressed store which are no longer used.
+
+    A file in the store which has no other links is not placed anywhere, so it
+    can be removed. If files could not be hardlinked, every file in the store
+    is removed, as none of them are shared.
+
+    Parameters
+    ----------
+    store: str
+        The directory of the store.
+
+    Returns
+    -------
+    removed: int
+        The number of files which were removed.
+    """
+    removed = 0
+    for path in Path(store).glob("*/*"):
+        if path.is_file() and path.stat().st_nlink == 1:
+            path.unlink()
+            remove_empty_parents(path, Path(store))
+            removed += 1
+
+    return removed
@@ -0,0 +1,287 @@
+"""Trace where the time goes in the build.
+
+The build scripts mark the work they do with spans, e.g. each stage of the
+build, each lesson which is fetched, each HTTP request and git command, each
+sync of files and each schedule which is parsed:
+
+    with tracing.span(f"fetch {lesson_name}", "lesson"):
+        ...
+
+Each span records its wall time, the number of bytes read and written by its
+thread (from /proc/thread-self/io, where it is available), and any counters
+added to it with tracing.count, e.g. the number of files read and written and
+the time spent waiting for subprocesses. Counters are added to every open span
+on the current thread, so a span includes the work of the spans inside it, but
+not the work its thread hands off to other threads.
+
+Tracing is off unless the BUILD_TRACE environment variable is set to the file
+to write the trace to, or tracing.enable is called (e.g. with build.py
+--trace). When it is off, span returns a shared span which does nothing. When
+the build finishes, the trace is written in the Chrome trace event format,
+which can be opened in chrome://tracing or https://ui.perfetto.dev, and a
+summary of each stage and each category of span is printed.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import subprocess
+
+TRACE_ENV = "BUILD_TRACE"
+CATEGORIES = ("stage", "lesson", "http", "git", "copy", "parse", "render")
+
+_tracer = None
+_local = threading.local()
+
+
+class Span:
+    """A span of work, which is recorded when it ends.
+
+    Parameters
+    ----------
+    name: str
+        The name of the span, e.g. the lesson or file it is working on.
+    cat: str
+        The category of the span, usually one of CATEGORIES.
+    args: dict
+        Extra information to record with the span.
+    """
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.counters = {}
+        self.start = None
+        self.end = None
+        self.tid = None
+        self._io = None
+
+    def __enter__(self):
+        self.tid = threading.get_ident()
+        _stack().append(self)
+        self._io = _thread_io()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.end = time.perf_counter_ns()
+        io = _thread_io()
+        if io and self._io:
+            self.counters["bytes_read"] = self.counters.get("bytes_read", 0) + io[0] - self._io[0]
+            self.counters["bytes_written"] = self.counters.get("bytes_written", 0) + io[1] - self._io[1]
+        _stack().remove(self)
+        _tracer.record(self)
+        return False
+
+    def add(self, **counters):
+        """Add to the counters of this span only."""
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+class _NullSpan:
+    """The span which is used when tracing is off, which does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, **counters):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """Collect the spans which have ended, and write them to a trace file.
+
+    Parameters
+    ----------
+    path: str
+        The file to write the trace to.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.start = time.perf_counter_ns()
+        self.spans = []
+        self.threads = {}
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        with self._lock:
+            self.spans.append(span)
+            self.threads.setdefault(span.tid, threading.current_thread().name)
+
+    def events(self):
+        """Get the spans as Chrome trace events.
+
+        Returns
+        -------
+        events: list[dict]
+            A complete ("X") event for each span, and a metadata event naming
+            each thread.
+        """
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in self.threads.items()]
+        for span in sorted(self.spans, key=lambda s: s.start):
+            events.append({
+                "name": span.name,
+                "cat": span.cat,
+                "ph": "X",
+                "ts": (span.start - self.start) / 1000,
+                "dur": (span.end - span.start) / 1000,
+                "pid": pid,
+                "tid": span.tid,
+                "args": {**span.args, **span.counters},
+            })
+
+        return events
+
+    def summary(self):
+        """Get the totals for each stage, and each category of span.
+
+        Returns
+        -------
+        rows: dict[str, dict]
+            The number of spans, their total wall time in ms and the total of
+            each counter, for each stage and category.
+        """
+        rows = {}
+        for span in self.spans:
+            key = f"stage {span.name}" if span.cat == "stage" else span.cat
+            row = rows.setdefault(key, {"count": 0, "wall_ms": 0})
+            row["count"] += 1
+            row["wall_ms"] += (span.end - span.start) / 1e6
+            for counter, value in span.counters.items():
+                row[counter] = row.get(counter, 0) + value
+
+        return rows
+
+    def write(self):
+        """Write the trace file, and print the summary."""
+        with open(self.path, "w") as fp:
+            json.dump({"traceEvents": self.events(), "displayTimeUnit": "ms"}, fp)
+
+        print(f"{'span':24} {'count':>6} {'wall ms':>10} {'read KB':>10} {'written KB':>10} {'files r/w':>12} "
+              f"{'subproc ms':>10}", file=sys.stderr)
+        for key, row in sorted(self.summary().items()):
+            files = f"{row.get('files_read', 0)}/{row.get('files_written', 0)}"
+            print(f"{key:24} {row['count']:6d} {row['wall_ms']:10.1f} {row.get('bytes_read', 0) / 1024:10.0f} "
+                  f"{row.get('bytes_written', 0) / 1024:10.0f} {files:>12} {row.get('subprocess_ms', 0):10.1f}",
+                  file=sys.stderr)
+        print(f"Trace written to {self.path}", file=sys.stderr)
+
+
+def _stack():
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+def _thread_io():
+    """Get the bytes read and written by the current thread, or None."""
+    try:
+        with open("/proc/thread-self/io", "rb") as fp:
+            io = dict(line.split(b":") for line in fp.read().splitlines())
+        return int(io[b"rchar"]), int(io[b"wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def enable(path):
+    """Turn tracing on, and write the trace to path when Python exits.
+
+    Parameters
+    ----------
+    path: str
+        The file to write the trace to.
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(path)
+        atexit.register(_tracer.write)
+
+
+def enabled():
+    """Check if tracing is on."""
+    return _tracer is not None
+
+
+def span(name, cat="build", **args):
+    """Create a span, to be used as a context manager.
+
+    Parameters
+    ----------
+    name: str
+        The name of the span.
+    cat: str
+        The category of the span, usually one of CATEGORIES.
+    args: dict
+        Extra information to record with the span.
+
+    Returns
+    -------
+    span: Span
+        The span, or a span which does nothing if tracing is off.
+    """
+    if _tracer is None:
+        return NULL_SPAN
+
+    return Span(name, cat, args)
+
+
+def count(**counters):
+    """Add to the counters of every open span on the current thread.
+
+    Parameters
+    ----------
+    counters: dict[str, int]
+        The amount to add to each counter, e.g. files_read=1.
+    """
+    if _tracer is None:
+        return
+    for open_span in _stack():
+        open_span.add(**counters)
+
+
+def run(command, cat="git", **kwargs):
+    """Run a subprocess in a span, and count the time spent waiting for it.
+
+    Parameters
+    ----------
+    command: list[str]
+        The command to run.
+    cat: str
+        The category of the span.
+    kwargs: dict
+        Passed on to subprocess.run.
+
+    Returns
+    -------
+    process: subprocess.CompletedProcess
+        The completed process.
+    """
+    if _tracer is None:
+        return subprocess.run(command, **kwargs)
+
+    with span(" ".join(command[:2]), cat):
+        start = time.perf_counter_ns()
+        try:
+            return subprocess.run(command, **kwargs)
+        finally:
+            count(subprocess_ms=(time.perf_counter_ns() - start) / 1e6)
+
+
+if os.environ.get(TRACE_ENV):
+    enable(os.environ[TRACE_ENV])
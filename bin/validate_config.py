@@ -0,0 +1,243 @@
+"""Check _config.yml for mistakes before the lessons are fetched.
+
+Problems with the lessons in _config.yml, such as a date which can not be
+parsed, or a lesson with a different number of dates than its schedule has
+days, used to only be found by get_schedules.py, after every lesson had been
+cloned. Instead, every lesson is checked in one pass before anything is
+fetched or written, and every problem is reported together:
+
+    - kind is "workshop" or "course"
+    - each lesson has the keys required for the kind of website, and a type
+      of "episode" or "episode_r"
+    - no two lessons have the same gh-name
+    - each date can be parsed, and is between startdate and enddate
+    - each start-time is in 24 hour (15:00) or 12 hour (3:00 pm) format
+    - a lesson has the same number of dates and start times
+    - if a lesson's schedule.html is already in _includes/rsg/ from a previous
+      build, it has one table for each date, and each time in it can be parsed
+
+This is run by build.py and get_submodules.py, and can be run on its own with
+
+    python bin/validate_config.py [directory]
+
+The schedule.html files are only checked by get_schedules.py, after the
+lessons have been fetched, as those from a previous build are stale when a
+lesson gains or loses a day (and would otherwise stop the fetch which updates
+them). Run on its own, the schedules are checked unless --no-schedules is
+given.
+"""
+
+import os
+import sys
+import datetime
+import argparse
+from pathlib import Path
+from site_config import LessonType, as_list, get_lesson, load_config, parse_date
+from schedule_table import parse_schedules
+
+KINDS = ("workshop", "course")
+REQUIRED_KEYS = {
+    "workshop": ("gh-name", "title", "type", "date", "start-time"),
+    "course": ("gh-name", "title", "type", "order"),
+}
+
+
+class ConfigError(ValueError):
+    """The problems found in _config.yml.
+
+    Parameters
+    ----------
+    errors: list[str]
+        A description of each problem.
+    """
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        super().__init__(f"{len(self.errors)} problem(s) in _config.yml:\n" +
+                         "\n".join(f"  - {error}" for error in self.errors))
+
+
+def validate_lesson(lesson, label, kind, start_date=None, end_date=None):
+    """Check a lesson entry from _config.yml.
+
+    Parameters
+    ----------
+    lesson: dict
+        The entry for the lesson.
+    label: str
+        How to refer to the lesson in the errors.
+    kind: str
+        The kind of website, "workshop" or "course".
+    start_date: datetime.date
+        The start date of the workshop, if it has one.
+    end_date: datetime.date
+        The end date of the workshop, if it has one.
+
+    Returns
+    -------
+    errors: list[str]
+        The problems with the lesson.
+    """
+    if not isinstance(lesson, dict):
+        return [f"{label} is not a mapping of keys to values"]
+
+    errors = [f"{label} does not have a {key}" for key in REQUIRED_KEYS[kind] if lesson.get(key) is None]
+
+    lesson_type = lesson.get("type")
+    if lesson_type is not None and lesson_type not in [t.value for t in LessonType]:
+        errors.append(f"{label} has an unknown type '{lesson_type}', expected one of: "
+                      f"{', '.join(t.value for t in LessonType)}")
+    if kind == "course" and lesson.get("order") is not None and not isinstance(lesson["order"], int):
+        errors.append(f"{label} has an order of '{lesson['order']}', which is not a whole number")
+
+    if kind != "workshop" or lesson.get("date") is None or lesson.get("start-time") is None:
+        return errors
+
+    # The dates and start times are parsed once, by site_config.py
+    parsed = get_lesson(lesson)
+    dates = as_list(lesson["date"])
+    starts = as_list(lesson["start-time"])
+    for i, (value, date) in enumerate(zip(dates, parsed.dates)):
+        if date is None:
+            errors.append(f"{label} day {i + 1} has a date of '{value}', which is not a date")
+        elif start_date and date < start_date:
+            errors.append(f"{label} day {i + 1} is on {date}, before the workshop starts on {start_date}")
+        elif end_date and date > end_date:
+            errors.append(f"{label} day {i + 1} is on {date}, after the workshop ends on {end_date}")
+    for i, (value, start) in enumerate(zip(starts, parsed.starts)):
+        if start is None:
+            errors.append(f"{label} day {i + 1} has a start-time of '{value}', expected 24 hr (15:00) or "
+                          f"12 hr with am/pm (3:00 pm)")
+    if len(dates) != len(starts):
+        errors.append(f"{label} has {len(dates)} date(s) but {len(starts)} start-time(s)")
+
+    return errors
+
+
+def validate_schedule(lesson, label, html):
+    """Check a lesson's schedule.html against its entry in _config.yml.
+
+    Parameters
+    ----------
+    lesson: dict
+        The entry for the lesson, from a workshop's _config.yml.
+    label: str
+        How to refer to the lesson in the errors.
+    html: str
+        The contents of the lesson's schedule.html.
+
+    Returns
+    -------
+    errors: list[str]
+        The problems with the schedule.
+    """
+    errors = []
+    schedules = parse_schedules(html)
+    n_dates = len(as_list(lesson.get("date")))
+    if len(schedules) != n_dates:
+        errors.append(f"{label} has {n_dates} date(s), but its schedule.html has {len(schedules)} day(s)")
+
+    for i, schedule in enumerate(schedules):
+        if not schedule:
+            errors.append(f"{label} has no sessions in day {i + 1} of its schedule.html")
+        for time, session in schedule:
+            try:
+                datetime.datetime.strptime(time, "%H:%M")
+            except ValueError:
+                errors.append(f"{label} has a time of '{time}' in day {i + 1} of its schedule.html, expected 24 hr")
+
+    return errors
+
+
+def validate_config(website_config, check_schedules=True):
+    """Check every lesson in the website config.
+
+    Parameters
+    ----------
+    website_config: dict
+        The configuration for the website.
+    check_schedules: bool
+        If True, also check the schedule.html of each lesson in a workshop,
+        where it exists from a previous build.
+
+    Returns
+    -------
+    errors: list[str]
+        Every problem which was found.
+    """
+    kind = website_config.get("kind")
+    if kind not in KINDS:
+        return [f"kind is '{kind}', expected one of: {', '.join(KINDS)}"]
+
+    lessons = website_config.get("lessons")
+    if not isinstance(lessons, list) or not lessons:
+        return ["There are no lessons specified in _config.yml"]
+
+    start_date = parse_date(website_config.get("startdate"))
+    end_date = parse_date(website_config.get("enddate"))
+    errors = []
+    seen = {}
+
+    for n, lesson in enumerate(lessons):
+        name = lesson.get("gh-name") if isinstance(lesson, dict) else None
+        label = f"Lesson {n + 1}" + (f" ({name})" if name else "")
+        errors += validate_lesson(lesson, label, kind, start_date, end_date)
+
+        if name is None:
+            continue
+        if name in seen:
+            errors.append(f"{label} has the same gh-name as lesson {seen[name] + 1}")
+        seen.setdefault(name, n)
+
+        schedule = Path(f"_includes/rsg/{name}-lesson/schedule.html")
+        if check_schedules and kind == "workshop" and lesson.get("date") is not None and schedule.is_file():
+            errors += validate_schedule(lesson, label, schedule.read_text(encoding="utf-8"))
+
+    return errors
+
+
+def check_config(website_config, check_schedules=True):
+    """Check the website config, and raise an exception if there are problems.
+
+    Parameters
+    ----------
+    website_config: dict
+        The configuration for the website.
+    check_schedules: bool
+        If True, also check the schedule.html of each lesson which exists.
+
+    Raises
+    ------
+    ConfigError
+        If there are any problems, with all of them listed.
+    """
+    errors = validate_config(website_config, check_schedules)
+    if errors:
+        raise ConfigError(errors)
+
+
+def main():
+    """Main function of the script.
+
+    Check _config.yml, and print every problem which is found.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", nargs="?", default=".",
+                        help="the root directory of the website")
+    parser.add_argument("--no-schedules", action="store_true",
+                        help="do not check the schedules from a previous build")
+    args = parser.parse_args()
+
+    os.chdir(args.directory)
+    website_config = load_config()
+
+    errors = validate_config(website_config, not args.no_schedules)
+    for error in errors:
+        print(error, file=sys.stderr)
+    if errors:
+        sys.exit(1)
+    print(f"_config.yml is valid: {len(website_config['lessons'])} lesson(s)")
+
+
+if __name__ == "__main__":
+    main()
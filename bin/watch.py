@@ -0,0 +1,394 @@
+"""Watch the inputs of the build, and re-run only the stages they affect.
+
+    python bin/watch.py [directory] [--serve COMMAND] [build options]
+
+The inputs of each stage of build.py are watched (with inotify if the
+inotify_simple package is installed, otherwise by checking their modification
+times several times a second). When they change, the changes are collected
+until there is a short pause, so an editor saving several files, or a branch
+being checked out, causes a single rebuild. Each changed file is then mapped to
+the stages which read it, and only those stages, and the stages which depend on
+them, are run, in this process:
+
+    _includes/rsg/*-lesson/schedule.html    schedules
+    _includes/rsg/*-lesson/setup.md         setup
+    collections/_episodes_rmd/*/*.Rmd       knit, then assets and schedules
+    ...
+
+A change to _config.yml is compared with the previous config, so that e.g. a
+different start-time only rebuilds the schedules, while a lesson which is added
+or moved to another branch fetches the lessons again. A config with mistakes in
+it is reported, and the site is left as it is until it is fixed.
+
+With --serve, the command (e.g. jekyll serve) is run alongside, and the
+watching stops when it exits. This is what make serve does.
+"""
+
+import os
+import glob
+import time
+import fnmatch
+import logging
+import argparse
+import subprocess
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+from build import STAGES, build, add_arguments
+from sync_tree import file_hash
+from validate_config import ConfigError, check_config
+import site_config
+
+log = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.2  # seconds
+DEBOUNCE = 0.1  # seconds
+
+# The keys of each lesson in _config.yml which change the lessons which are
+# fetched, and the keys which change the workshop's setup.md
+FETCH_KEYS = ("gh-name", "org-name", "branch", "type")
+SETUP_KEYS = ("gh-name", "title", "type", "date", "order")
+
+
+def expand(patterns):
+    """Get the files which match the patterns.
+
+    Parameters
+    ----------
+    patterns: list[str]
+        The glob patterns of the files.
+
+    Returns
+    -------
+    files: set[str]
+        The files which exist.
+    """
+    return {path for pattern in patterns for path in glob.glob(pattern) if os.path.isfile(path)}
+
+
+def matches(path, patterns):
+    """Check if a path matches any of the patterns."""
+    return any(fnmatch.fnmatch(path, pattern) for pattern in patterns)
+
+
+class PollingWatcher:
+    """Watch files by checking their size and modification time.
+
+    Parameters
+    ----------
+    interval: float
+        The time between checks, in seconds.
+    """
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self.patterns = []
+        self._stats = {}
+
+    def _scan(self):
+        stats = {}
+        for path in expand(self.patterns):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stats[path] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    def watch(self, patterns):
+        """Start watching the files which match the patterns, as they are now."""
+        self.patterns = list(patterns)
+        self._stats = self._scan()
+
+    def wait(self, timeout=None):
+        """Wait until files have changed, been created or been deleted.
+
+        Parameters
+        ----------
+        timeout: float
+            The longest time to wait, in seconds, or None to wait forever.
+
+        Returns
+        -------
+        changed: set[str]
+            The files which changed, which is empty if the timeout was reached.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            stats = self._scan()
+            changed = {path for path in stats.keys() | self._stats.keys() if stats.get(path) != self._stats.get(path)}
+            self._stats = stats
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval if deadline is None else min(self.interval, max(0, deadline - time.monotonic())))
+
+
+class InotifyWatcher:
+    """Watch files with inotify, by watching the directories they are in.
+
+    inotify only watches a directory, not the directories inside it, so each
+    directory which the patterns can match files in is watched.
+    """
+
+    def __init__(self):
+        self.mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.CREATE | flags.DELETE
+        self.patterns = []
+        self._inotify = INotify()
+        self._directories = {}
+
+    def watch(self, patterns):
+        """Start watching the directories the patterns can match files in."""
+        self.patterns = list(patterns)
+        directories = {path for pattern in self.patterns for path in glob.glob(os.path.dirname(pattern) or ".")}
+        for directory in directories - set(self._directories.values()):
+            if os.path.isdir(directory):
+                self._directories[self._inotify.add_watch(directory, self.mask)] = directory
+
+    def wait(self, timeout=None):
+        """Wait until files which match the patterns have changed.
+
+        Parameters
+        ----------
+        timeout: float
+            The longest time to wait, in seconds, or None to wait forever.
+
+        Returns
+        -------
+        changed: set[str]
+            The files which changed, which is empty if the timeout was reached.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            events = self._inotify.read(timeout=None if remaining is None else int(remaining * 1000))
+            changed = set()
+            for event in events:
+                if event.mask & flags.IGNORED:
+                    self._directories.pop(event.wd, None)
+                    continue
+                directory = self._directories.get(event.wd)
+                if directory is None:
+                    continue
+                path = os.path.normpath(os.path.join(directory, event.name))
+                if matches(path, self.patterns):
+                    changed.add(path)
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+
+def create_watcher(poll=False):
+    """Create an inotify watcher if inotify_simple is installed, or else one which polls."""
+    if INotify is not None and not poll:
+        try:
+            return InotifyWatcher()
+        except OSError as e:
+            log.warning(f"Can not use inotify ({e}), so the files will be polled instead")
+    return PollingWatcher()
+
+
+def watched_patterns(stages=STAGES):
+    """Get the glob patterns of the inputs of every stage."""
+    return sorted({pattern for stage in stages for pattern in stage.inputs})
+
+
+def lesson_keys(website_config, keys):
+    """Get the values of some of the keys of each lesson in the config."""
+    return [tuple(str(lesson.get(key)) for key in keys) for lesson in website_config.get("lessons") or []
+            if isinstance(lesson, dict)]
+
+
+def config_stages(old_config, new_config):
+    """Get the stages which need to be run for a change to _config.yml.
+
+    Parameters
+    ----------
+    old_config: dict
+        The config from before the change.
+    new_config: dict
+        The config after the change.
+
+    Returns
+    -------
+    stages: set[str]
+        The names of the stages which read the parts of the config which
+        changed.
+    """
+    stages = set()
+    if lesson_keys(old_config, FETCH_KEYS) != lesson_keys(new_config, FETCH_KEYS):
+        stages.add("submodules")
+    schedule_keys = ("kind", "startdate", "enddate", "lessons")
+    if any(old_config.get(key) != new_config.get(key) for key in schedule_keys):
+        stages.add("schedules")
+    if old_config.get("kind") != new_config.get("kind") or \
+            lesson_keys(old_config, SETUP_KEYS) != lesson_keys(new_config, SETUP_KEYS):
+        stages.add("setup")
+
+    return stages
+
+
+def with_dependents(names, stages=STAGES):
+    """Add the stages which depend on the given stages, directly or not."""
+    names = set(names)
+    added = True
+    while added:
+        dependents = {stage.name for stage in stages if names & set(stage.deps)}
+        added = not dependents <= names
+        names |= dependents
+
+    return names
+
+
+def affected_stages(changed, old_config, new_config, stages=STAGES):
+    """Map the files which changed to the stages which need to be run.
+
+    Parameters
+    ----------
+    changed: set[str]
+        The files which changed.
+    old_config: dict
+        The config from before the changes.
+    new_config: dict
+        The config after the changes.
+    stages: list[Stage]
+        Every stage of the build.
+
+    Returns
+    -------
+    names: set[str]
+        The names of the stages which read the files, and of the stages which
+        depend on them.
+    """
+    names = set()
+    for path in changed:
+        if path == "_config.yml":
+            names |= config_stages(old_config, new_config)
+            continue
+        names |= {stage.name for stage in stages if matches(path, stage.inputs)}
+
+    return with_dependents(names, stages)
+
+
+def load_config():
+    """Load _config.yml, or return None if it can not be read."""
+    try:
+        website_config = site_config.load_config()
+    except (OSError, ValueError) as e:
+        log.error(f"Can not read _config.yml: {e}")
+        return None
+
+    return website_config if isinstance(website_config, dict) else None
+
+
+def watch(args, watcher, serve=None):
+    """Rebuild the stages affected by each change, until the server exits.
+
+    Parameters
+    ----------
+    args: argparse.Namespace
+        The options of the build.
+    watcher: PollingWatcher | InotifyWatcher
+        What to watch the files with.
+    serve: subprocess.Popen
+        The server which is running alongside, or None to watch forever.
+    """
+    patterns = watched_patterns()
+    website_config = load_config()
+    hashes = {path: file_hash(path) for path in expand(patterns)}
+    pending = set()
+    watcher.watch(patterns)
+    log.info(f"Watching {len(hashes)} files for changes, with {type(watcher).__name__}")
+
+    while serve is None or serve.poll() is None:
+        changed = watcher.wait(timeout=None if serve is None else 1)
+        if not changed:
+            continue
+
+        # Wait for a pause in the changes, then ignore files whose contents
+        # have not changed (e.g. saved without any edits)
+
+        while True:
+            more = watcher.wait(timeout=DEBOUNCE)
+            if not more:
+                break
+            changed |= more
+        changed |= pending
+        changed = {path for path in changed if (file_hash(path) if os.path.isfile(path) else None) != hashes.get(path)}
+        if not changed:
+            continue
+
+        log.info(f"Changed: {', '.join(sorted(changed))}")
+        new_config = load_config() if "_config.yml" in changed else website_config
+        try:
+            if new_config is None:
+                raise ConfigError(["_config.yml is not a mapping of keys to values"])
+            check_config(new_config, check_schedules=False)
+        except ConfigError as e:
+            # Wait for the config to be fixed, then rebuild for these changes too
+            log.error(str(e))
+            pending = changed
+            continue
+
+        names = affected_stages(changed, website_config, new_config)
+        if not names:
+            log.info("No stages read the files which changed")
+            hashes.update({path: file_hash(path) for path in changed if os.path.isfile(path)})
+            website_config = new_config
+            continue
+
+        start = time.perf_counter()
+        args.stages = sorted(names)
+        try:
+            results = build(new_config, args)
+        except Exception as e:
+            log.error(f"The build failed, so the site may be out of date: {e}")
+        else:
+            ran = [name for name, result in results.items() if result == "run"]
+            log.info(f"Ran {', '.join(ran) or 'nothing'} in {time.perf_counter() - start:.2f}s")
+        website_config = new_config
+        pending = set()
+
+        # The stages write some of the files which are watched, so take the
+        # files as they are now, rather than treating those writes as changes
+
+        hashes = {path: file_hash(path) for path in expand(patterns)}
+        watcher.watch(patterns)
+
+
+def main():
+    """Main function of the script.
+
+    Watch the inputs of the build, running the server alongside if one is
+    given.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", nargs="?", default=".",
+                        help="the root directory of the website")
+    parser.add_argument("--serve", metavar="COMMAND",
+                        help="a command to run alongside, e.g. \"bundle exec jekyll serve\", which stops the watching "
+                             "when it exits")
+    parser.add_argument("--poll", action="store_true",
+                        help="check the modification times of the files, rather than using inotify")
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.packs:
+        args.packs = os.path.abspath(args.packs)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    os.chdir(args.directory)
+
+    serve = subprocess.Popen(args.serve, shell=True) if args.serve else None
+    try:
+        watch(args, create_watcher(args.poll), serve)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if serve and serve.poll() is None:
+            serve.terminate()
+            serve.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Check that deploy_tree.py deploys only the changed files to gh-pages.
+
+The website is deployed to a local bare repository, acting as the remote with
+the gh-pages branch, so this runs without network access.
+
+    python -m pytest tests
+"""
+
+import sys
+import subprocess
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bin"))
+
+import benchmark  # noqa: E402
+import deploy_tree  # noqa: E402
+import tracing  # noqa: E402
+from site_config import load_config  # noqa: E402
+
+CONFIG = """kind: workshop
+exclude:
+  - Makefile
+  - notes/
+"""
+
+FILES = {
+    "_config.yml": CONFIG,
+    "index.md": "# Workshop\n",
+    "fig/figure.png": "png\n",
+    "docs/Makefile": "deployed, as exclude: is from the root\n",
+    "Makefile": "excluded by _config.yml\n",
+    "notes/todo.md": "excluded by _config.yml\n",
+    "bin/build.py": "excluded by DEPLOY_EXCLUDE\n",
+    "submodules/lesson-0/index.md": "excluded by DEPLOY_EXCLUDE\n",
+    "fig/.DS_Store": "excluded by name\n",
+    "docs/index.md~": "excluded by name\n",
+}
+
+
+def git(*args, cwd=None):
+    """Run a git command, and get its output."""
+    process = subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True)
+    return process.stdout.strip()
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    """Make a website, in a git repository, and a bare repository to deploy it to."""
+    for key, value in benchmark.GIT_ENV.items():
+        monkeypatch.setenv(key, value)
+    site = tmp_path / "site"
+    for rel, content in FILES.items():
+        (site / rel).parent.mkdir(parents=True, exist_ok=True)
+        (site / rel).write_text(content)
+    git("init", "--quiet", str(site))
+    git("init", "--quiet", "--bare", str(tmp_path / "remote.git"))
+    monkeypatch.chdir(site)
+
+    return site
+
+
+@pytest.fixture
+def git_commands(monkeypatch):
+    """Record the arguments of every git command which is run."""
+    commands = []
+    run = tracing.run
+
+    def recording_run(command, *args, **kwargs):
+        if command[0] == "git":
+            commands.append(command[1:])
+        return run(command, *args, **kwargs)
+
+    monkeypatch.setattr(tracing, "run", recording_run)
+
+    return commands
+
+
+def test_deploy(site, git_commands):
+    remote = str(site.parent / "remote.git")
+
+    first = deploy_tree.deploy(load_config(), remote=remote)
+    assert first["previous"] is None
+    assert git("rev-parse", "gh-pages", cwd=remote) == first["commit"]
+    deployed = set(git("ls-tree", "-r", "--name-only", "gh-pages", cwd=remote).split("\n"))
+    assert deployed == {"_config.yml", "index.md", "fig/figure.png", "docs/Makefile"}
+
+    # Nothing has changed, so nothing is committed or pushed
+    git_commands.clear()
+    second = deploy_tree.deploy(load_config(), remote=remote)
+    assert second["commit"] is None
+    assert not second["added"] + second["changed"] + second["removed"]
+    assert not [command for command in git_commands if command[0] == "push"]
+    assert git("rev-parse", "gh-pages", cwd=remote) == first["commit"]
+
+    # A change is committed on top of the previous deploy
+    (site / "index.md").write_text("# Workshop, changed\n")
+    (site / "fig/figure.png").unlink()
+    third = deploy_tree.deploy(load_config(), remote=remote)
+    assert third["changed"] == ["index.md"]
+    assert third["removed"] == ["fig/figure.png"]
+    assert git("rev-parse", "gh-pages", cwd=remote) == third["commit"]
+    assert git("rev-parse", f"{third['commit']}^", cwd=remote) == first["commit"]
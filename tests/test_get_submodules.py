@@ -0,0 +1,98 @@
+"""Check that get_submodules.py fetches each lesson with a single clone.
+
+The lessons are committed to local bare repositories, and the GitHub API is
+faked on localhost (see bin/benchmark.py), so this runs without network access.
+
+    python -m pytest tests
+"""
+
+import sys
+import subprocess
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bin"))
+
+import benchmark  # noqa: E402
+import get_submodules  # noqa: E402
+import tracing  # noqa: E402
+
+N_LESSONS = 4
+
+
+@pytest.fixture
+def git_commands(monkeypatch):
+    """Record the arguments of every git command which is run."""
+    commands = []
+    run = tracing.run
+
+    def recording_run(command, *args, **kwargs):
+        if command[0] == "git":
+            commands.append(command[1:])
+        return run(command, *args, **kwargs)
+
+    monkeypatch.setattr(tracing, "run", recording_run)
+
+    return commands
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_one_clone_per_lesson(tmp_path, monkeypatch, git_commands, sparse):
+    git_dir, site, reveal_commit = benchmark.make_lesson_repos(tmp_path, n_lessons=N_LESSONS, n_days=1,
+                                                               n_episodes=2, n_figures=1)
+    for key, value in benchmark.GIT_ENV.items():
+        monkeypatch.setenv(key, value)
+    monkeypatch.setattr(get_submodules, "REVEAL_JS_COMMIT", reveal_commit)
+    monkeypatch.chdir(site)
+
+    with benchmark.FakeGitHub(git_dir) as github:
+        options = ["--workers", "2", "--no-cache", "--cache-dir", str(tmp_path / "cache"), "--api-url", github.url,
+                   "--git-url", f"file://{git_dir}"]
+        if sparse:
+            options.append("--sparse")
+        get_submodules.get_submodules(get_submodules.load_config(), get_submodules.parse_args(options))
+
+    clones = [command for command in git_commands if command[0] == "clone"]
+    assert len(clones) == N_LESSONS + 1
+    assert sum("reveal.js.git" in arg for command in clones for arg in command) == 1
+    assert not [command for command in git_commands if command[:2] == ["submodule", "update"]]
+    for n in range(N_LESSONS):
+        assert (site / "submodules" / f"lesson-{n}" / "setup.md").is_file()
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_branch_moved_after_resolving(tmp_path, monkeypatch, sparse):
+    git_dir, site, reveal_commit = benchmark.make_lesson_repos(tmp_path, n_lessons=1, n_days=1, n_episodes=1,
+                                                               n_figures=1)
+    for key, value in benchmark.GIT_ENV.items():
+        monkeypatch.setenv(key, value)
+    monkeypatch.setattr(get_submodules, "REVEAL_JS_COMMIT", reveal_commit)
+    monkeypatch.chdir(site)
+    repo = git_dir / benchmark.ORG / "lesson-0.git"
+    resolved = []
+    resolve_lesson = get_submodules.resolve_lesson
+
+    def resolve_then_push(*args):
+        # Push a new commit to the branch after the lesson has been resolved
+        lesson = resolve_lesson(*args)
+        resolved.append(lesson["commit"])
+        work = tmp_path / "push"
+        subprocess.run(["git", "clone", "--quiet", "--branch", "gh-pages", str(repo), str(work)], check=True)
+        (work / "setup.md").write_text("moved\n")
+        subprocess.run(["git", "commit", "--quiet", "--all", "--message", "Move"], cwd=work, check=True)
+        subprocess.run(["git", "push", "--quiet", "origin", "gh-pages"], cwd=work, check=True)
+        return lesson
+
+    monkeypatch.setattr(get_submodules, "resolve_lesson", resolve_then_push)
+    cache_dir = tmp_path / "cache"
+    with benchmark.FakeGitHub(git_dir) as github:
+        options = ["--cache-dir", str(cache_dir), "--api-url", github.url, "--git-url", f"file://{git_dir}"]
+        if sparse:
+            options.append("--sparse")
+        get_submodules.get_submodules(get_submodules.load_config(), get_submodules.parse_args(options))
+
+    head = subprocess.run(["git", "rev-parse", "HEAD"], cwd=site / "submodules" / "lesson-0", check=True,
+                          capture_output=True, text=True)
+    assert head.stdout.strip() == resolved[0]
+    assert (site / "submodules" / "lesson-0" / "setup.md").read_text() != "moved\n"